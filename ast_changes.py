@@ -0,0 +1,138 @@
+import ast
+import asyncio
+import os
+import re
+import subprocess
+from concurrent.futures import Executor
+from typing import Dict, List, Optional
+
+import git
+from loguru import logger
+
+from trivial_commits import split_diff_files
+
+# Languages with a parser in the standard library. Other files are left to the LLM.
+ANALYZABLE_EXTENSIONS = {'.py', '.pyi'}
+
+
+def _definitions(source: str) -> Dict[str, str]:
+    """Maps qualified function/class names to a formatting-insensitive dump of their AST."""
+    definitions = {}
+
+    def visit(node, prefix=""):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                if isinstance(child, ast.ClassDef):
+                    # A class only counts as modified for changes outside its methods
+                    body = [stmt for stmt in child.body if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef))]
+                    shell = ast.ClassDef(child.name, child.bases, child.keywords, body, child.decorator_list)
+                    definitions[name] = ast.dump(shell)
+                else:
+                    definitions[name] = ast.dump(child)
+                visit(child, f"{name}.")
+
+    visit(ast.parse(source))
+    return definitions
+
+
+def analyze_python_change(path: str, before: str, after: str) -> Optional[Dict[str, List[str]]]:
+    """
+    Compares the before/after source of one Python file.
+
+    Returns {'added': [...], 'removed': [...], 'modified': [...]} qualified names,
+    or None when either side does not parse. Runs in worker processes.
+    """
+    try:
+        old_defs = _definitions(before) if before else {}
+        new_defs = _definitions(after) if after else {}
+    except (SyntaxError, ValueError):
+        return None
+    return {
+        'added': sorted(new_defs.keys() - old_defs.keys()),
+        'removed': sorted(old_defs.keys() - new_defs.keys()),
+        'modified': sorted(name for name in new_defs.keys() & old_defs.keys() if new_defs[name] != old_defs[name]),
+    }
+
+
+def read_blobs(repo_path: str, specs: List[str]) -> List[str]:
+    """
+    Reads `<revision>:<path>` blobs with a single `git cat-file --batch` process.
+
+    Returns one string per spec, "" when the file does not exist on that side (added or deleted).
+    """
+    if not specs:
+        return []
+    output = subprocess.run(
+        ["git", "cat-file", "--batch"], cwd=repo_path, input="\n".join(specs).encode() + b"\n",
+        stdout=subprocess.PIPE, check=True,
+    ).stdout
+    blobs, offset = [], 0
+    for _ in specs:
+        end = output.index(b"\n", offset)
+        header = output[offset:end].split()
+        offset = end + 1
+        if len(header) != 3:  # "<spec> missing" / "ambiguous"
+            blobs.append("")
+            continue
+        size = int(header[2])
+        blobs.append(output[offset:offset + size].decode(errors="replace"))
+        offset += size + 1
+    return blobs
+
+
+async def analyze_commit(repo: git.Repo, commit_hash: str, diff: str, executor: Optional[Executor] = None) -> dict:
+    """
+    Builds a `code_changes` dict for a commit without the LLM.
+
+    Reads the before/after blobs of changed Python files in one `git cat-file --batch` off the
+    event loop, then parses them in `executor` (a process pool).
+    The result has the same shape as the `code_changes` key of the JSON schema, plus a
+    per-file 'structure' map used by summarize_structure().
+    """
+    files = split_diff_files(diff)
+    analyzable = [file for file in files if os.path.splitext(file.path)[1] in ANALYZABLE_EXTENSIONS]
+    specs = []
+    for file in analyzable:
+        specs += [f"{commit_hash}~1:{file.old_path}", f"{commit_hash}:{file.new_path}"]
+    blobs = await asyncio.to_thread(read_blobs, repo.working_dir, specs)
+    loop = asyncio.get_running_loop()
+    jobs = [
+        loop.run_in_executor(executor, analyze_python_change, file.path, blobs[2 * i], blobs[2 * i + 1])
+        for i, file in enumerate(analyzable)
+    ]
+    results = await asyncio.gather(*jobs)
+
+    structure = {file.path: result for file, result in zip(analyzable, results) if result is not None}
+    functions = []
+    for changes in structure.values():
+        functions += [f"{name} (added)" for name in changes['added']]
+        functions += [f"{name} (removed)" for name in changes['removed']]
+        functions += changes['modified']
+    logger.debug(f"Local analysis of {commit_hash}: {len(structure)}/{len(files)} files parsed.")
+    return {
+        'files_changed': [file.path for file in files],
+        'functions_modified': functions,
+        'other_observations': [],
+        'structure': structure,
+    }
+
+
+def summarize_structure(diff: str, code_changes: dict) -> str:
+    """Replaces the hunks of locally analyzed files with a compact structural summary."""
+    structure = code_changes.get('structure', {})
+    sections = re.split(r'(?m)^(?=diff --git )', diff)
+    summarized = []
+    for section in sections:
+        match = re.match(r'diff --git a/.* b/(.*)$', section.split("\n", 1)[0])
+        changes = structure.get(match.group(1)) if match else None
+        if not changes or not any(changes.values()):
+            # Unparsed files and module-level-only edits keep their hunks
+            summarized.append(section)
+            continue
+        lines = [section.split("\n", 1)[0], "# Structural summary (hunks omitted):"]
+        for kind in ('added', 'removed', 'modified'):
+            if changes[kind]:
+                lines.append(f"# {kind}: {', '.join(changes[kind])}")
+        summarized.append("\n".join(lines) + "\n")
+    return "".join(summarized)
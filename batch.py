@@ -0,0 +1,94 @@
+import argparse
+import json
+from typing import List, Tuple
+
+# Options a manifest line may set per repository (argparse dest names); the rest apply to the whole batch
+REPO_OPTIONS = {
+    "range", "incremental", "max_count", "since", "until", "author", "path", "clone_depth", "shallow_since",
+    "trivial_rules", "no_dedup", "cherry_pick_note", "ast_analysis", "max_file_bytes", "max_file_lines",
+    "max_diff_bytes", "refs", "priority",
+}
+LIST_OPTIONS = {"author", "path", "refs"}  # Repeatable flags; a manifest may give one value or a list
+
+
+class ManifestEntry:
+    """One repository of a batch: a path or URL and its option overrides."""
+
+    def __init__(self, repo: str, options: dict = None):
+        self.repo = repo
+        self.options = options or {}
+
+    def args(self, defaults: argparse.Namespace) -> argparse.Namespace:
+        """The command-line options with this repository's overrides applied."""
+        return argparse.Namespace(**{**vars(defaults), **self.options})
+
+
+def parse_manifest_line(line: str) -> ManifestEntry:
+    """
+    Parses one manifest line: a bare path/URL, or a JSON object such as
+    {"repo": "https://github.com/user/repo", "since": "2024-01-01", "path": ["src"]}.
+    """
+    if not line.startswith("{"):
+        return ManifestEntry(line)
+    options = json.loads(line)
+    repo = options.pop("repo", None)
+    if not repo:
+        raise ValueError(f"Manifest entry without 'repo': {line}")
+    options = {key.replace("-", "_"): value for key, value in options.items()}
+    unknown = set(options) - REPO_OPTIONS
+    if unknown:
+        raise ValueError(f"Unsupported per-repository options for {repo}: {', '.join(sorted(unknown))}")
+    for key in LIST_OPTIONS & set(options):
+        if isinstance(options[key], str):
+            options[key] = [options[key]]
+    return ManifestEntry(repo, options)
+
+
+def load_manifest(path: str) -> List[ManifestEntry]:
+    """Reads a manifest: one repository per line; blank lines and '#' comments are skipped."""
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    return [parse_manifest_line(line) for line in lines if line and not line.startswith("#")]
+
+
+class BatchResult:
+    """Per-repository outcome of a batch run."""
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.commits = self.generated = self.trivial = self.failed = 0
+        self.seconds = 0.0
+        self.error = None
+
+    def count(self, commits):
+        self.commits = len(commits)
+        self.trivial = sum(1 for commit in commits if commit.trivial_rule)
+        self.failed = sum(1 for commit in commits if not commit.new_message)
+        self.generated = self.commits - self.trivial - self.failed
+
+    def __str__(self):
+        if self.error:
+            return f"{self.repo}: failed after {self.seconds:.1f}s ({self.error})"
+        return (f"{self.repo}: {self.commits} commits, {self.generated} generated, {self.trivial} trivial, "
+                f"{self.failed} failed in {self.seconds:.1f}s")
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """argparse type for --shard: "i/N" (1-based) -> (i - 1, N)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not between 1 and {count}")
+    return index - 1, count
+
+
+def shard_label(shard: Tuple[int, int]) -> str:
+    return f"{shard[0] + 1}/{shard[1]}"
+
+
+def in_shard(commit_hash: str, shard: Tuple[int, int]) -> bool:
+    """Deterministic partition by object id, so any machine computes the same split without coordination."""
+    index, count = shard
+    return int(commit_hash, 16) % count == index
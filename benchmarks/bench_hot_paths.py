@@ -0,0 +1,83 @@
+"""
+Micro-benchmarks for the per-commit CPU hot paths (requires pytest-benchmark).
+
+Not collected by the default test run. Compare with a base commit on the same machine, or with the
+committed baseline in .benchmarks/ (fails on a 15% median regression):
+
+    benchmarks/compare.sh --base main
+    benchmarks/compare.sh
+"""
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+from loguru import logger
+
+from benchmarks.corpora import KB, MB, make_diff, make_fenced_text, make_llm_response, make_log
+from main import (
+    _split_diff_intelligently,
+    _split_text_aggressively,
+    _split_text_at_boundaries,
+    check_json_schema,
+    filter_diff,
+    parse_commit_log,
+)
+
+pytest.importorskip("pytest_benchmark")
+
+DIFF_SIZES = {"small": 4 * KB, "medium": 256 * KB, "10mb": 10 * MB}
+
+
+@pytest.fixture(autouse=True, scope="module")
+def quiet_logger():
+    """Benchmark the code, not the log sink."""
+    logger.disable("main")
+    yield
+    logger.enable("main")
+
+
+@pytest.fixture(scope="module", params=DIFF_SIZES, ids=list(DIFF_SIZES))
+def diff(request):
+    return make_diff(DIFF_SIZES[request.param])
+
+
+@pytest.fixture(scope="module", params=DIFF_SIZES, ids=list(DIFF_SIZES))
+def fenced_text(request):
+    return make_fenced_text(DIFF_SIZES[request.param])
+
+
+def test_filter_diff(benchmark, diff):
+    filtered = benchmark(filter_diff, diff)
+    assert "venv/" not in filtered
+
+
+def test_split_text_at_boundaries(benchmark, fenced_text):
+    chunks = benchmark(_split_text_at_boundaries, fenced_text)
+    assert "".join(chunks) == fenced_text
+
+
+def test_split_diff_intelligently(benchmark, diff):
+    chunks = benchmark(_split_diff_intelligently, diff)
+    assert chunks
+
+
+def test_split_text_aggressively(benchmark, diff):
+    chunks = benchmark(lambda: list(_split_text_aggressively(diff)))
+    assert chunks[-1].endswith(diff[-10:])
+
+
+@pytest.mark.parametrize("lines", [1_000, 100_000], ids=["1k", "100k"])
+def test_parse_commit_log(benchmark, lines):
+    log_output = make_log(lines)
+    commits = benchmark(parse_commit_log, log_output, MagicMock())
+    assert len(commits) == lines
+
+
+@pytest.mark.parametrize("valid", [True, False], ids=["valid", "truncated"])
+def test_check_json_schema(benchmark, valid):
+    response = make_llm_response(valid)
+    loop = asyncio.new_event_loop()
+    try:
+        assert benchmark(lambda: loop.run_until_complete(check_json_schema(response, None))) is valid
+    finally:
+        loop.close()
@@ -0,0 +1,36 @@
+#!/bin/bash
+# Fails when a hot-path micro-benchmark's median is more than 15% slower than a baseline.
+#   benchmarks/compare.sh --base REF   benchmark REF and then this tree back to back, on this machine
+#   benchmarks/compare.sh              compare with the committed .benchmarks/<machine>/0001_baseline.json
+#   benchmarks/compare.sh --save       replace the committed baseline after an intended change
+# Timings only compare on the same hardware, so CI uses --base (and only reports, since runners are noisy).
+
+set -e
+cd "$(dirname "$0")/.."
+BENCH=(python -m pytest benchmarks/bench_hot_paths.py -q -o addopts="")
+FAIL=--benchmark-compare-fail=median:15%
+
+if [ "$1" = "--save" ]; then
+    rm -f .benchmarks/*/*_baseline.json
+    exec "${BENCH[@]}" --benchmark-save=baseline
+fi
+
+if [ "$1" = "--base" ]; then
+    if ! git rev-parse --verify --quiet "$2^{commit}" >/dev/null; then
+        echo "No base commit '$2' to compare against; skipping"
+        exit 0
+    fi
+    base=$(mktemp -d)
+    trap 'git worktree remove --force "$base"' EXIT
+    git worktree add --quiet --detach "$base" "$2"
+    if [ ! -f "$base/benchmarks/bench_hot_paths.py" ]; then
+        echo "$2 has no hot-path benchmarks; skipping"
+        exit 0
+    fi
+    storage="file://$base/.benchmarks-base"
+    (cd "$base" && "${BENCH[@]}" --benchmark-storage="$storage" --benchmark-save=base)
+    "${BENCH[@]}" --benchmark-storage="$storage" --benchmark-compare=0001 "$FAIL"
+    exit
+fi
+
+exec "${BENCH[@]}" --benchmark-compare=0001 "$FAIL"
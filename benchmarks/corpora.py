@@ -0,0 +1,74 @@
+import json
+import random
+
+KB = 1024
+MB = 1024 * KB
+
+
+def make_diff(size: int, seed: int = 0) -> str:
+    """A realistic multi-file unified diff of roughly `size` characters, including ignored sections."""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    file_index = 0
+    while total < size:
+        file_index += 1
+        roll = rng.random()
+        if roll < 0.1:
+            path = f"venv/lib/site-packages/pkg_{file_index}/module.py"
+        elif roll < 0.15:
+            path = f"assets/image_{file_index}.png"
+        else:
+            path = f"src/package_{file_index % 17}/module_{file_index}.py"
+        lines = [
+            f"diff --git a/{path} b/{path}",
+            f"index {rng.getrandbits(28):07x}..{rng.getrandbits(28):07x} 100644",
+            f"--- a/{path}",
+            f"+++ b/{path}",
+        ]
+        if path.endswith(".png"):
+            lines.append(f"Binary files a/{path} and b/{path} differ")
+        for hunk in range(rng.randint(1, 4)):
+            lines.append(f"@@ -{hunk * 40 + 1},12 +{hunk * 40 + 1},14 @@ def function_{hunk}(self):")
+            for _ in range(rng.randint(5, 40)):
+                prefix = rng.choice(" +-")
+                lines.append(f"{prefix}    result_{rng.randrange(1000)} = compute(value, {rng.randrange(10**6)})")
+        section = "\n".join(lines) + "\n"
+        parts.append(section)
+        total += len(section)
+    return "".join(parts)
+
+
+def make_fenced_text(size: int, seed: int = 0) -> str:
+    """Text with ``` code fences, the boundaries _split_text_at_boundaries looks for."""
+    diff = make_diff(size, seed)
+    sections = diff.split("diff --git ")
+    return "".join(f"Change {i}:\n```diff\ndiff --git {section}```\n" for i, section in enumerate(sections) if section)
+
+
+def make_log(lines: int, seed: int = 0) -> str:
+    """`git log --pretty=format:%H,%P,%an <%ae>,%ad,%s` output with `lines` commits."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(lines):
+        parents = " ".join(f"{rng.getrandbits(160):040x}" for _ in range(2 if i % 50 == 0 else 1))
+        rows.append(
+            f"{rng.getrandbits(160):040x},{parents},Dev {i % 37} <dev{i % 37}@example.com>,2024-01-{i % 28 + 1:02d},"
+            f"fix(parser): handle edge case {i}, with commas, in subject"
+        )
+    return "\n".join(rows)
+
+
+def make_llm_response(valid: bool = True) -> str:
+    """A typical LLM JSON answer (or a truncated one)."""
+    text = json.dumps({
+        "short_analysis": "Refactors the parser and adds edge-case handling.",
+        "new_commit_title": "refactor(parser): handle empty input",
+        "new_detailed_commit_message": "- Return early on empty input\n- Add tests for edge cases",
+        "code_changes": {
+            "files_changed": [f"src/module_{i}.py" for i in range(10)],
+            "functions_modified": [f"function_{i}" for i in range(20)],
+            "other_observations": ["No behavior change for non-empty input"],
+        },
+    })
+    return text if valid else text[: len(text) // 2]
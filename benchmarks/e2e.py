@@ -0,0 +1,120 @@
+"""
+End-to-end throughput benchmark: synthetic repo + fake LLM server + the real pipeline.
+
+    python -m benchmarks.e2e --commits 500 --latency 0.2 --malformed-rate 0.05 --json report.json
+    python -m benchmarks.e2e --commits 200 -- --ast-analysis prefill --no-dedup
+
+Arguments after `--` are passed to the OCDG command line (see `python main.py --help`).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from loguru import logger
+
+from benchmarks.fake_llm_server import FakeLLMServer
+from benchmarks.synthetic_repo import generate_repo
+from clients import create_client
+from config import load_configuration
+from main import GitAnalyzer, build_arg_parser, generate_messages
+from metrics import prompt_cache_hit_rate
+from tracing import tracer
+
+
+def _peak_rss_mb(who) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024  # ru_maxrss is in KiB on Linux
+
+
+async def run_benchmark(repo_path: str, server: FakeLLMServer, provider: str = "ollama", ocdg_args=()) -> dict:
+    """Runs generation over `repo_path` against `server` and returns the measurements."""
+    os.environ.setdefault("NVIDIA_API_KEY", "benchmark")
+    config = load_configuration(provider)
+    config["OLLAMA_HOST"] = server.url
+    config["OPENAI_BASE_URL"] = f"{server.url}/v1"
+    args = build_arg_parser().parse_args([repo_path, "-l", provider, *ocdg_args])
+    client = create_client(provider, config)
+    if not tracer.enabled:
+        tracer.configure(None)
+
+    start = time.perf_counter()
+    analyzer = GitAnalyzer(repo_path)
+    with tracer.span("get_commits"):
+        commits = analyzer.get_commits()
+    await generate_messages(commits, analyzer, client, args)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "commits": len(commits),
+        "messages": sum(1 for commit in commits if commit.new_message),
+        "seconds": round(elapsed, 3),
+        "commits_per_second": round(len(commits) / elapsed, 2) if elapsed else None,
+        "llm_calls": server.requests,
+        "llm_calls_per_commit": round(server.requests / len(commits), 3) if commits else 0,
+        "llm_errors": server.stats["error"],
+        "llm_malformed": server.stats["malformed"],
+        "prompt_chars": server.prompt_chars,
+        "prompt_cache_hit_rate": None if prompt_cache_hit_rate() is None else round(prompt_cache_hit_rate(), 3),
+        "peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_child_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "stage_seconds": {stage: round(sum(values) / 1000, 3) for stage, values in sorted(tracer.durations.items())},
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{key:<22}{value}" for key, value in report.items() if key != "stage_seconds"]
+    lines.append("stage seconds (summed over concurrent commits):")
+    lines += [f"  {stage:<20}{seconds}" for stage, seconds in report["stage_seconds"].items()]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    ocdg_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    argv = argv[:argv.index("--")] if "--" in argv else argv
+
+    parser = argparse.ArgumentParser(description="End-to-end OCDG throughput benchmark.")
+    parser.add_argument("--commits", type=int, default=200, help="Commits in the synthetic repository.")
+    parser.add_argument("--median-diff-lines", type=int, default=40, help="Median changed lines per commit.")
+    parser.add_argument("--binary-ratio", type=float, default=0.05, help="Share of commits adding binary files.")
+    parser.add_argument("--vendored-ratio", type=float, default=0.05, help="Share of commits adding node_modules noise.")
+    parser.add_argument("--merge-every", type=int, default=25, help="Merge a side branch every N commits (0 disables).")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency per request in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency up to this many seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500.")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of requests answered with bad JSON.")
+    parser.add_argument("--provider", choices=["ollama", "openai"], default="ollama", help="Client to benchmark.")
+    parser.add_argument("--repo", help="Reuse an existing repository instead of generating one.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="FILE", help="Also write the report as JSON for cross-version comparison.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Keep OCDG INFO logging.")
+    options = parser.parse_args(argv)
+
+    if not options.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+    workdir = tempfile.mkdtemp(prefix="ocdg-bench-")
+    repo_path = options.repo or generate_repo(
+        os.path.join(workdir, "repo"), options.commits, options.seed, options.median_diff_lines,
+        binary_ratio=options.binary_ratio, vendored_ratio=options.vendored_ratio, merge_every=options.merge_every,
+    )
+    server = FakeLLMServer(options.latency, options.jitter, options.error_rate, options.malformed_rate,
+                           options.seed).start()
+    os.chdir(workdir)  # Keep client log files out of the source tree
+    try:
+        report = asyncio.run(run_benchmark(os.path.abspath(repo_path), server, options.provider, ocdg_args))
+    finally:
+        server.stop()
+    print(format_report(report))
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
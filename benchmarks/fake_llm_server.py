@@ -0,0 +1,116 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VALID_RESPONSE = {
+    "short_analysis": "Synthetic change",
+    "new_commit_title": "refactor: update synthetic module values",
+    "new_detailed_commit_message": "- Update computed values\n- Extend module constants",
+}
+MALFORMED_RESPONSE = '{"short_analysis": "Synthetic change", "new_commit_title": "refactor: upd'
+
+
+class FakeLLMServer:
+    """
+    Serves `/api/generate`, `/api/chat` (Ollama) and `/v1/chat/completions` (OpenAI).
+
+    Each request sleeps `latency` seconds (plus up to `jitter`), then fails with HTTP 500
+    with probability `error_rate` or returns truncated JSON with probability `malformed_rate`.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self.prompt_chars = 0
+        self.seen_system_prompts = set()
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def _outcome(self) -> str:
+        with self.lock:
+            roll = self.rng.random()
+            jitter = self.rng.random() * self.jitter
+        time.sleep(self.latency + jitter)
+        if roll < self.error_rate:
+            return "error"
+        if roll < self.error_rate + self.malformed_rate:
+            return "malformed"
+        return "ok"
+
+    def _usage(self, messages: list) -> dict:
+        """OpenAI-style usage; a system prompt seen before counts as cached, like a provider prompt cache."""
+        system = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        with self.lock:
+            cached = len(system) // 4 if system in self.seen_system_prompts else 0
+            self.seen_system_prompts.add(system)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached}}
+
+    def start(self) -> 'FakeLLMServer':
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                outcome = fake._outcome()
+                with fake.lock:
+                    fake.stats[outcome] += 1
+                    fake.stats[self.path] += 1
+                    fake.prompt_chars += len(json.dumps(request))
+                if outcome == "error":
+                    return self._reply(500, {"error": "synthetic failure"})
+                text = MALFORMED_RESPONSE if outcome == "malformed" else json.dumps(VALID_RESPONSE)
+                model = request.get("model", "fake")
+                if self.path == "/api/generate":
+                    body = {"model": model, "created_at": "2024-01-01T00:00:00Z", "response": text, "done": True}
+                elif self.path == "/api/chat":
+                    body = {"model": model, "created_at": "2024-01-01T00:00:00Z", "done": True,
+                            "message": {"role": "assistant", "content": text}}
+                elif self.path == "/v1/chat/completions":
+                    body = {"id": "fake", "object": "chat.completion", "created": 0, "model": model,
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": text}}],
+                            "usage": fake._usage(request.get("messages", []))}
+                else:
+                    return self._reply(404, {"error": f"unknown path {self.path}"})
+                self._reply(200, body)
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    @property
+    def requests(self) -> int:
+        return self.stats["ok"] + self.stats["error"] + self.stats["malformed"]
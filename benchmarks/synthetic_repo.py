@@ -0,0 +1,89 @@
+import os
+import random
+import subprocess
+from typing import Dict, List
+
+
+class _FastImportStream:
+    """Accumulates a fast-import stream in memory."""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.mark = 0
+        self.timestamp = 1_600_000_000
+
+    def data(self, payload: bytes):
+        self.parts.append(b"data %d\n" % len(payload) + payload + b"\n")
+
+    def commit(self, ref: str, message: str, files: Dict[str, bytes], parents: List[int]) -> int:
+        self.mark += 1
+        self.timestamp += 3600
+        self.parts.append(f"commit {ref}\nmark :{self.mark}\n".encode())
+        self.parts.append(f"committer Bench <bench@example.com> {self.timestamp} +0000\n".encode())
+        self.data(message.encode())
+        if parents:
+            self.parts.append(f"from :{parents[0]}\n".encode())
+        for parent in parents[1:]:
+            self.parts.append(f"merge :{parent}\n".encode())
+        for path, content in files.items():
+            self.parts.append(f"M 100644 inline {path}\n".encode())
+            self.data(content)
+        return self.mark
+
+
+def _source_lines(rng: random.Random, count: int) -> List[str]:
+    return [f"value_{rng.randrange(10**6)} = compute({rng.randrange(1000)}, '{rng.randrange(10**9):x}')"
+            for _ in range(count)]
+
+
+def generate_repo(
+    path: str,
+    commits: int = 100,
+    seed: int = 0,
+    median_diff_lines: int = 40,
+    diff_lines_sigma: float = 1.0,
+    binary_ratio: float = 0.05,
+    vendored_ratio: float = 0.05,
+    merge_every: int = 25,
+    source_files: int = 20,
+) -> str:
+    """
+    Creates a repository at `path` with `commits` commits on main (merge commits included).
+
+    Diff sizes follow a log-normal distribution around `median_diff_lines`; a share of
+    commits add binary blobs or vendored (node_modules) noise; every `merge_every`
+    commits a short side branch is merged back. Returns the repository path.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    subprocess.run(["git", "init", "-q", "-b", "main", path], check=True)
+
+    stream = _FastImportStream()
+    contents = {f"src/module_{i}.py": _source_lines(rng, 20) for i in range(source_files)}
+    tip = stream.commit("refs/heads/main", "initial", {p: "\n".join(c).encode() for p, c in contents.items()}, [])
+
+    for index in range(1, commits):
+        if merge_every and index % merge_every == 0:
+            side = stream.commit(f"refs/heads/side-{index}", f"side change {index}",
+                                 {f"side/file_{index}.py": "\n".join(_source_lines(rng, 10)).encode()}, [tip])
+            tip = stream.commit("refs/heads/main", f"Merge branch 'side-{index}'", {}, [tip, side])
+            continue
+
+        changed = {}
+        lines = max(1, int(rng.lognormvariate(0, diff_lines_sigma) * median_diff_lines))
+        for file_path in rng.sample(sorted(contents), k=min(len(contents), rng.randint(1, 3))):
+            body = contents[file_path]
+            for _ in range(lines // 2):
+                body[rng.randrange(len(body))] = _source_lines(rng, 1)[0]
+            body.extend(_source_lines(rng, lines - lines // 2))
+            changed[file_path] = "\n".join(body).encode()
+        roll = rng.random()
+        if roll < binary_ratio:
+            changed[f"assets/image_{index}.png"] = rng.randbytes(rng.randint(1_000, 50_000))
+        elif roll < binary_ratio + vendored_ratio:
+            changed[f"node_modules/pkg_{index}/index.js"] = "\n".join(_source_lines(rng, 500)).encode()
+        tip = stream.commit("refs/heads/main", f"commit {index}", changed, [tip])
+
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=path, input=b"".join(stream.parts), check=True)
+    subprocess.run(["git", "reset", "-q", "--hard", "main"], cwd=path, check=True)
+    return path
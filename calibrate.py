@@ -0,0 +1,164 @@
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Sequence
+
+from loguru import logger
+
+from config import CALIBRATION_CONCURRENCY, CALIBRATION_SIZES, CALIBRATION_REQUESTS, CALIBRATION_MAX_ERROR_RATE, \
+    CALIBRATION_REQUEST_TIMEOUT, CALIBRATION_TIMEOUT_FACTOR
+from metrics import LLM_RETRIES
+from tracing import percentile
+
+Send = Callable[[str], Awaitable[str]]  # Sends one prompt built around a diff; raises on failure
+KNEE_GAIN = 1.1  # A higher concurrency must add 10% throughput, or the ladder stops climbing
+MIN_TIMEOUT = 10  # Seconds; floor for the recommended timeout
+
+
+def synthetic_diff(size: int, seed: int = 0) -> str:
+    """A unified diff of `size` characters; each seed gives different text, so no provider cache can answer it."""
+    rng = random.Random(seed)
+    parts, total, index = [], 0, 0
+    while total < size:
+        index += 1
+        path = f"src/package_{index % 7}/module_{index}.py"
+        lines = [f"diff --git a/{path} b/{path}", f"--- a/{path}", f"+++ b/{path}",
+                 f"@@ -{index * 10},20 +{index * 10},24 @@ def handler_{index}(request):"]
+        lines += [f"{rng.choice('+- ')}    value_{rng.randrange(1000)} = compute(request, {rng.randrange(10 ** 6)})"
+                  for _ in range(20)]
+        section = "\n".join(lines) + "\n"
+        parts.append(section)
+        total += len(section)
+    return "".join(parts)[:size]
+
+
+class StepResult:
+    """One rung of the ladder: prompts of `size` diff characters sent `concurrency` at a time."""
+
+    def __init__(self, concurrency: int, size: int):
+        self.concurrency = concurrency
+        self.size = size
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.retries = 0  # Attempts the clients' retry_with_backoff hid from us
+        self.seconds = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        attempts = len(self.latencies) + self.errors + self.retries
+        return (self.errors + self.retries) / attempts if attempts else 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Successful requests per second of wall time."""
+        return len(self.latencies) / self.seconds if self.seconds else 0.0
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.latencies) and self.error_rate <= CALIBRATION_MAX_ERROR_RATE
+
+    def percentile(self, percent: float) -> float:
+        return percentile(sorted(self.latencies), percent) if self.latencies else math.inf
+
+    def as_dict(self) -> dict:
+        return {"concurrency": self.concurrency, "size": self.size, "requests": len(self.latencies) + self.errors,
+                "errors": self.errors, "retries": self.retries, "throughput": round(self.throughput, 3),
+                "p50": round(self.percentile(50), 3), "p95": round(self.percentile(95), 3),
+                "max": round(max(self.latencies, default=math.inf), 3)}
+
+    def __str__(self):
+        return (f"concurrency {self.concurrency}, {self.size} chars: {self.throughput:.2f} req/s, "
+                f"p50 {self.percentile(50):.2f}s, p95 {self.percentile(95):.2f}s, "
+                f"{self.errors} errors, {self.retries} retries")
+
+
+async def run_step(send: Send, concurrency: int, size: int, requests: int, seed: int = 0) -> StepResult:
+    """Sends `requests` distinct synthetic prompts, at most `concurrency` in flight."""
+    step = StepResult(concurrency, size)
+    semaphore = asyncio.Semaphore(concurrency)
+    retries_before = LLM_RETRIES.get(function="async_generate_text")
+
+    async def one(index: int):
+        diff = synthetic_diff(size, seed + index)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(send(diff), CALIBRATION_REQUEST_TIMEOUT)
+                step.latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                step.errors += 1
+                logger.debug(f"Calibration request failed ({concurrency} x {size} chars): {e!r}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    step.seconds = time.perf_counter() - start
+    step.retries = int(LLM_RETRIES.get(function="async_generate_text") - retries_before)
+    return step
+
+
+async def calibrate(send: Send, concurrencies: Sequence[int] = CALIBRATION_CONCURRENCY,
+                    sizes: Sequence[int] = CALIBRATION_SIZES, requests_per_slot: int = CALIBRATION_REQUESTS) -> dict:
+    """
+    Climbs a ladder of synthetic requests and returns a recommended profile.
+
+    First concurrency rises at the smallest size until errors appear or throughput stops
+    growing; the best level becomes `concurrency`. Then the prompt size rises at that level;
+    the largest size without errors becomes `chunk_size`. `timeout` is a multiple of the
+    slowest request seen at that size. Every step is kept in the profile for reference.
+    """
+    steps: List[StepResult] = []
+    error_onset = None
+
+    async def climb(concurrency: int, size: int) -> StepResult:
+        step = await run_step(send, concurrency, size, concurrency * requests_per_slot, seed=len(steps) * 10_000)
+        steps.append(step)
+        logger.info(f"Calibration step {len(steps)}: {step}")
+        return step
+
+    best = None
+    for concurrency in concurrencies:
+        step = await climb(concurrency, sizes[0])
+        if not step.ok:
+            error_onset = {"concurrency": concurrency, "size": sizes[0]}
+            break
+        if best and step.throughput < best.throughput * KNEE_GAIN:
+            break  # Past the knee: more requests in flight only queue at the provider
+        best = step
+    if best is None:
+        raise RuntimeError(f"Provider failed the first calibration step: {steps[0]}")
+
+    chosen = best
+    for size in sizes[1:]:
+        step = await climb(best.concurrency, size)
+        if not step.ok:
+            error_onset = error_onset or {"concurrency": best.concurrency, "size": size}
+            break
+        chosen = step
+
+    return {
+        "concurrency": best.concurrency,
+        "chunk_size": chosen.size,
+        "timeout": max(MIN_TIMEOUT, math.ceil(max(chosen.latencies) * CALIBRATION_TIMEOUT_FACTOR)),
+        "throughput": round(best.throughput, 3),
+        "error_onset": error_onset,
+        "calibrated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "steps": [step.as_dict() for step in steps],
+    }
+
+
+def save_profile(path: str, key: str, profile: dict):
+    """Stores `profile` under `key` ("provider/model") in the JSON file load_configuration reads."""
+    profiles = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles = json.load(f)
+    profiles[key] = profile
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
+        f.write("\n")
+    logger.info(f"Saved calibration for {key} to {path}: concurrency {profile['concurrency']}, "
+                f"chunk size {profile['chunk_size']}, timeout {profile['timeout']}s")
@@ -0,0 +1,79 @@
+import re
+from collections import Counter
+from typing import Any, Awaitable, Callable, Optional
+
+from loguru import logger
+
+from config import CASCADE_MAX_SMALL_DIFF_CHARS, CASCADE_MAX_TITLE_LENGTH
+
+CONVENTIONAL_TITLE_PATTERN = re.compile(
+    r'^(feat|fix|docs|style|refactor|perf|test|build|ci|chore|revert)(\([^)]+\))?!?: \S'
+)
+
+
+def check_message_quality(message: Optional[str]) -> Optional[str]:
+    """Cheap checks on a generated message. Returns the failure reason, or None if it passes."""
+    if not message:
+        return "invalid_json"
+    title = message.splitlines()[0].strip()
+    if len(title) > CASCADE_MAX_TITLE_LENGTH:
+        return "title_too_long"
+    if not CONVENTIONAL_TITLE_PATTERN.match(title):
+        return "not_conventional"
+    return None
+
+
+class ModelCascade:
+    """
+    Two-tier generation: a small, fast model first and a large model only on escalation.
+
+    A commit escalates when its diff is too large for the small model, when the small
+    model returns no valid JSON, or when its message fails check_message_quality.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[..., Awaitable[Optional[str]]],
+        small_client: Any,
+        small_model: str,
+        large_client: Any,
+        large_model: str,
+        max_small_diff_chars: int = CASCADE_MAX_SMALL_DIFF_CHARS,
+    ):
+        self.generate = generate
+        self.small_client = small_client
+        self.small_model = small_model
+        self.large_client = large_client
+        self.large_model = large_model
+        self.max_small_diff_chars = max_small_diff_chars
+        self.small_count = 0
+        self.escalations = Counter()
+
+    async def generate_commit_description(self, diff: str, old_description: str, code_changes: dict = None) -> Optional[str]:
+        """Generates a commit description, escalating to the large model when needed."""
+        if len(diff) > self.max_small_diff_chars:
+            reason = "large_diff"
+        else:
+            message = await self.generate(
+                diff, old_description, self.small_client, self.small_model, code_changes=code_changes
+            )
+            reason = check_message_quality(message)
+            if reason is None:
+                self.small_count += 1
+                return message
+
+        self.escalations[reason] += 1
+        logger.info(f"Escalating to large model ({self.large_model}): {reason}")
+        return await self.generate(
+            diff, old_description, self.large_client, self.large_model, code_changes=code_changes
+        )
+
+    def summary(self) -> str:
+        """One-line cascade statistics for the end-of-run log."""
+        escalated = sum(self.escalations.values())
+        total = self.small_count + escalated
+        reasons = ", ".join(f"{reason}={count}" for reason, count in sorted(self.escalations.items()))
+        return (
+            f"Cascade: {self.small_count}/{total} commits finished on small model, "
+            f"{escalated} escalated" + (f" ({reasons})" if reasons else "")
+        )
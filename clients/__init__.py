@@ -1,17 +1,46 @@
-from .openai_client import OpenAIClient
-from .groq_client import GroqClient
-from .replicate_client import ReplicateClient
-from .ollama_client import OllamaClient
+import importlib
+
 from .base_client import Client
 
-def create_client(client_type: str, config: dict) -> Client:
-    """Creates and returns an instance of the specified client type."""
-    clients = {
-        "openai": lambda: OpenAIClient(config.get('NVIDIA_API_KEY')),
-        "groq": lambda: GroqClient(config.get('GROQ_API_KEY')),
-        "replicate": lambda: ReplicateClient(config.get('REPLICATE_API_KEY')),  # Add REPLICATE_API_KEY to config
-        "ollama": lambda: OllamaClient()
-    }
-    if client_type not in clients:
+# Provider SDKs are slow to import, so client modules load on first use.
+# name -> (module, class, factory building the client from the configuration)
+PROVIDERS = {
+    "openai": ("clients.openai_client", "OpenAIClient",
+               lambda cls, config: cls(config.get('NVIDIA_API_KEY'), config.get('OPENAI_BASE_URL'),
+                                       prompt_cache_key=config.get('OPENAI_PROMPT_CACHE_KEY', False),
+                                       timeout=config.get('LLM_TIMEOUT'))),
+    "groq": ("clients.groq_client", "GroqClient",
+             lambda cls, config: cls(config.get('GROQ_API_KEY'), timeout=config.get('LLM_TIMEOUT'))),
+    "replicate": ("clients.replicate_client", "ReplicateClient",
+                  lambda cls, config: cls(config.get('REPLICATE_API_KEY'))),  # Add REPLICATE_API_KEY to config
+    "ollama": ("clients.ollama_client", "OllamaClient",
+               lambda cls, config: cls(host=config.get('OLLAMA_HOST'), keep_alive=config.get('OLLAMA_KEEP_ALIVE'),
+                                       timeout=config.get('LLM_TIMEOUT'))),
+    "replay": ("clients.replay_client", "ReplayClient",
+               lambda cls, config: cls(config.get('REPLAY_FILE'), latency=float(config.get('REPLAY_LATENCY') or 0))),
+}
+_CLASSES = {class_name: module for module, class_name, _ in PROVIDERS.values()}
+# The model each client sends to when -m is not given
+DEFAULT_MODELS = {"openai": "meta/llama3-70b-instruct", "ollama": "llama3"}
+
+
+def _load_class(module: str, class_name: str) -> type:
+    return getattr(importlib.import_module(module), class_name)
+
+
+def __getattr__(name):
+    """Keeps `from clients import OpenAIClient` working without importing every SDK up front."""
+    if name in _CLASSES:
+        return _load_class(_CLASSES[name], name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def create_client(client_type: str, config: dict, model: str = None) -> Client:
+    """Creates and returns an instance of the specified client type, sending to `model` if given."""
+    if client_type not in PROVIDERS:
         raise ValueError(f"Invalid client type: {client_type}")
-    return clients[client_type]()
+    module, class_name, factory = PROVIDERS[client_type]
+    client = factory(_load_class(module, class_name), config)
+    if model:
+        client.model = model
+    return client
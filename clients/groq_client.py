@@ -2,13 +2,15 @@ from groq import Groq, AsyncGroq
 from clients.base_client import Client
 from loguru import logger
 from retry_utils import retry_with_backoff
+from metrics import record_llm_request, record_prompt_usage
 
 
 class GroqClient(Client):
-    def __init__(self, api_key):
+    def __init__(self, api_key, timeout=None):
         super().__init__(api_key)
-        self.client = Groq(api_key=api_key)
-        self.async_client = AsyncGroq(api_key=api_key)
+        timeout_kwargs = {"timeout": timeout} if timeout else {}  # Otherwise the SDK default
+        self.client = Groq(api_key=api_key, **timeout_kwargs)
+        self.async_client = AsyncGroq(api_key=api_key, **timeout_kwargs)
 
     @retry_with_backoff(max_retries=3, exceptions=(Exception,))
     def generate_text(self, prompt, **kwargs):
@@ -19,6 +21,7 @@ class GroqClient(Client):
         return chat_completion.choices[0].message.content
 
     @retry_with_backoff(max_retries=3, exceptions=(Exception,))
+    @record_llm_request("groq")
     async def async_generate_text(self, system_prompt, prompt, **kwargs):
         logger.info("Sending async request to Groq API...")
         logger.debug(f"Prompt: {prompt}")
@@ -31,6 +34,7 @@ class GroqClient(Client):
             **kwargs
         )
         logger.info("Groq API async response received.")
+        record_prompt_usage("groq", chat_completion.usage)
         text_content = chat_completion.choices[0].message.content.strip()
         logger.debug(f"Generated text: {text_content[:50]}...")
         return text_content
\ No newline at end of file
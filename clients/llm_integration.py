@@ -1,22 +1,26 @@
+import functools
 import os
 import traceback
 
-from langchain_core.messages import SystemMessage, HumanMessage
 from loguru import logger
 
-from langchain_nvidia_ai_endpoints import ChatNVIDIA
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.prompts import ChatPromptTemplate
 # from commit_message_generator import generate_commit_message_prefix
 
 # Replace with your API key and model name
 API_KEY = "YOUR_API_KEY"
 MODEL_NAME = "meta/llama3-70b-instruct"
 
-llm = ChatNVIDIA(model=MODEL_NAME, api_key=API_KEY)
+
+@functools.lru_cache(maxsize=None)
+def get_llm():
+    """Builds the ChatNVIDIA model on first use; langchain is slow to import."""
+    from langchain_nvidia_ai_endpoints import ChatNVIDIA
+    return ChatNVIDIA(model=MODEL_NAME, api_key=API_KEY)
+
 
 def split_diff(diff, chunk_size=1500, chunk_overlap=200):
     """Splits a large diff into smaller chunks with overlap."""
+    from langchain.text_splitter import CharacterTextSplitter
     text_splitter = CharacterTextSplitter(
         separator="\n", chunk_size=chunk_size, chunk_overlap=chunk_overlap
     )
@@ -25,6 +29,8 @@ def split_diff(diff, chunk_size=1500, chunk_overlap=200):
 
 def generate_prompt(diff_chunk, old_description, is_partial=False):
     """Generates a prompt for Llama 3 based on diff chunk and old description."""
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_core.messages import SystemMessage, HumanMessage
     # prefix = generate_commit_message_prefix(old_description)
     prompt_template = ChatPromptTemplate.from_messages(
         [
@@ -43,6 +49,9 @@ def generate_prompt(diff_chunk, old_description, is_partial=False):
 
 def generate_commit_description(history):
     """Generates a commit description for a potentially large diff."""
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_core.messages import SystemMessage, HumanMessage
+    llm = get_llm()
     logger.info(f'history.get_oldest_commit.diff: {history.get_oldest_commit().diff[:100]}')
     logger.info(f'history.get_oldest_commit.description: {history.get_oldest_commit().message}')
     logger.info(f'delete oldest_commit: {history.get_oldest_commit().delete()}')
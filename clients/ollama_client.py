@@ -10,13 +10,16 @@ from ollama import Client as OllClient
 from config import COMMIT_MESSAGES_LOG_FILE, GENERATED_MESSAGES_LOG_FILE
 from loguru import logger
 from retry_utils import retry_with_backoff
+from metrics import record_llm_request
 
 
 class OllamaClient(Client):
-    def __init__(self, api_key='ollama'):
+    def __init__(self, api_key='ollama', host=None, keep_alive=None, timeout=None):
         super().__init__(api_key)
-        self.host = 'http://localhost:11434'
-        self.timeout = 30
+        self.host = host or 'http://localhost:11434'
+        # Keeps the model, and with it the KV cache of the shared system prompt, loaded between requests
+        self.keep_alive = keep_alive
+        self.timeout = timeout or 30
         self.client = OllClient(
             host=self.host,
             timeout=self.timeout,  # Set a timeout (in seconds)
@@ -28,6 +31,7 @@ class OllamaClient(Client):
         self.model = 'llama3'
 
     @retry_with_backoff(max_retries=3, exceptions=(ollama.ResponseError, ollama.RequestError))
+    @record_llm_request("ollama")
     async def async_generate_text(self, system_prompt, prompt, **kwargs):
         logger.info(f"Sending request to Ollama API (model: {self.model})...")
         response = await self.async_client.generate(
@@ -35,6 +39,7 @@ class OllamaClient(Client):
             prompt=prompt,
             system=system_prompt,
             format='json',
+            keep_alive=self.keep_alive,
             **kwargs
         )
         logger.info("Ollama API response received.")
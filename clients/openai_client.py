@@ -1,3 +1,4 @@
+import hashlib
 import os
 import openai
 
@@ -6,21 +7,24 @@ from clients.base_client import Client
 from openai import OpenAI, AsyncOpenAI
 from loguru import logger
 from retry_utils import retry_with_backoff
+from metrics import record_llm_request, record_prompt_usage
 
 
 class OpenAIClient(Client):
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=None, prompt_cache_key=False, timeout=None):
         super().__init__(api_key)
+        self.prompt_cache_key = prompt_cache_key  # Route requests sharing a system prompt to the same cache
         nvidia_key = os.getenv('NVIDIA_API_KEY', api_key)
+        base_url = base_url or "https://integrate.api.nvidia.com/v1"  # NVIDIA API base URL
         self.client = OpenAI(
-            base_url="https://integrate.api.nvidia.com/v1",  # NVIDIA API base URL
+            base_url=base_url,
             api_key=nvidia_key,
-            timeout=10,  # Set a timeout (in seconds)
+            timeout=timeout or 10,  # Set a timeout (in seconds)
         )
         self.async_client = AsyncOpenAI(
-            base_url="https://integrate.api.nvidia.com/v1",
+            base_url=base_url,
             api_key=nvidia_key,
-            timeout=10,
+            timeout=timeout or 10,
         )
         self.model = "meta/llama3-70b-instruct"  # Default model
 
@@ -40,10 +44,14 @@ class OpenAIClient(Client):
         return text_content
 
     @retry_with_backoff(max_retries=3, exceptions=(openai.APIError, openai.RateLimitError, openai.APIConnectionError))
+    @record_llm_request("openai")
     async def async_generate_text(self, system_prompt, prompt, **kwargs):
         logger.info(f"Sending async request to OpenAI API (model: {self.model})...")
         logger.debug(f"Prompt: {prompt}")
         logger.debug(f"Additional parameters: {kwargs}")
+        if self.prompt_cache_key:
+            cache_key = hashlib.sha256(system_prompt.encode()).hexdigest()[:32]
+            kwargs.setdefault("extra_body", {}).setdefault("prompt_cache_key", cache_key)
         response = await self.async_client.chat.completions.create(
             model=self.model,
             messages=[
@@ -53,6 +61,7 @@ class OpenAIClient(Client):
             **kwargs
         )
         logger.info("OpenAI API async response received.")
+        record_prompt_usage("openai", response.usage)
         logger.debug(f"Full response: {response}")
         text_content = response.choices[0].message.content.strip()
         logger.debug(f"Generated text: {text_content[:50]}...")
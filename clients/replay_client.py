@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+from clients.base_client import Client
+from loguru import logger
+from metrics import record_llm_request
+
+
+class ReplayMissError(LookupError):
+    """Raised when a replayed run sends a request that was never recorded."""
+
+
+def request_key(system_prompt, prompt, **kwargs) -> str:
+    """Stable key for a request: sha256 over the prompts and any extra generation parameters."""
+    payload = json.dumps([system_prompt, prompt, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ReplayClient(Client):
+    """
+    Records or replays LLM responses through a JSONL file of {"key", "response"} lines.
+
+    With `upstream`, every request is forwarded and the response appended to `path`.
+    Without it, responses are served from `path` after `latency` seconds; a request seen
+    several times gets its recorded responses in order, then the last one again, so
+    retries after malformed JSON replay exactly.
+    """
+
+    def __init__(self, path: str, upstream: Client = None, latency: float = 0.0):
+        super().__init__(api_key=None)
+        self.path = path
+        self.upstream = upstream
+        self.latency = latency
+        self.responses = defaultdict(list)
+        self.served = defaultdict(int)
+        if upstream is None:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Replay file not found: {path}")
+            self._load()
+        self.model = getattr(upstream, "model", "replay")
+
+    def __setattr__(self, name, value):
+        # Keep the recorded model in step when callers pick a model on the client
+        if name == "model" and getattr(self, "upstream", None) is not None:
+            self.upstream.model = value
+        super().__setattr__(name, value)
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[record["key"]].append(record["response"])
+        logger.info(f"Loaded {sum(map(len, self.responses.values()))} recorded responses from {self.path}")
+
+    def _record(self, key: str, response: str):
+        self.responses[key].append(response)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"key": key, "response": response}) + "\n")
+
+    def _lookup(self, key: str) -> str:
+        recorded = self.responses.get(key)
+        if not recorded:
+            raise ReplayMissError(f"No recorded response for request {key[:12]} in {self.path}")
+        index = min(self.served[key], len(recorded) - 1)
+        self.served[key] += 1
+        return recorded[index]
+
+    async def async_generate_text(self, system_prompt, prompt, **kwargs):
+        key = request_key(system_prompt, prompt, **kwargs)
+        if self.upstream is not None:
+            response = await self.upstream.async_generate_text(system_prompt, prompt, **kwargs)
+            self._record(key, response)
+            return response
+        return await self._replay(system_prompt, prompt, key=key)
+
+    @record_llm_request("replay")
+    async def _replay(self, system_prompt, prompt, key):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._lookup(key)
+
+    def generate_text(self, prompt, **kwargs):
+        key = request_key(None, prompt, **kwargs)
+        if self.upstream is not None:
+            response = self.upstream.generate_text(prompt, **kwargs)
+            self._record(key, response)
+            return response
+        return self._lookup(key)
@@ -2,6 +2,7 @@ import replicate
 from clients.base_client import Client
 from loguru import logger
 from retry_utils import retry_with_backoff
+from metrics import record_llm_request
 
 
 class ReplicateClient(Client):
@@ -25,6 +26,7 @@ class ReplicateClient(Client):
         return text_content
 
     @retry_with_backoff(max_retries=3, exceptions=(Exception,))
+    @record_llm_request("replicate")
     async def async_generate_text(self, system_prompt, prompt, **kwargs):
         logger.info("Sending async request to Replicate API...")
         logger.debug(f"Prompt: {prompt}")
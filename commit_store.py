@@ -0,0 +1,177 @@
+import sqlite3
+import sys
+from typing import Iterable, Iterator, List, Optional, Union
+
+import git
+from loguru import logger
+
+Oid = Union[bytes, str]
+
+
+def encode_oid(hash: str) -> Oid:
+    """Stores hex object ids as raw bytes (20 for SHA-1); anything else is kept as given."""
+    try:
+        return bytes.fromhex(hash)
+    except ValueError:
+        return hash
+
+
+def decode_oid(oid: Oid) -> str:
+    return oid.hex() if isinstance(oid, bytes) else oid
+
+
+class Commit:
+    """Represents a single commit's metadata. Diffs are fetched on demand and never stored."""
+
+    __slots__ = ("_oid", "author", "date", "message", "repo", "_parents", "new_message", "trivial_rule")
+
+    def __init__(self, hash: str, author: str, date: str, message: str, repo: git.Repo, parents: List[str] = None):
+        self._oid = encode_oid(hash)
+        self.author = sys.intern(author)  # Few distinct authors across a long history
+        self.date = date
+        self.message = message
+        self.repo = repo
+        self.parents = parents
+        self.new_message = None
+        self.trivial_rule = None
+
+    @property
+    def hash(self) -> str:
+        return decode_oid(self._oid)
+
+    @hash.setter
+    def hash(self, value: str):
+        self._oid = encode_oid(value)
+
+    @property
+    def oid(self) -> Oid:
+        return self._oid
+
+    @property
+    def parents(self) -> Optional[List[str]]:
+        return None if self._parents is None else [decode_oid(parent) for parent in self._parents]
+
+    @parents.setter
+    def parents(self, value: Optional[List[str]]):
+        self._parents = None if value is None else tuple(encode_oid(parent) for parent in value)
+
+    def __str__(self):
+        """Returns a string representation of the Commit object."""
+        return f"Commit(hash={self.hash}, author={self.author}, date={self.date}, message={self.message})"
+
+    def get_diff(self):
+        """Fetches the diff for this commit."""
+        return self.repo.git.diff(f"{self.hash}~1", f"{self.hash}")
+
+
+class CommitHistory:
+    """Manages a collection of Commit objects, indexed by object id."""
+
+    def __init__(self):
+        self._commits: List[Commit] = []
+        self._index = {}
+
+    @property
+    def commits(self) -> List[Commit]:
+        return self._commits
+
+    @commits.setter
+    def commits(self, commits: Iterable[Commit]):
+        self._commits = []
+        self._index = {}
+        self.extend(commits)
+
+    def extend(self, commits: Iterable[Commit]):
+        for commit in commits:
+            self._index[commit.oid] = len(self._commits)
+            self._commits.append(commit)
+
+    def get_oldest_commit(self) -> Optional[Commit]:
+        """Returns the oldest commit in the history."""
+        return self._commits[0] if self._commits else None
+
+    def get_commit(self, commit_hash: str) -> Optional[Commit]:
+        """Retrieves a specific commit by its hash."""
+        index = self._index.get(encode_oid(commit_hash))
+        return None if index is None else self._commits[index]
+
+
+class _StoredCommits:
+    """Read-only sequence over an SQLite commit table; rows become Commit objects on access."""
+
+    def __init__(self, store: 'SQLiteCommitStore'):
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store.db.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+
+    def __getitem__(self, index: int) -> Commit:
+        if index < 0:
+            index += len(self)
+        row = self.store.db.execute(f"{self.store.SELECT} WHERE position = ?", (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return self.store.row_to_commit(row)
+
+    def __iter__(self) -> Iterator[Commit]:
+        for row in self.store.db.execute(f"{self.store.SELECT} ORDER BY position"):
+            yield self.store.row_to_commit(row)
+
+
+class SQLiteCommitStore(CommitHistory):
+    """
+    CommitHistory kept in an SQLite file instead of memory.
+
+    Only the commit being worked on is materialized; `commits` iterates rows in order.
+    Assigning `commits` replaces the stored history, generated messages included.
+    """
+
+    SELECT = "SELECT oid, author, date, message, parents, new_message, trivial_rule FROM commits"
+
+    def __init__(self, path: str, repo: git.Repo = None):
+        self.path = path
+        self.repo = repo
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS commits (position INTEGER PRIMARY KEY, oid BLOB UNIQUE NOT NULL,"
+            " author TEXT, date TEXT, message TEXT, parents TEXT, new_message TEXT, trivial_rule TEXT)"
+        )
+
+    @property
+    def commits(self) -> _StoredCommits:
+        return _StoredCommits(self)
+
+    @commits.setter
+    def commits(self, commits: Iterable[Commit]):
+        with self.db:
+            self.db.execute("DELETE FROM commits")
+        self.extend(commits)
+
+    def extend(self, commits: Iterable[Commit]):
+        start = len(self.commits)
+        rows = (
+            (start + offset, commit.oid, commit.author, commit.date, commit.message,
+             None if commit.parents is None else " ".join(commit.parents), commit.new_message, commit.trivial_rule)
+            for offset, commit in enumerate(commits)
+        )
+        with self.db:
+            self.db.executemany("INSERT INTO commits VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        logger.info(f"Stored {len(self.commits)} commits in {self.path}")
+
+    def row_to_commit(self, row) -> Commit:
+        oid, author, date, message, parents, new_message, trivial_rule = row
+        commit = Commit(decode_oid(oid), author, date, message, self.repo,
+                        parents=None if parents is None else parents.split())
+        commit.new_message = new_message
+        commit.trivial_rule = trivial_rule
+        return commit
+
+    def get_oldest_commit(self) -> Optional[Commit]:
+        return self.commits[0] if len(self.commits) else None
+
+    def get_commit(self, commit_hash: str) -> Optional[Commit]:
+        row = self.db.execute(f"{self.SELECT} WHERE oid = ?", (encode_oid(commit_hash),)).fetchone()
+        return None if row is None else self.row_to_commit(row)
+
+    def close(self):
+        self.db.close()
@@ -1,18 +1,32 @@
+import json
 import os
 from dotenv import load_dotenv
 
 
 
-def load_configuration(llm_choice='ollama'):
+def load_configuration(llm_choice='ollama', model=None):
     load_dotenv()
     config = {
         'GROQ_API_KEY': os.getenv('GROQ_API_KEY'),
         'NVIDIA_API_KEY': os.getenv('NVIDIA_API_KEY'),
         'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY'),
         'REPLICATE_API_TOKEN': os.getenv('REPLICATE_API_TOKEN'),
-        'COMMIT_DIFF_DIRECTORY': 'commit_diff'
+        'OLLAMA_HOST': os.getenv('OLLAMA_HOST', 'http://localhost:11434'),
+        'OPENAI_BASE_URL': os.getenv('OPENAI_BASE_URL', 'https://integrate.api.nvidia.com/v1'),
+        'OLLAMA_KEEP_ALIVE': os.getenv('OLLAMA_KEEP_ALIVE', '30m'),
+        'OPENAI_PROMPT_CACHE_KEY': os.getenv('OPENAI_PROMPT_CACHE_KEY', '').lower() in ('1', 'true', 'yes'),
+        'REPLAY_FILE': os.getenv('OCDG_REPLAY_FILE', 'llm_replay.jsonl'),
+        'REPLAY_LATENCY': os.getenv('OCDG_REPLAY_LATENCY', '0'),
+        'COMMIT_DIFF_DIRECTORY': 'commit_diff',
+        'CALIBRATION_FILE': os.getenv('OCDG_CALIBRATION_FILE', CALIBRATION_FILE),
     }
 
+    # Tuning measured by 'main.py calibrate'; None means the client's or splitter's built-in default
+    profile = load_calibration(config['CALIBRATION_FILE'], llm_choice, model)
+    config['MAX_CONCURRENT_REQUESTS'] = profile.get('concurrency', MAX_CONCURRENT_REQUESTS)
+    config['CHUNK_SIZE'] = profile.get('chunk_size')
+    config['LLM_TIMEOUT'] = profile.get('timeout')
+
     # Validate required API keys based on LLM choice
     if llm_choice == 'openai' and not config['NVIDIA_API_KEY']:
         raise ValueError("NVIDIA_API_KEY required for OpenAI client")
@@ -25,9 +39,28 @@ def load_configuration(llm_choice='ollama'):
     return config
 
 
+def calibration_key(llm_choice, model=None):
+    return f"{llm_choice}/{model}" if model else llm_choice
+
+
+def load_calibration_profiles(path):
+    """All saved profiles, {"provider/model": profile}."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_calibration(path, llm_choice, model=None):
+    """The saved profile for `llm_choice` and `model` (else for the provider alone), or {}."""
+    profiles = load_calibration_profiles(path)
+    return profiles.get(calibration_key(llm_choice, model)) or profiles.get(llm_choice) or {}
+
+
 COMMIT_MESSAGES_LOG_FILE = "commit_messages.log"
 GENERATED_MESSAGES_LOG_FILE = "generated_messages.log"
-MAX_CONCURRENT_REQUESTS = 4  # Adjust this value based on Ollama's capacity
+MAX_CONCURRENT_REQUESTS = 4  # Default when no calibration profile applies (see 'main.py calibrate')
+CALIBRATION_FILE = "ocdg_calibration.json"  # Profiles per provider/model, written by 'main.py calibrate'
 IGNORED_SECTION_PATTERNS = {
     r'venv.*',  # Ignore any path containing 'venv'
     r'.idea.*',  # Ignore any path containing '.idea'
@@ -46,3 +79,48 @@ IGNORED_LINE_PATTERNS = {
     r'(package-lock\.json|poetry\.lock|yarn\.lock|Gemfile\.lock)',
     r'.*\.(err|stderr|stdout|log)$', r'.*\.(cache|cached)$'
 }
+
+# Rule-based fast path for commits that do not need an LLM (see trivial_commits.py).
+# Remove a rule name to always send that kind of commit to the LLM.
+TRIVIAL_COMMIT_RULES = {'merge', 'empty', 'lockfile', 'version_bump', 'rename', 'whitespace'}
+LOCKFILE_PATTERNS = {
+    r'(^|/)(package-lock\.json|npm-shrinkwrap\.json|yarn\.lock|pnpm-lock\.yaml)$',
+    r'(^|/)(poetry\.lock|Pipfile\.lock|uv\.lock|Gemfile\.lock|Cargo\.lock|composer\.lock|go\.sum)$',
+}
+VERSION_FILE_PATTERNS = {
+    r'(^|/)(pyproject\.toml|setup\.py|setup\.cfg|package\.json|Cargo\.toml|version\.py|__init__\.py)$',
+    r'(^|/)(VERSION|version\.txt|CHANGELOG\.md)$',
+}
+VERSION_LINE_PATTERN = r'^\s*["\']?(__version__|version|VERSION)["\']?\s*[:=]\s*["\']?v?\d+(\.\d+)+|^\s*v?\d+(\.\d+)+\s*$'
+
+# Two-tier model cascade (see cascade.py)
+CASCADE_MAX_SMALL_DIFF_CHARS = 16000  # Larger filtered diffs go straight to the large model
+CASCADE_MAX_TITLE_LENGTH = 72  # Prompt asks for 50; escalate only past git's 72-char convention
+
+# Large-diff guard (see diff_budget.py); 0 disables a budget
+DIFF_MAX_FILE_BYTES = 256 * 1024  # Larger file patches are replaced by a one-line summary
+DIFF_MAX_FILE_LINES = 5000  # Same for files with more changed lines
+DIFF_MAX_TOTAL_BYTES = 1024 * 1024  # Hard cap on the diff read per commit
+
+# Process-pool offload (--cpu-workers, see cpu_offload.py)
+CPU_OFFLOAD_MIN_CHARS = 64 * 1024  # Smaller diffs are filtered on the event loop; pool round trips cost more
+SHARED_MEMORY_MIN_BYTES = 256 * 1024  # Offloaded diffs this large go through /dev/shm; below DIFF_MAX_TOTAL_BYTES
+
+# Batch mode (--manifest, see batch.py)
+BATCH_GIT_CONCURRENCY = 4  # Repositories cloned/enumerated at once; LLM requests share MAX_CONCURRENT_REQUESTS
+MESSAGE_MAP_FILE = "ocdg_messages.jsonl"
+
+# Ref snapshots taken before rewrites (see ref_snapshots.py)
+REF_SNAPSHOT_KEEP = 10  # Kept after each new snapshot, and by 'main.py snapshots prune' unless --keep says otherwise
+
+# Provider calibration ladder ('main.py calibrate', see calibrate.py)
+CALIBRATION_CONCURRENCY = (1, 2, 4, 8, 16)  # Tried in order at CALIBRATION_SIZES[0]; stops past the throughput knee
+CALIBRATION_SIZES = (2000, 4000, 7900, 16000, 32000)  # Diff characters per prompt, tried at the chosen concurrency
+CALIBRATION_REQUESTS = 2  # Requests per step, per concurrent slot
+CALIBRATION_MAX_ERROR_RATE = 0.05  # Errors and retries above this share mark a step as failed
+CALIBRATION_REQUEST_TIMEOUT = 300  # Seconds; generous so slow steps show up as latency, not errors
+CALIBRATION_TIMEOUT_FACTOR = 3  # Recommended timeout: this multiple of the worst latency seen at the chosen step
+
+# Run planner and budgets (--plan, --token-budget, --time-budget; see planner.py)
+PLAN_COMPLETION_TOKENS = 400  # Expected completion tokens per request (analysis, title, detailed message)
+PLAN_SECONDS_PER_REQUEST = 10.0  # Latency assumed per request for profiles without calibration steps
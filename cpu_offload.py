@@ -0,0 +1,63 @@
+import asyncio
+import os
+import tempfile
+from concurrent.futures import Executor
+from typing import IO, Optional, Set, Tuple, Union
+
+from config import SHARED_MEMORY_MIN_BYTES
+from diff_filter import prepare_diff
+
+# tmpfs-backed files rather than multiprocessing.shared_memory: before Python 3.13 the resource
+# tracker of a pool worker that attaches to a segment unlinks it as "leaked" when the worker exits.
+SHARED_MEMORY_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+Payload = Union[bytes, Tuple[str, int]]
+
+
+def available_cores() -> int:
+    """Cores this process may run on (respects CPU affinity, unlike os.cpu_count)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_workers(value: str) -> int:
+    """argparse type for --cpu-workers: a count, or 'auto' for one per available core."""
+    return available_cores() if value == "auto" else int(value)
+
+
+def _pack(text: str) -> Tuple[Payload, Optional[IO[bytes]]]:
+    """Encodes `text` once; large payloads go through shared memory instead of the pool's pipe."""
+    data = text.encode("utf-8", errors="surrogateescape")
+    if len(data) < SHARED_MEMORY_MIN_BYTES:
+        return data, None
+    shared = tempfile.NamedTemporaryFile(dir=SHARED_MEMORY_DIR, prefix="ocdg-diff-")
+    shared.write(data)
+    shared.flush()
+    return (shared.name, len(data)), shared
+
+
+def _unpack(payload: Payload) -> str:
+    if isinstance(payload, bytes):
+        return payload.decode("utf-8", errors="surrogateescape")
+    path, size = payload
+    with open(path, "rb") as f:
+        return f.read(size).decode("utf-8", errors="surrogateescape")
+
+
+def _prepare_diff(payload: Payload, message: str, parents, is_initial: bool, trivial_rules: Set[str]):
+    return prepare_diff(_unpack(payload), message, parents, is_initial, trivial_rules)
+
+
+async def prepare_diff_in_pool(executor: Executor, diff: str, message: str, parents, is_initial: bool,
+                               trivial_rules: Set[str]):
+    """Runs diff_filter.prepare_diff (filter + trivial rules) in `executor` without blocking the event loop."""
+    payload, shared = _pack(diff)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, _prepare_diff, payload, message, parents, is_initial, trivial_rules
+        )
+    finally:
+        if shared:
+            shared.close()  # Deletes the file
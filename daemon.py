@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+
+DEFAULT_SOCKET = os.environ.get("OCDG_SOCKET") or os.path.join(tempfile.gettempdir(), f"ocdg-{os.getuid()}.sock")
+MAX_REQUEST_BYTES = 16 * 1024 * 1024  # One JSON line per request; hooks cap the diff well below this
+CACHE_SIZE = 256  # Suggestions kept for repeated requests (e.g. commit aborted and retried)
+
+Handler = Callable[[dict], Awaitable[dict]]
+
+
+class SuggestionCache:
+    """LRU of responses keyed by the request content."""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def key(request: dict) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        return None
+
+    def put(self, key: str, response: dict):
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+class SuggestionServer:
+    """
+    Serves `handler` over a Unix socket: each connection sends one JSON request line and
+    gets one JSON response line. The process stays up, so clients and models stay warm.
+    """
+
+    def __init__(self, handler: Handler, socket_path: str = DEFAULT_SOCKET, cache: SuggestionCache = None):
+        self.handler = handler
+        self.socket_path = socket_path
+        self.cache = cache or SuggestionCache()
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left behind by a daemon that did not shut down cleanly
+        self.server = await asyncio.start_unix_server(self._serve, self.socket_path, limit=MAX_REQUEST_BYTES)
+        os.chmod(self.socket_path, 0o600)  # The diff of whoever connects is sent to the LLM
+        logger.info(f"Listening on {self.socket_path}")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            key = SuggestionCache.key(request)
+            response = self.cache.get(key)
+            if response is None:
+                response = await self.handler(request)
+                if "error" not in response:
+                    self.cache.put(key, response)
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            response = {"error": str(e)}
+        try:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass  # The hook gave up waiting; the suggestion stays cached for a retry
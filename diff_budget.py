@@ -0,0 +1,214 @@
+import subprocess
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from config import DIFF_MAX_FILE_BYTES, DIFF_MAX_FILE_LINES, DIFF_MAX_TOTAL_BYTES
+
+NULL_OID = "0" * 40
+BINARY_PATCH_BYTES = 100  # Without --binary, git prints one "Binary files ... differ" line
+ESTIMATED_LINE_BYTES = 80  # Patch bytes per changed line of a modified file; read_capped bounds misses
+CONTEXT_LINES = 6  # Hunk header and context around a typical change
+MAX_PATHSPECS = 1000  # Paths per git invocation, well under command line limits
+OMITTED_PATCH_MARKER = "# Patch omitted"  # Starts the stand-in line of a file whose patch was not fetched
+
+
+class FileStat:
+    """Size of one file's change, from `git diff --raw --numstat` and blob sizes."""
+
+    __slots__ = ("path", "added", "removed", "binary", "old_size", "new_size")
+
+    def __init__(self, path: str, added: int, removed: int, binary: bool, old_size: int = 0, new_size: int = 0):
+        self.path = path
+        self.added = added
+        self.removed = removed
+        self.binary = binary
+        self.old_size = old_size
+        self.new_size = new_size
+
+    @property
+    def lines(self) -> int:
+        return self.added + self.removed
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Expected patch size: the whole blob for added or deleted files, changed lines otherwise."""
+        if self.binary:
+            return BINARY_PATCH_BYTES
+        if not self.old_size or not self.new_size:
+            return self.old_size + self.new_size
+        return min(self.old_size + self.new_size, (self.lines + CONTEXT_LINES) * ESTIMATED_LINE_BYTES)
+
+    def summary(self) -> str:
+        """Stand-in diff section for a file whose patch is not fetched."""
+        size = "binary" if self.binary else f"+{self.added} -{self.removed} lines"
+        return (f"diff --git a/{self.path} b/{self.path}\n"
+                f"{OMITTED_PATCH_MARKER} ({size}, {self.new_size or self.old_size} bytes; over the diff budget)")
+
+
+def _git(repo_path: str, args: List[str], input: str = None) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=repo_path, input=input, capture_output=True, text=True,
+                              check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Git command failed: {e.stderr}") from e
+
+
+def parse_raw_numstat(output: str) -> Tuple[List[FileStat], Dict[str, Tuple[str, str]]]:
+    """Parses `git diff --raw --numstat -z --no-renames --no-abbrev` into (stats, {path: (old blob, new blob)})."""
+    fields = output.split("\0")
+    blobs: Dict[str, Tuple[str, str]] = {}
+    stats: List[FileStat] = []
+    i = 0
+    while i < len(fields) and fields[i]:
+        field = fields[i]
+        if field.startswith(":"):  # ":oldmode newmode oldsha newsha status" then the path
+            _, _, old_oid, new_oid, _ = field[1:].split(" ")
+            blobs[fields[i + 1]] = (old_oid, new_oid)
+            i += 2
+        else:  # "added\tremoved\tpath"
+            added, removed, path = field.split("\t", 2)
+            binary = added == "-"
+            stats.append(FileStat(path, 0 if binary else int(added), 0 if binary else int(removed), binary))
+            i += 1
+    return stats, blobs
+
+
+def _blob_sizes(repo_path: str, oids) -> Dict[str, int]:
+    sizes = {NULL_OID: 0}
+    oids = set(oids) - {NULL_OID}
+    if oids:
+        output = _git(repo_path, ["cat-file", "--batch-check=%(objectname) %(objectsize)"], "\n".join(oids) + "\n")
+        for line in output.splitlines():
+            oid, size = line.split(" ")[:2]
+            sizes[oid] = int(size) if size.isdigit() else 0  # Submodule commits report "missing"
+    return sizes
+
+
+def commit_file_stats(repo_path: str, base: str, commit_hash: str) -> List[FileStat]:
+    """Sizes every file changed between `base` and `commit_hash` without reading any patch."""
+    output = _git(repo_path, ["diff", "--raw", "--numstat", "-z", "--no-renames", "--no-abbrev", base, commit_hash])
+    stats, blobs = parse_raw_numstat(output)
+    sizes = _blob_sizes(repo_path, (oid for pair in blobs.values() for oid in pair))
+    for stat in stats:
+        old_oid, new_oid = blobs.get(stat.path, (NULL_OID, NULL_OID))
+        stat.old_size, stat.new_size = sizes.get(old_oid, 0), sizes.get(new_oid, 0)
+    return stats
+
+
+def commits_file_stats(repo_path: str, hashes: List[str]) -> Dict[str, List[FileStat]]:
+    """
+    Sizes the changes of many commits against their parent with one `git diff-tree --stdin` and
+    one blob size lookup. Merges (diff-tree prints nothing for them) map to an empty list.
+    """
+    output = _git(repo_path, ["diff-tree", "--stdin", "-r", "--raw", "--numstat", "-z", "--no-renames", "--no-abbrev",
+                              "--root"], "".join(f"{commit_hash}\n" for commit_hash in hashes))
+    sections: Dict[str, List[str]] = {commit_hash: [] for commit_hash in hashes}
+    fields = output.split("\0")
+    current, i = None, 0
+    while i < len(fields):
+        field = fields[i]
+        if field.startswith(":"):  # Raw record: the path is the next field and may look like anything
+            sections[current] += fields[i:i + 2]
+            i += 2
+            continue
+        if field in sections:  # Commit header
+            current = field
+        elif field:
+            sections[current].append(field)
+        i += 1
+    parsed = {commit_hash: parse_raw_numstat("\0".join(section + [""])) for commit_hash, section in sections.items()}
+    sizes = _blob_sizes(repo_path, (oid for _, blobs in parsed.values() for pair in blobs.values() for oid in pair))
+    stats = {}
+    for commit_hash, (commit_stats, blobs) in parsed.items():
+        for stat in commit_stats:
+            old_oid, new_oid = blobs.get(stat.path, (NULL_OID, NULL_OID))
+            stat.old_size, stat.new_size = sizes.get(old_oid, 0), sizes.get(new_oid, 0)
+        stats[commit_hash] = commit_stats
+    return stats
+
+
+def plan_diff(
+    stats: List[FileStat],
+    max_file_bytes: int = DIFF_MAX_FILE_BYTES,
+    max_file_lines: int = DIFF_MAX_FILE_LINES,
+    max_total_bytes: int = DIFF_MAX_TOTAL_BYTES,
+) -> Tuple[List[FileStat], List[FileStat]]:
+    """
+    Splits files into (fetched, omitted).
+
+    A file is omitted when it alone exceeds the byte or line budget, or when the
+    files before it (in git's order) have used up the total budget. A budget of 0 disables it.
+    """
+    fetched, omitted = [], []
+    total = 0
+    for stat in stats:
+        too_big = (max_file_bytes and stat.estimated_bytes > max_file_bytes) or \
+                  (max_file_lines and stat.lines > max_file_lines)
+        over_total = max_total_bytes and total + stat.estimated_bytes > max_total_bytes
+        if too_big or over_total:
+            omitted.append(stat)
+        else:
+            fetched.append(stat)
+            total += stat.estimated_bytes
+    return fetched, omitted
+
+
+def _pathspec_batches(fetched: List[FileStat], omitted: List[FileStat]) -> List[List[str]]:
+    """Pathspecs selecting the fetched files: everything, an exclude list, or include lists in batches."""
+    if not omitted:
+        return [[]]
+    if len(omitted) <= min(len(fetched), MAX_PATHSPECS):
+        return [["."] + [f":(exclude,literal){stat.path}" for stat in omitted]]
+    paths = [f":(literal){stat.path}" for stat in fetched]
+    return [paths[i:i + MAX_PATHSPECS] for i in range(0, len(paths), MAX_PATHSPECS)]
+
+
+def read_capped(repo_path: str, args: List[str], max_bytes: int) -> str:
+    """Runs a git command and keeps at most `max_bytes` of its output, cut at a line boundary."""
+    process = subprocess.Popen(["git", *args], cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        data = process.stdout.read(max_bytes + 1) if max_bytes else process.stdout.read()
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+    truncated = bool(max_bytes) and len(data) > max_bytes
+    if truncated:
+        data = data[:data.rfind(b"\n", 0, max_bytes) + 1]
+    text = data.decode("utf-8", errors="replace").rstrip("\n")
+    if truncated:
+        text += f"\n# Diff truncated at {max_bytes} bytes (over the diff budget)"
+    return text
+
+
+def budgeted_diff(
+    repo_path: str,
+    base: str,
+    commit_hash: str,
+    max_file_bytes: int = DIFF_MAX_FILE_BYTES,
+    max_file_lines: int = DIFF_MAX_FILE_LINES,
+    max_total_bytes: int = DIFF_MAX_TOTAL_BYTES,
+) -> Tuple[str, List[FileStat]]:
+    """
+    Returns the `base..commit_hash` diff with oversized files replaced by one-line summaries.
+
+    Files are sized first, only the patches that fit are fetched, and the output is
+    hard-capped at `max_total_bytes`, so memory stays bounded even when an estimate is off.
+    Returns (diff, omitted files).
+    """
+    stats = commit_file_stats(repo_path, base, commit_hash)
+    fetched, omitted = plan_diff(stats, max_file_bytes, max_file_lines, max_total_bytes)
+    parts = []
+    remaining = max_total_bytes
+    for pathspecs in _pathspec_batches(fetched, omitted) if fetched else []:
+        part = read_capped(repo_path, ["diff", "--no-color", base, commit_hash, "--", *pathspecs], remaining)
+        parts.append(part)
+        if max_total_bytes:
+            remaining -= len(part.encode())
+            if remaining <= 0:
+                break
+    if omitted:
+        logger.info(f"Omitted {len(omitted)} oversized file(s) from the diff of {commit_hash}")
+        parts += [stat.summary() for stat in omitted]
+    return "\n".join(part for part in parts if part), omitted
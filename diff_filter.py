@@ -0,0 +1,53 @@
+import re
+from typing import List
+
+from loguru import logger
+
+from config import IGNORED_SECTION_PATTERNS, IGNORED_LINE_PATTERNS
+from trivial_commits import classify_trivial_commit
+
+
+def _compile_patterns(patterns) -> re.Pattern:
+    """
+    Compiles search patterns into one alternation. filter_diff runs it on every diff line.
+
+    A leading '.*' is redundant for re.search and makes every pattern quadratic in the
+    line length, so it is dropped.
+    """
+    return re.compile("|".join(f"(?:{pattern.removeprefix('.*')})" for pattern in sorted(patterns)))
+
+
+IGNORED_SECTION_RE = _compile_patterns(IGNORED_SECTION_PATTERNS)  # Matched against 'diff --git' lines
+IGNORED_LINE_RE = _compile_patterns(IGNORED_LINE_PATTERNS)  # Matched against every other line
+
+
+def filter_diff(diff: str) -> str:
+    """Removes unwanted lines from the diff based on file extensions and patterns."""
+    filtered_lines = []
+    skip_section = False  # Flag to skip entire diff sections
+
+    for line in diff.splitlines():
+        # Section-Level Filtering
+        if line.startswith('diff --git '):
+            # Check if the section should be skipped
+            if IGNORED_SECTION_RE.search(line):
+                skip_section = True
+                logger.info(f"Skipping section: {line}")
+                continue # Skip to the next line
+            else:
+                skip_section = False  # Reset the flag for the new section
+                filtered_lines.append(line) # Add the 'diff --git' line if not skipped
+        else:
+            # Only add lines if not skipping the section
+            if not skip_section and not IGNORED_LINE_RE.search(line):
+                filtered_lines.append(line)
+
+    return "\n".join(filtered_lines)
+
+def prepare_diff(diff: str, message: str, parents: List[str], is_initial: bool, trivial_rules) -> tuple:
+    """Filters a diff and classifies it against the trivial rules: (filtered_diff, (rule, message) or None)."""
+    filtered_diff = filter_diff(diff)
+    trivial = classify_trivial_commit(
+        diff, filtered_diff, message, parents, is_initial, trivial_rules
+    ) if trivial_rules else None
+    return filtered_diff, trivial
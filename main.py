@@ -1,24 +1,45 @@
 import argparse
 import asyncio
+import difflib
+import functools
 import json
 import os
+import pydoc
 import re
-import tempfile
-from typing import Any, List, Dict
-from jsonschema import validate, ValidationError
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Dict, Optional, Tuple
 from loguru import logger
 import git
 
-from clients import create_client
-from config import load_configuration, COMMIT_MESSAGES_LOG_FILE, MAX_CONCURRENT_REQUESTS, IGNORED_SECTION_PATTERNS, \
-    IGNORED_LINE_PATTERNS
-
-
-# Global variable to store log file path
-
-# Define file/folder paths and patterns to ignore ENTIRE SECTIONS
+from clients import DEFAULT_MODELS, PROVIDERS, ReplayClient, create_client
+from commit_store import Commit, CommitHistory, SQLiteCommitStore
+from config import load_configuration, COMMIT_MESSAGES_LOG_FILE, MAX_CONCURRENT_REQUESTS, TRIVIAL_COMMIT_RULES, \
+    DIFF_MAX_FILE_BYTES, DIFF_MAX_FILE_LINES, DIFF_MAX_TOTAL_BYTES, CPU_OFFLOAD_MIN_CHARS, BATCH_GIT_CONCURRENCY, \
+    MESSAGE_MAP_FILE, REF_SNAPSHOT_KEEP, CALIBRATION_FILE, \
+    CALIBRATION_CONCURRENCY, CALIBRATION_SIZES, CALIBRATION_REQUESTS, CALIBRATION_REQUEST_TIMEOUT, calibration_key, \
+    load_calibration, load_calibration_profiles
+from diff_filter import filter_diff, prepare_diff
+from patch_dedup import compute_patch_ids, deduplicate_commits, fan_out_messages
+from cascade import ModelCascade
+from diff_budget import budgeted_diff, commits_file_stats
+from cpu_offload import parse_workers, prepare_diff_in_pool
+from remote_repo import clone_or_fetch, clone_path, is_remote_url, shallow_boundary
+from watermark import current_branch, incremental_range, remap_watermarks, write_watermark
+from rewrite import expand_refs, rewrite_messages
+from calibrate import calibrate, save_profile
+from planner import PRIORITIES, Budget, CostModel, default_chunk_size, format_plan, plan_commits, prioritize
+from ref_snapshots import create_snapshot, list_snapshots, prune_snapshots, read_snapshot, restore_snapshot
+from daemon import DEFAULT_SOCKET, SuggestionServer
+from batch import BatchResult, ManifestEntry, in_shard, load_manifest, parse_shard, shard_label
+from message_map import merge_message_maps, read_message_map, write_message_map
+from ast_changes import analyze_commit, summarize_structure
+from tracing import tracer
+from metrics import (CACHE_LOOKUPS, COMMIT_DURATION, COMMITS_PROCESSED, COMMITS_QUEUED, JSON_FAILURES,
+                     JSON_RESPONSES, prompt_cache_hit_rate, start_http_server, start_textfile_exporter,
+                     write_textfile)
 
-# Define file extensions and patterns to ignore
 
 def user_confirms_rewrite(commit_history):
     """Presents the proposed changes to the user and asks for confirmation."""
@@ -46,76 +67,64 @@ class RepositoryUpdater:
     def __init__(self, repo_path: str):
         self.repo_path = repo_path
         self.repo = git.Repo(repo_path)
+        self.snapshot = None
 
-    def backup_refs(self):
-        """Backs up refs using git for-each-ref to a file."""
+    def backup_refs(self) -> str:
+        """
+        Snapshots branches, tags and remote-tracking refs under refs/ocdg/backup/<timestamp>/,
+        keeping the REF_SNAPSHOT_KEEP newest snapshots.
+        """
         try:
-            with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_file:
-                self.refs_backup_file = temp_file.name
-                run_git_command(
-                    [
-                        "for-each-ref",
-                        "--format='%(refname)'",
-                        "refs/heads/",
-                        "refs/remotes/",
-                        "refs/tags/",
-                        ">",
-                        self.refs_backup_file,
-                    ],
-                    self.repo_path,
-                )
-            logger.info("Backed up refs to '.git/refs_backup'")
+            self.snapshot = create_snapshot(self.repo_path)
+            prune_snapshots(self.repo_path, REF_SNAPSHOT_KEEP)
+            return self.snapshot
         except Exception as e:
             logger.error(f"Error backing up refs: {e}")
             raise
 
-    def restore_refs(self):
-        """Restores refs from the backup file."""
+    def restore_refs(self, name: str = None) -> str:
+        """Restores snapshot `name`; by default the one this updater took, else the latest."""
         try:
-            if not hasattr(self, 'refs_backup_file') or not os.path.exists(self.refs_backup_file):
-                logger.warning(
-                    f"Refs backup file not found. Skipping restore."
-                )
-                return
-            run_git_command(
-                ["update-ref", "--stdin", "<", self.refs_backup_file], self.repo_path
-            )
-            logger.info("Restored refs from backup.")
+            return restore_snapshot(self.repo_path, name or self.snapshot)
         except Exception as e:
             logger.error(f"Error restoring refs: {e}")
             raise
-        finally:
-            # Clean up the backup file after restore attempt
-            if hasattr(self, 'refs_backup_file') and os.path.exists(self.refs_backup_file):
-                os.remove(self.refs_backup_file)
 
-    def rewrite_commit_messages(self, commit_history: 'CommitHistory'):
-        """Rewrites commit messages using git rebase -i."""
+    def rewrite_commit_messages(self, commit_history: 'CommitHistory', refs=("HEAD",)) -> Dict[str, str]:
+        """Rewrites commit messages on all `refs` in one pass, without a rebase; returns {old hash: new hash}."""
         try:
-            self.backup_refs()
-
-            # Start an interactive rebase
-            rebase_process = self.repo.git.rebase('-i', f'{commit_history.get_oldest_commit().hash}~1',
-                                                  interactive=True)
-
-            # Construct the rebase instructions based on commit messages
-            rebase_instructions = []
-            for commit in commit_history.commits:
-                if commit.new_message:
-                    rebase_instructions.append(f'reword {commit.hash} {commit.new_message}')
-                else:
-                    rebase_instructions.append(f'pick {commit.hash} {commit.message}')
-
-            # Pass the instructions to the rebase process
-            rebase_process.stdin.write('\n'.join(rebase_instructions))
-            rebase_process.stdin.close()
-
+            if not self.snapshot:
+                self.backup_refs()
+            messages = {commit.hash: commit.new_message for commit in commit_history.commits if commit.new_message}
+            rewritten = rewrite_messages(self.repo_path, messages, refs)
             logger.info("Commit messages rewritten successfully.")
 
         except Exception as e:
             logger.error(f"Error rewriting commit messages: {e}")
             self.restore_refs()  # Attempt restore on error
             raise
+        remap_watermarks(self.repo_path, rewritten)  # Or --incremental would redo everything after the rewrite
+        return rewritten
+
+    def force_push(self, refs=("HEAD",)):
+        """
+        Pushes the `refs` the rewrite moved to origin in one atomic push. Each is leased to its
+        pre-rewrite value from this updater's snapshot, so remote work pushed meanwhile is not
+        overwritten; a bare --force-with-lease has no remote-tracking value to check tags against.
+        """
+        if not self.snapshot:
+            raise RuntimeError("Nothing was rewritten; no snapshot to lease the push against")
+        previous = read_snapshot(self.repo_path, self.snapshot)
+        current = {refname: self.repo.git.rev_parse(refname) for refname in expand_refs(self.repo_path, refs)}
+        if "HEAD" in current:
+            logger.warning("HEAD is detached and has no branch on origin to push to; skipping it")
+            del current["HEAD"]
+        moved = [refname for refname, value in current.items() if previous.get(refname) != value]
+        if not moved:
+            logger.info("No rewritten refs to push")
+            return
+        leases = [f"--force-with-lease={refname}:{previous.get(refname, '')}" for refname in moved]
+        self.repo.git.push(*leases, "--atomic", "origin", *[f"{refname}:{refname}" for refname in moved])
 
     def generate_filter_script(self, commit_history, script_path):
         """Generates the Python script for git filter-branch."""
@@ -145,25 +154,6 @@ if __name__ == "__main__":
             )
 
 
-class CommitHistory:
-    """Manages a collection of Commit objects."""
-
-    def __init__(self):
-        self.commits: List['Commit'] = []
-
-    def get_oldest_commit(self) -> 'Commit':
-        """Returns the oldest commit in the history."""
-        return self.commits[0] if self.commits else None
-
-
-    def get_commit(self, commit_hash: str) -> 'Commit':
-        """Retrieves a specific commit by its hash."""
-        for commit in self.commits:
-            if commit.hash == commit_hash:
-                return commit
-        return None
-
-
 def save_commit_messages_to_log(commit_history: 'CommitHistory'):
     """Saves old and new commit messages to the log file."""
     try:
@@ -177,28 +167,6 @@ def save_commit_messages_to_log(commit_history: 'CommitHistory'):
     except Exception as e:
         logger.error(f"Failed to save commit messages to log file: {e}")
 
-def filter_diff(diff: str) -> str:
-    """Removes unwanted lines from the diff based on file extensions and patterns."""
-    filtered_lines = []
-    skip_section = False  # Flag to skip entire diff sections
-
-    for line in diff.splitlines():
-        # Section-Level Filtering
-        if line.startswith('diff --git '):
-            # Check if the section should be skipped
-            if any(re.search(pattern, line) for pattern in IGNORED_SECTION_PATTERNS):
-                skip_section = True
-                logger.info(f"Skipping section: {line}")
-                continue # Skip to the next line
-            else:
-                skip_section = False  # Reset the flag for the new section
-                filtered_lines.append(line) # Add the 'diff --git' line if not skipped
-        else:
-            # Only add lines if not skipping the section
-            if not skip_section and not any(re.search(pattern, line) for pattern in IGNORED_LINE_PATTERNS):
-                filtered_lines.append(line)
-
-    return "\n".join(filtered_lines)
 
 async def check_json_schema(json_data: str, client: Any) -> bool:
     """Checks if the JSON response from the LLM conforms to a simplified schema."""
@@ -249,8 +217,7 @@ def validate_repo_path(repo_path: str):
 
 def _split_text_at_boundaries(text: str, max_chunk_size: int = 7900) -> List[str]:
     """Splits text into chunks, attempting to break at code block boundaries."""
-    logger.info(f"Splitting text into chunks, attempting to break at code block boundaries...")
-    logger.debug(f"Full text being split: \n{text}\n") # Print the full diff for inspection
+    logger.info(f"Splitting {len(text)} characters into chunks, attempting to break at code block boundaries...")
     try:
 
         # Define a regular expression to find code block boundaries
@@ -276,8 +243,6 @@ def _split_text_at_boundaries(text: str, max_chunk_size: int = 7900) -> List[str
             chunks.append(current_chunk)
 
         logger.info(f"Split text into {len(chunks)} chunks.")
-        for i, chunk in enumerate(chunks):
-            logger.debug(f"Chunk {i+1} size: {len(chunk)} characters")
 
         return chunks
     except Exception as e:
@@ -307,36 +272,25 @@ def _split_diff_intelligently(diff: str, max_chunk_size: int = 7900, min_chunk_s
 
 def _split_text_aggressively(text: str, max_chunk_size: int = 7900, overlap: int = 200) -> str:
     """Yields chunks of text with overlap."""
-    logger.info(f"Splitting text aggressively into chunks of at most {max_chunk_size}"
+    overlap = min(overlap, max_chunk_size // 5)  # The overlap must leave room to make progress
+    logger.info(f"Splitting {len(text)} characters aggressively into chunks of at most {max_chunk_size}"
                 f" characters with {overlap} overlap...")
     try:
         start_index = 0
         while start_index < len(text):
-            logger.info(f"Splitting at index start_index: {start_index}, length: {len(text)}")
             end_index = min(start_index + max_chunk_size, len(text))
-            logger.info(f"Splitting at index end_index: {end_index}")
             yield text[start_index:end_index]
-            logger.info(f"Text: {text[start_index:end_index]}")
-
-            start_index = max(0, end_index - overlap)  # Ensure start_index is not negative
-            logger.info(f'New start index after overlap correction: {start_index}')
+            if end_index == len(text):
+                break
+            start_index = end_index - overlap
     except Exception as e:
         logger.error(f'Error in split text aggressively: {e}')
         raise
 
 
-async def _generate_single_commit_message_json(
-    diff_chunk: str,
-    commit_message: str,
-    client: Any,
-    model: str,
-    chunk_index: int,
-    total_chunks: int,
-) -> Dict[str, str]:
-    """
-    Generates a single commit message in JSON format, handling potential JSON decoding errors.
-    """
-    system_prompt = """
+# System prompts are module constants and go first in every request, so the prefix is byte-identical
+# across commits and chunks and provider prompt caches (Ollama's KV cache, OpenAI prompt caching) can reuse it.
+COMMIT_SYSTEM_PROMPT = """
 ## Role: You are a Git commit message generator.
 ## Goal: Analyze code diffs and produce Conventional Commit messages in JSON.
 
@@ -358,45 +312,104 @@ IMPORTANT: REQUIRED KEYS IN JSON: ['short_analysis', 'new_commit_title', 'new_de
 ## Code Analysis (Required): Note modified lines, new/changed functions/classes, logic changes.
 ## Empty Diffs: Return "No code changes detected" for 'short_analysis' and 'new_commit_title'.  
 """
-    # User Prompt Template
-    user_prompt = f"""
+
+COMBINE_SYSTEM_PROMPT = """
+## Role: You are a Git commit message expert, combining multiple messages into one. 
+## Goal: Create a concise, informative commit message in JSON that adheres to Conventional Commits.
+## Input: Multiple JSON-formatted commit messages (see structure below).
+## Output: A single, combined JSON-formatted commit message.
+
+## JSON Structure (for both input and output):
+```json
+{
+ "short_analysis": "...", 
+ "new_commit_title": "...", 
+ "new_detailed_commit_message": "...", 
+ "code_changes": { 
+  "files_changed": [...], 
+  "functions_modified": [...], 
+  "other_observations": [...] 
+ }}
+```
+IMPORTANT: REQUIRED KEYS IN JSON: ['short_analysis', 'new_commit_title', 'new_detailed_commit_message'].
+
+## Key Points:
+* **Analyze the COMBINED impact of all changes, not just individual messages.**
+* **Be concise and technical. Use bullet points in the detailed message.**
+* **Strictly follow Conventional Commits (<https://www.conventionalcommits.org/>) for the title.**
+"""
+
+
+def _commit_user_prompt(diff_chunk: str, commit_message: str, partial: bool = False) -> str:
+    return f"""
 Analyze this diff and generate a commit message in JSON format.
 Previous commit message: {commit_message}
-Code changes: {'(partial)' if chunk_index != total_chunks - 1 else ''}
+Code changes: {'(partial)' if partial else ''}
 ```
 {diff_chunk}
 ```
+"""
+
+
+async def _generate_single_commit_message_json(
+    diff_chunk: str,
+    commit_message: str,
+    client: Any,
+    model: str,
+    chunk_index: int,
+    total_chunks: int,
+    code_changes: dict = None,
+) -> Dict[str, str]:
+    """
+    Generates a single commit message in JSON format, handling potential JSON decoding errors.
+    """
+    user_prompt = _commit_user_prompt(diff_chunk, commit_message, chunk_index != total_chunks - 1)
+    if code_changes:
+        # Locally computed structure: the model does not need to spend tokens on 'code_changes'
+        user_prompt += f"""
+Files and functions changed (computed locally, omit 'code_changes' from your answer):
+{json.dumps({key: code_changes[key] for key in ('files_changed', 'functions_modified')})}
 """
     try:
         is_valid_json = False
         count = 0
         while is_valid_json is False and count < 3:
-            chat_completion = await client.async_generate_text(system_prompt, user_prompt)
+            with tracer.span("llm_request", kind="chunk",
+                             prompt_chars=len(COMMIT_SYSTEM_PROMPT) + len(user_prompt)) as span:
+                chat_completion = await client.async_generate_text(COMMIT_SYSTEM_PROMPT, user_prompt)
+                span["completion_chars"] = len(chat_completion or "")
             is_valid_json = await check_json_schema(chat_completion, client)
+            JSON_RESPONSES.inc(outcome="valid" if is_valid_json else "invalid")
             if is_valid_json:
                 # Extract JSON
                 logger.success(f"Valid JSON found in response: {chat_completion}")
                 return json.loads(chat_completion)
             else:
                 count += 1
+                tracer.add("json_retries")
                 # Handle invalid JSON (log, retry, or attempt to fix)
                 logger.warning(f"Invalid JSON response from LLM. Trying number {count}/3 Skipping...")
+        JSON_FAILURES.inc()
 
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON: {e} - {chat_completion}")
         return {}
 
-async def _generate_commit_message_parts(diff: str, commit_message: str, client: Any, model: str, chunk_size: int = 7900) -> List[Dict[str, str]]:
+async def _generate_commit_message_parts(diff: str, commit_message: str, client: Any, model: str, chunk_size: int = 7900,
+                                         code_changes: dict = None) -> List[Dict[str, str]]:
     """Splits a diff into chunks and generates a commit message for each chunk."""
     logger.info("Split diff into chunks")
     try:
-        diff_chunks = [diff[i:i + chunk_size] for i in range(0, len(diff), chunk_size)]
+        with tracer.span("split", diff_chars=len(diff)) as span:
+            diff_chunks = [diff[i:i + chunk_size] for i in range(0, len(diff), chunk_size)]
+            span["chunks"] = len(diff_chunks)
         # diff_chunks = list(_split_text_aggressively(diff, chunk_size))
         commit_messages = []
         for i, diff_chunk in enumerate(diff_chunks):
+            # The locally computed summary covers the whole commit, so only the first chunk carries it
             commit_messages.append(
                 await _generate_single_commit_message_json(
-                    diff_chunk, commit_message, client, model, i, len(diff_chunks)
+                    diff_chunk, commit_message, client, model, i, len(diff_chunks), code_changes if i == 0 else None
                 )
             )
         logger.success(f"Generated {len(commit_messages)} commit messages.")
@@ -408,31 +421,6 @@ async def _generate_commit_message_parts(diff: str, commit_message: str, client:
 
 async def combine_messages(multi_commit: List[Dict[str, str]], client: Any, model: str) -> dict:
     """Combines multiple commit messages into a single commit message."""
-    system_prompt = f"""
-## Role: You are a Git commit message expert, combining multiple messages into one. 
-## Goal: Create a concise, informative commit message in JSON that adheres to Conventional Commits.
-## Input: Multiple JSON-formatted commit messages (see structure below).
-## Output: A single, combined JSON-formatted commit message.
-
-## JSON Structure (for both input and output):
-```json
-{
- "short_analysis": "...", 
- "new_commit_title": "...", 
- "new_detailed_commit_message": "...", 
- "code_changes": { 
-  "files_changed": [...], 
-  "functions_modified": [...], 
-  "other_observations": [...] 
- }}
-```
-IMPORTANT: REQUIRED KEYS IN JSON: ['short_analysis', 'new_commit_title', 'new_detailed_commit_message'].
-
-## Key Points:
-* **Analyze the COMBINED impact of all changes, not just individual messages.**
-* **Be concise and technical. Use bullet points in the detailed message.**
-* **Strictly follow Conventional Commits (<https://www.conventionalcommits.org/>) for the title.**
-"""
     user_prompt = f"""
 Combine the following commit messages into a single, well-structured commit message, adhering to the guidelines and 
 JSON format defined in the system prompt.
@@ -440,49 +428,57 @@ JSON format defined in the system prompt.
 {json.dumps(multi_commit)}
 ```
 """
-    combined_message = await client.async_generate_text(
-        system_prompt, user_prompt
-    )
     try:
         is_valid_json = False
         count = 0
         while is_valid_json is False and count < 3:
-            combined_message = await client.async_generate_text(system_prompt, user_prompt)
+            with tracer.span("llm_request", kind="combine",
+                             prompt_chars=len(COMBINE_SYSTEM_PROMPT) + len(user_prompt)) as span:
+                combined_message = await client.async_generate_text(COMBINE_SYSTEM_PROMPT, user_prompt)
+                span["completion_chars"] = len(combined_message or "")
             is_valid_json = await check_json_schema(combined_message, client)
+            JSON_RESPONSES.inc(outcome="valid" if is_valid_json else "invalid")
             if is_valid_json:
                 logger.success(f"Valid JSON found in response: {combined_message}")
                 return json.loads(combined_message)
             else:
                 count += 1
+                tracer.add("json_retries")
                 # Handle invalid JSON (log, retry, or attempt to fix)
                 logger.warning(f"Invalid JSON response from LLM. Trying number {count}/3 Skipping...")
+        JSON_FAILURES.inc()
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON: {e} - {combined_message}")
         return {}
 
 
 
-async def generate_commit_description(diff: str, old_description: str, client: Any, model: str, max_tokens: int = 7900) -> str | None:
-    """Generates a commit description for a potentially large diff."""
+async def generate_commit_description(diff: str, old_description: str, client: Any, model: str, max_tokens: int = None,
+                                      code_changes: dict = None) -> str | None:
+    """Generates a commit description for a potentially large diff; `max_tokens` is the chunk size in characters."""
     try:
-        if model == "llama3":
-            max_tokens = 100_000
+        if max_tokens is None:  # Not calibrated (see 'main.py calibrate')
+            max_tokens = default_chunk_size(model)
         if len(diff) >= max_tokens:
             logger.info("Diff is too long. Start splitting it into chunks.")
-            multi_commit = await _generate_commit_message_parts(diff, old_description, client, model, max_tokens)
+            multi_commit = await _generate_commit_message_parts(
+                diff, old_description, client, model, max_tokens, code_changes
+            )
             if not multi_commit:
                 logger.warning("Failed to generate multi-commit message. Skipping...")
                 return None
             generated_message = await combine_messages(multi_commit, client, model)
         else:
             generated_message = await _generate_single_commit_message_json(
-                diff, old_description, client, model, 0, 1
+                diff, old_description, client, model, 0, 1, code_changes
             )
         new_description = "\n".join(
             [
-                generated_message.get("New Commit Title", ""),
+                generated_message.get("new_commit_title", generated_message.get("New Commit Title", "")),
                 "",
-                generated_message.get("New Detailed Commit Message", ""),
+                generated_message.get(
+                    "new_detailed_commit_message", generated_message.get("New Detailed Commit Message", "")
+                ),
             ]
         ).strip()
 
@@ -497,25 +493,13 @@ async def generate_commit_description(diff: str, old_description: str, client: A
         return None
 
 
-class Commit:
-    """Represents a single commit with its metadata and diff."""
-
-    def __init__(self, hash: str, author: str, date: str, message: str, repo: git.Repo):
-        self.hash = hash
-        self.author = author
-        self.date = date
-        self.message = message
-        self.repo = repo
-        self.diff = ""
-        self.new_message = None
-
-    def __str__(self):
-        """Returns a string representation of the Commit object."""
-        return f"Commit(hash={self.hash}, author={self.author}, date={self.date}, message={self.message})"
-
-    def get_diff(self):
-        """Fetches the diff for this commit."""
-        return self.repo.git.diff(f"{self.hash}~1", f"{self.hash}")
+def parse_commit_log(log_output: str, repo: git.Repo) -> List['Commit']:
+    """Parses `git log --pretty=format:%H,%P,%an <%ae>,%ad,%s` output into Commit objects."""
+    commits = []
+    for line in log_output.splitlines():
+        parts = line.split(",", maxsplit=4)
+        commits.append(Commit(parts[0], parts[2], parts[3], parts[4].strip(), repo, parents=parts[1].split()))
+    return commits
 
 
 class GitAnalyzer:
@@ -540,21 +524,31 @@ class GitAnalyzer:
             logger.error(f"Error getting commit message for {commit_hash}: {e}")
             raise
 
-    def get_commits(self, limit=None, since=None) -> List['Commit']:
+    def get_commits(self, limit=None, since=None, until=None, revision_range=None, authors=None,
+                    paths=None, refs=None) -> List['Commit']:
         """
-        Retrieves commits with optional limit and since parameters.
+        Retrieves commits, scoped by git itself: `revision_range` (e.g. "v1.0..main") or the union
+        of `refs` (default HEAD), `limit`, `since`/`until` dates, `authors` (any of) and `paths` (pathspecs).
         Diffs are NOT fetched at this stage.
         """
         commits = []
         log_command = [
             "log",
-            "--pretty=format:%H,%an <%ae>,%ad,%s",
+            "--pretty=format:%H,%P,%an <%ae>,%ad,%s",
             "--date=short",
         ]
         if limit:
-            log_command.append(f"-n {limit}")
+            log_command.append(f"--max-count={limit}")
         if since:
             log_command.append(f"--since={since}")
+        if until:
+            log_command.append(f"--until={until}")
+        log_command += [f"--author={author}" for author in authors or []]
+        if revision_range:
+            log_command.append(revision_range)
+        log_command += refs or []  # Commits shared by several refs are listed once
+        if paths:
+            log_command += ["--", *paths]
 
         log_output = run_git_command(log_command, self.repo.working_dir)
 
@@ -564,11 +558,12 @@ class GitAnalyzer:
             )
             return commits
 
-        for line in log_output.splitlines():
-            parts = line.split(",", maxsplit=3)
-            commit = Commit(parts[0], parts[1], parts[2], parts[3].strip(), self.repo)
-            commits.append(commit)
-
+        commits = parse_commit_log(log_output, self.repo)
+        boundary = shallow_boundary(self.repo.git_dir)
+        if boundary:
+            # Their parents were not fetched, so their real diffs are unknown
+            logger.info(f"Skipping {len(boundary)} commit(s) at the shallow clone boundary")
+            commits = [commit for commit in commits if commit.hash not in boundary]
         return commits
 
 
@@ -591,70 +586,730 @@ class GitAnalyzer:
             logger.error(f"Error updating commit message for commit {commit.hash}: {e}")
             raise
 
-async def process_commit(commit, analyzer, client, model, repo_path, semaphore):
+async def process_commit(commit, analyzer, client, model, repo_path, semaphore, trivial_rules=TRIVIAL_COMMIT_RULES,
+                         cascade=None, ast_mode="off", executor=None,
+                         diff_budget=(DIFF_MAX_FILE_BYTES, DIFF_MAX_FILE_LINES, DIFF_MAX_TOTAL_BYTES), cpu_executor=None,
+                         chunk_size=None, budget=None):
     """Processes a single commit asynchronously, limited by a semaphore."""
+    COMMITS_QUEUED.inc()
     async with semaphore:  # Acquire the semaphore, wait if necessary
-        logger.info(f"Processing commit: {commit.hash}")
+        COMMITS_QUEUED.dec()
+        start = time.perf_counter()
+        with tracer.span("commit", commit=commit.hash):
+            await _process_commit_stages(
+                commit, analyzer, client, model, repo_path, trivial_rules, cascade, ast_mode, executor, diff_budget,
+                cpu_executor, chunk_size, budget,
+            )
+        COMMIT_DURATION.observe(time.perf_counter() - start)
+        if commit.trivial_rule:
+            COMMITS_PROCESSED.inc(result="trivial")
+        else:
+            COMMITS_PROCESSED.inc(result="generated" if commit.new_message else "failed")
+
+
+async def _process_commit_stages(commit, analyzer, client, model, repo_path, trivial_rules, cascade, ast_mode, executor,
+                                 diff_budget, cpu_executor, chunk_size=None, budget=None):
+    """Runs the per-commit stages of process_commit, each under its own trace span."""
+    logger.info(f"Processing commit: {commit.hash}")
 
-        # 1. Get the Diff (fetch diff here)
-        initial_commit_hash = run_git_command(['rev-list', '--max-parents=0', 'HEAD'], repo_path).strip()
-        if commit.hash == initial_commit_hash:
+    # 1. Get the Diff (fetch diff here); git runs in a thread so the event loop keeps dispatching requests
+    with tracer.span("git_diff") as span:
+        if commit.parents is not None:
+            is_initial = not commit.parents
+        else:
+            is_initial = commit.hash in run_git_command(['rev-list', '--max-parents=0', 'HEAD'], repo_path).split()
+        if is_initial:
             logger.info(f"Skipping diff for initial commit: {commit.hash}")
             diff = ""  # Or handle the initial commit differently
         else:
-            diff = analyzer.get_commit_diff(commit.hash, commit)
+            # Sized with --numstat first; oversized files become one-line summaries
+            diff, omitted = await asyncio.to_thread(
+                budgeted_diff, repo_path, f"{commit.hash}~1", commit.hash, *diff_budget
+            )
+            span["omitted_files"] = len(omitted)
+        span["diff_chars"] = len(diff)
+
+    # 2. Filter the Diff and check the trivial commit rules (merges, lockfiles, version bumps, ...)
+    with tracer.span("filter_diff") as span:
+        if cpu_executor and len(diff) >= CPU_OFFLOAD_MIN_CHARS:
+            filtered_diff, trivial = await prepare_diff_in_pool(
+                cpu_executor, diff, commit.message, commit.parents, is_initial, trivial_rules
+            )
+            span["offloaded"] = True
+        else:
+            filtered_diff, trivial = prepare_diff(diff, commit.message, commit.parents, is_initial, trivial_rules)
+        span["filtered_chars"] = len(filtered_diff)
+        span["rule"] = trivial[0] if trivial else None
+    if trivial:
+        commit.trivial_rule, commit.new_message = trivial
+        logger.info(f"Commit {commit.hash} matched trivial rule '{commit.trivial_rule}'. Skipping LLM.")
+        return
 
-        # 2. Filter the Diff
-        filtered_diff = filter_diff(diff)
+    # 2b. Local structural analysis fills 'code_changes' without spending tokens
+    code_changes = None
+    if ast_mode != "off":
+        with tracer.span("ast_analysis") as span:
+            code_changes = await analyze_commit(analyzer.repo, commit.hash, filtered_diff, executor)
+            if ast_mode == "summary":
+                filtered_diff = summarize_structure(filtered_diff, code_changes)
+            span["prompt_diff_chars"] = len(filtered_diff)
+
+    # 2c. Budget: once a commit no longer fits, it and everything after it are left for a later run
+    if budget and not budget.admit(len(filtered_diff)):
+        logger.info(f"Budget exhausted; leaving {commit.hash} for a later run")
+        return
 
-        # 3. Generate New Commit Message (using await)
-        new_message = await generate_commit_description(
-            filtered_diff, commit.message, client, model
+    # 3. Generate New Commit Message (using await)
+    try:
+        with tracer.span("generate"):
+            if cascade:
+                new_message = await cascade.generate_commit_description(filtered_diff, commit.message, code_changes)
+            else:
+                new_message = await generate_commit_description(
+                    filtered_diff, commit.message, client, model, chunk_size, code_changes=code_changes
+                )
+    finally:
+        if budget:
+            budget.release(len(filtered_diff))
+
+    # 4. Handle Generated Message
+    if new_message is None:
+        logger.warning(
+            f"Skipping commit {commit.hash} - No new message generated"
         )
+    else:
+        commit.new_message = new_message  # Store the new message
+        logger.info(f"New message generated for commit {commit.hash}")
 
-        # 4. Handle Generated Message
-        if new_message is None:
-            logger.warning(
-                f"Skipping commit {commit.hash} - No new message generated"
-            )
-        else:
-            commit.new_message = new_message  # Store the new message
-            logger.info(f"New message generated for commit {commit.hash}")
 
-async def main():
-    # Parse command-line arguments
-    parser = argparse.ArgumentParser(description="Revitalize old commit messages using LLMs.")
-    parser.add_argument("repo_path", help="Path to the Git repository (local path or URL).")
+SUBCOMMANDS = ("generate", "apply", "merge", "daemon", "snapshots", "calibrate")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Builds the command-line parser."""
+    parser = argparse.ArgumentParser(
+        description="Revitalize old commit messages using LLMs.",
+        epilog="Subcommands: 'main.py generate ...' takes the options above, writes --message-map and never "
+               "rewrites; 'main.py apply' rewrites history from a message map; 'main.py merge' combines message "
+               "maps; 'main.py daemon' serves suggestions to hooks/prepare-commit-msg; 'main.py snapshots' "
+               "lists, restores and prunes ref backups; 'main.py calibrate' measures a provider and saves "
+               "its tuning. See '<subcommand> -h'.",
+    )
+    parser.add_argument("repo_path", nargs="?", help="Path to the Git repository (local path or URL).")
     parser.add_argument("-b", "--backup_dir",
                         default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "backup"),
                         help="Directory for repository backup.")
-    parser.add_argument("-l", "--llm", choices=["openai", "groq", "replicate", "ollama"], default="ollama", help="Choice of LLM.")
-    parser.add_argument("-m", "--model", default="meta/llama3-70b-instruct", help="Choice of LLM model.")
+    parser.add_argument("-l", "--llm", choices=["openai", "groq", "replicate", "ollama", "replay"], default="ollama",
+                        help="Choice of LLM ('replay' serves responses saved with --record).")
+    parser.add_argument("-m", "--model", default=None,
+                        help="Choice of LLM model (default: the provider's, e.g. llama3 for ollama, "
+                             "meta/llama3-70b-instruct for openai).")
     parser.add_argument("-f", "--force-push", action="store_true", help="Force push to remote after rewrite.")
     parser.add_argument(
         "-r",
         "--restore",
         action="store_true",
-        help="Restore refs from backup before proceeding.",
+        help="Restore refs from the latest snapshot (refs/ocdg/backup/) and exit; see 'main.py snapshots'.",
     )
+    parser.add_argument(
+        "--trivial-rules",
+        default=",".join(sorted(TRIVIAL_COMMIT_RULES)),
+        help="Comma-separated trivial commit rules handled without the LLM "
+             "(merge, empty, lockfile, version_bump, rename, whitespace). Use 'none' to disable.",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Generate a message for every commit, even when git patch-id shows the same change elsewhere.",
+    )
+    parser.add_argument(
+        "--cherry-pick-note",
+        action="store_true",
+        help="Append '(cherry picked from commit <hash>)' to messages reused from a duplicate patch.",
+    )
+    parser.add_argument(
+        "--small-model",
+        help="Enable the model cascade: try this small model first, escalate to -m only when needed.",
+    )
+    parser.add_argument(
+        "--small-llm",
+        choices=["openai", "groq", "replicate", "ollama"],
+        default="ollama",
+        help="LLM provider for --small-model.",
+    )
+    parser.add_argument(
+        "--ast-analysis",
+        choices=["off", "prefill", "summary"],
+        default="off",
+        help="Parse changed Python files locally: 'prefill' sends the changed functions with the diff, "
+             "'summary' also replaces their hunks with a structural summary.",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write per-commit stage spans to a JSONL file and log a timing summary at the end.",
+    )
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics.")
+    parser.add_argument(
+        "--metrics-textfile",
+        metavar="FILE",
+        help="Periodically write Prometheus metrics to FILE (node_exporter textfile collector).",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="Append every LLM request/response pair to FILE for later runs with '-l replay'.",
+    )
+    parser.add_argument("--replay-file", metavar="FILE", help="Recorded responses for '-l replay' (default: llm_replay.jsonl).")
+    parser.add_argument("--replay-latency", type=float, metavar="SECONDS", help="Simulated latency per replayed request.")
+    parser.add_argument(
+        "--commit-store",
+        metavar="FILE",
+        help="Keep commit metadata and generated messages in an SQLite file for the review and rewrite steps.",
+    )
+    parser.add_argument("--max-file-bytes", type=int, default=DIFF_MAX_FILE_BYTES,
+                        help="Summarize files whose patch would exceed this many bytes (0 disables).")
+    parser.add_argument("--max-file-lines", type=int, default=DIFF_MAX_FILE_LINES,
+                        help="Summarize files with more changed lines than this (0 disables).")
+    parser.add_argument("--max-diff-bytes", type=int, default=DIFF_MAX_TOTAL_BYTES,
+                        help="Read at most this many bytes of diff per commit (0 disables).")
+    parser.add_argument("--chunk-size", type=int, default=None, metavar="CHARS",
+                        help="Split filtered diffs longer than this into several requests. "
+                             "Default: the calibrated profile (see 'main.py calibrate'), else the built-in size.")
+    parser.add_argument(
+        "--cpu-workers",
+        type=parse_workers,
+        default=0,
+        metavar="N|auto",
+        help="Filter and classify large diffs in a pool of N processes ('auto': one per available core).",
+    )
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--range", metavar="REVISIONS",
+                       help="Revision range to process, e.g. 'v1.0..main' (default: HEAD and its history).")
+    scope.add_argument("--refs", action="append", metavar="PATTERN",
+                       help="Process the commits of every matching ref (repeatable; e.g. 'refs/heads', "
+                            "'refs/tags/v*', 'HEAD'). Shared history is generated and rewritten once, and all "
+                            "matching branches and tags move together.")
+    scope.add_argument("--incremental", action="store_true",
+                       help="Only process commits after this branch's watermark (refs/ocdg/watermark/<branch>), "
+                            "and move the watermark once they all have messages.")
+    parser.add_argument("-n", "--max-count", type=int, metavar="N", help="Process at most the N newest commits.")
+    parser.add_argument("--since", metavar="DATE", help="Only commits more recent than DATE.")
+    parser.add_argument("--until", metavar="DATE", help="Only commits older than DATE.")
+    parser.add_argument("--author", action="append", metavar="PATTERN",
+                        help="Only commits by a matching author (repeatable; any match).")
+    parser.add_argument("--path", action="append", metavar="PATHSPEC",
+                        help="Only commits touching PATHSPEC (repeatable).")
+    parser.add_argument("--clone-depth", type=int, metavar="N",
+                        help="For repository URLs: fetch only the last N commits (shallow clone). "
+                             "Default: derived from --max-count.")
+    parser.add_argument("--shallow-since", metavar="DATE",
+                        help="For repository URLs: fetch only commits newer than DATE (shallow clone). "
+                             "Default: --since.")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="Batch mode: process every repository listed in FILE (JSONL) through one shared "
+                             "LLM pool, instead of repo_path. Messages are written to --message-map, not rewritten.")
+    parser.add_argument("--message-map", metavar="FILE",
+                        help=f"Write generated messages as JSONL (default with --manifest: {MESSAGE_MAP_FILE}).")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Only process the i-th of N hash partitions of the commits (1-based) and write them "
+                             "to --message-map; merge the N files with 'python main.py merge'.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Predict requests, tokens and time for every calibrated provider profile from diff "
+                             "sizes alone, then exit without calling the LLM.")
+    parser.add_argument("--token-budget", type=int, metavar="TOKENS",
+                        help="Stop sending commits to the LLM once their estimated or recorded tokens would pass this.")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS",
+                        help="Stop sending commits to the LLM once their predicted time would pass this.")
+    parser.add_argument("--priority", choices=PRIORITIES, default="recent",
+                        help="Order in which commits are sent, and kept when a budget runs out: 'recent' (default), "
+                             "'oldest', or 'worst' existing messages first.")
     # Add more arguments as needed...
-    args = parser.parse_args()
+    return parser
+
+
+def shallow_clone_scope(args: argparse.Namespace):
+    """
+    (depth, shallow_since) for cloning a repository URL: explicit options win, otherwise
+    they follow --since, or --max-count when nothing else filters the newest commits.
+    """
+    if args.clone_depth or args.shallow_since:
+        return args.clone_depth, args.shallow_since
+    if args.since:
+        return None, args.since
+    if args.max_count and not (args.range or args.until or args.author or args.path):
+        return args.max_count + 1, None  # The oldest selected commit needs its parent for a diff
+    return None, None
+
+
+def resolve_repository(repo: str, args: argparse.Namespace, config: dict) -> str:
+    """Local path of `repo`; URLs are cloned (or fetched) into COMMIT_DIFF_DIRECTORY first."""
+    if not is_remote_url(repo):
+        return os.path.abspath(repo)
+    repo_path = clone_path(repo, config['COMMIT_DIFF_DIRECTORY'])
+    # Partial (and optionally shallow) clone, or an incremental fetch into an existing one
+    depth, shallow_since = shallow_clone_scope(args)
+    clone_or_fetch(repo, repo_path, depth=depth, shallow_since=shallow_since)
+    return repo_path
+
+
+def load_commits(analyzer: 'GitAnalyzer', args: argparse.Namespace) -> Tuple[List['Commit'], Optional[Tuple[str, str]]]:
+    """Commits in the scope selected by `args`, and (branch, pinned tip) for --incremental runs."""
+    repo_path = analyzer.repo.working_dir
+    revision_range, watermark = args.range, None
+    if args.incremental:
+        branch = current_branch(repo_path)
+        tip = run_git_command(["rev-parse", "HEAD"], repo_path)  # Pinned: commits landing mid-run wait
+        revision_range = incremental_range(repo_path, branch, tip) or tip
+        watermark = (branch, tip)
+    refs = expand_refs(repo_path, args.refs) if args.refs else None
+    if args.refs and not refs:
+        raise RuntimeError(f"No refs match {', '.join(args.refs)}")
+    # Metadata only, and only for the requested scope; diffs are fetched per commit while processing
+    commits = analyzer.get_commits(limit=args.max_count, since=args.since, until=args.until,
+                                   revision_range=revision_range, authors=args.author, paths=args.path, refs=refs)
+    if args.shard:
+        total = len(commits)
+        commits = [commit for commit in commits if in_shard(commit.hash, args.shard)]
+        logger.info(f"Shard {shard_label(args.shard)}: {len(commits)} of {total} commits")
+    return commits, watermark
+
+
+def advance_watermark(repo_path: str, commits: List['Commit'], watermark: Tuple[str, str],
+                      args: argparse.Namespace, rewritten: Dict[str, str] = None) -> bool:
+    """
+    Moves the --incremental watermark to the pinned tip if every commit in scope got a message.
+    After a rewrite, pass its {old hash: new hash} so the watermark lands on the rewritten tip.
+    """
+    branch, tip = watermark
+    failed = sum(1 for commit in commits if not commit.new_message)
+    if failed:
+        logger.warning(f"{failed} commits have no new message; the watermark stays so the next run retries them")
+        return False
+    if args.max_count and len(commits) >= args.max_count:
+        logger.warning("--max-count may have cut off older new commits; the watermark stays")
+        return False
+    write_watermark(repo_path, branch, (rewritten or {}).get(tip, tip))  # Nothing in scope still counts as processed
+    return True
+
+
+def run_cost_model(args: argparse.Namespace, config: dict) -> CostModel:
+    """Cost model of the -l/-m profile as this run uses it (--chunk-size and concurrency applied)."""
+    overhead = len(COMMIT_SYSTEM_PROMPT) + len(_commit_user_prompt("", ""))
+    return CostModel.from_profile(calibration_key(args.llm, args.model),
+                                  load_calibration(config['CALIBRATION_FILE'], args.llm, args.model), args.model,
+                                  overhead, args.chunk_size, config['MAX_CONCURRENT_REQUESTS'])
+
+
+def run_budget(args: argparse.Namespace, config: dict) -> Optional[Budget]:
+    if args.token_budget is None and args.time_budget is None:
+        return None
+    return Budget(run_cost_model(args, config), args.token_budget, args.time_budget)
+
+
+def plan_run(analyzer: 'GitAnalyzer', commits: List['Commit'], args: argparse.Namespace, config: dict) -> str:
+    """
+    Predicts the run from `git diff-tree` sizes (no diffs are read): one row for this run's
+    profile, then one per other calibrated profile.
+    """
+    repo_path = analyzer.repo.working_dir
+    if not args.no_dedup:
+        commits, _ = deduplicate_commits(commits, compute_patch_ids(repo_path, [commit.hash for commit in commits]))
+    commits = prioritize(commits, args.priority)
+    trivial_rules = set() if args.trivial_rules == "none" else {
+        rule.strip() for rule in args.trivial_rules.split(",") if rule.strip()
+    }
+    plans = plan_commits(commits, commits_file_stats(repo_path, [commit.hash for commit in commits]), trivial_rules,
+                         (args.max_file_bytes, args.max_file_lines, args.max_diff_bytes))
+    current = run_cost_model(args, config)
+    models = [current]
+    overhead = current.overhead_chars
+    for key, profile in load_calibration_profiles(config['CALIBRATION_FILE']).items():
+        if key != current.name:
+            models.append(CostModel.from_profile(key, profile, key.partition("/")[2], overhead))
+    return format_plan(plans, models, args.token_budget, args.time_budget)
+
+
+async def generate_messages(commits: List['Commit'], analyzer: 'GitAnalyzer', client: Any, args: argparse.Namespace,
+                            semaphore: asyncio.Semaphore = None, executor: ProcessPoolExecutor = None,
+                            budget: Budget = None):
+    """
+    Generates new messages for `commits` in place (dedup, trivial rules, cascade, LLM), in --priority order.
+
+    Batch runs pass one `semaphore`, process pool `executor` and `budget` shared by all repositories.
+    """
+    repo_path = analyzer.repo.working_dir
+    cascade = None
+    if args.small_model:
+        small_client = create_client(args.small_llm, load_configuration(args.small_llm, args.small_model),
+                                     args.small_model)
+        cascade = ModelCascade(functools.partial(generate_commit_description, max_tokens=args.chunk_size),
+                               small_client, args.small_model, client, args.model)
+        logger.info(f"Model cascade enabled: {args.small_model} -> {args.model}")
+
+    # Process each commit asynchronously, limited by semaphore
+    trivial_rules = set() if args.trivial_rules == "none" else {
+        rule.strip() for rule in args.trivial_rules.split(",") if rule.strip()
+    }
+    unique_commits, duplicates = commits, {}
+    if not args.no_dedup:
+        with tracer.span("patch_id", commits=len(commits)):
+            patch_ids = await asyncio.to_thread(compute_patch_ids, repo_path, [commit.hash for commit in commits])
+        unique_commits, duplicates = deduplicate_commits(commits, patch_ids)
+    unique_commits = prioritize(unique_commits, args.priority)  # The semaphore admits commits in this order
+    if budget:
+        with tracer.span("plan", commits=len(unique_commits)):
+            stats = await asyncio.to_thread(commits_file_stats, repo_path, [commit.hash for commit in unique_commits])
+        plans = plan_commits(unique_commits, stats, trivial_rules,
+                             (args.max_file_bytes, args.max_file_lines, args.max_diff_bytes))
+        unique_commits = budget.select(plans)
+    semaphore = semaphore or asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # One pool serves both AST analysis and --cpu-workers offload
+    owns_executor = executor is None and (args.ast_analysis != "off" or args.cpu_workers)
+    if owns_executor:
+        executor = ProcessPoolExecutor(args.cpu_workers or None)
+        logger.info(f"Process pool started with {args.cpu_workers or os.cpu_count()} workers")
+    try:
+        tasks = [
+            process_commit(
+                commit, analyzer, client, args.model, repo_path, semaphore, trivial_rules, cascade,
+                args.ast_analysis, executor, (args.max_file_bytes, args.max_file_lines, args.max_diff_bytes),
+                executor if args.cpu_workers else None, args.chunk_size, budget,
+            )
+            for commit in unique_commits
+        ]
+        await asyncio.gather(*tasks)  # Execute tasks concurrently
+    finally:
+        if owns_executor:
+            executor.shutdown()
+    if cascade:
+        logger.info(cascade.summary())
+    hit_rate = prompt_cache_hit_rate()
+    if hit_rate is not None:
+        logger.info(f"Prompt cache: {hit_rate:.0%} of provider-reported prompt tokens were served from cache")
+    if duplicates:
+        reused = fan_out_messages(commits, duplicates, args.cherry_pick_note)
+        COMMITS_PROCESSED.inc(reused, result="reused")
+        logger.info(f"Reused generated messages for {reused} duplicate commits.")
+    if not args.no_dedup:
+        CACHE_LOOKUPS.inc(len(commits) - len(unique_commits), cache="patch_id", result="hit")
+        CACHE_LOOKUPS.inc(len(unique_commits), cache="patch_id", result="miss")
+    trivial_count = sum(1 for commit in commits if commit.trivial_rule)
+    logger.info(f"{trivial_count}/{len(commits)} commits handled by trivial commit rules without the LLM.")
+
+
+def build_apply_parser() -> argparse.ArgumentParser:
+    """Parser for `main.py apply`: rewrite history from a message map without generating anything."""
+    parser = argparse.ArgumentParser(prog="main.py apply", description="Rewrite commit messages from a message map.")
+    parser.add_argument("repo_path", help="Repository to rewrite (local path, or the URL it was generated from).")
+    parser.add_argument("--message-map", default=MESSAGE_MAP_FILE, metavar="FILE",
+                        help=f"Messages written by 'generate' (default: {MESSAGE_MAP_FILE}).")
+    parser.add_argument("--refs", action="append", default=None, metavar="PATTERN",
+                        help="Refs to rewrite in one pass (repeatable; e.g. 'refs/heads', 'refs/tags'). Default: HEAD.")
+    parser.add_argument("--review", choices=["none", "pager", "diff"], default="none",
+                        help="Show the changes in a pager ('diff': unified diff of old and new messages) "
+                             "and ask before rewriting. Default: rewrite without asking.")
+    parser.add_argument("-f", "--force-push", action="store_true",
+                        help="Push the rewritten branch to origin with --force-with-lease.")
+    return parser
+
+
+def build_merge_parser() -> argparse.ArgumentParser:
+    """Parser for `main.py merge`: combine message maps, e.g. the outputs of --shard runs."""
+    parser = argparse.ArgumentParser(prog="main.py merge", description="Combine message maps into one.")
+    parser.add_argument("inputs", nargs="+", help="Message map files.")
+    parser.add_argument("-o", "--output", default=MESSAGE_MAP_FILE, help=f"Merged map (default: {MESSAGE_MAP_FILE}).")
+    return parser
+
+
+def build_daemon_parser() -> argparse.ArgumentParser:
+    """Parser for `main.py daemon`: a resident suggestion server for hooks/prepare-commit-msg."""
+    parser = argparse.ArgumentParser(prog="main.py daemon",
+                                     description="Serve commit message suggestions for staged changes over a Unix socket.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help=f"Socket path (default: $OCDG_SOCKET or {DEFAULT_SOCKET}).")
+    parser.add_argument("-l", "--llm", choices=list(PROVIDERS), default="ollama", help="Choice of LLM.")
+    parser.add_argument("-m", "--model", default=None, help="Choice of LLM model (default: the provider's).")
+    parser.add_argument("--trivial-rules", default=",".join(sorted(TRIVIAL_COMMIT_RULES)),
+                        help="Comma-separated trivial commit rules answered without the LLM. Use 'none' to disable.")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="Skip the startup request that loads the model and primes the provider's prompt cache.")
+    return parser
+
+
+async def run_daemon(args: argparse.Namespace):
+    """Keeps one client (SDK imported, model loaded) resident and answers suggestion requests until stopped."""
+    args.model = args.model or DEFAULT_MODELS.get(args.llm)
+    config = load_configuration(args.llm, args.model)
+    client = create_client(args.llm, config, args.model)  # Warmed up and served: the -m model stays loaded
+    trivial_rules = set() if args.trivial_rules == "none" else set(args.trivial_rules.split(","))
+    semaphore = asyncio.Semaphore(config['MAX_CONCURRENT_REQUESTS'])
+
+    async def suggest(request: dict) -> dict:
+        """{"diff", "message", "parents", "initial"} -> {"message", "trivial_rule"} or {"error"}."""
+        async with semaphore:
+            filtered_diff, trivial = prepare_diff(request.get("diff", ""), request.get("message", ""),
+                                                  request.get("parents"), request.get("initial", False), trivial_rules)
+            if trivial:
+                return {"message": trivial[1], "trivial_rule": trivial[0]}
+            new_message = await generate_commit_description(filtered_diff, request.get("message", ""), client,
+                                                            args.model, config['CHUNK_SIZE'])
+            return {"message": new_message} if new_message else {"error": "No message generated"}
+
+    if not args.no_warmup:
+        start = time.perf_counter()
+        try:
+            await client.async_generate_text(COMMIT_SYSTEM_PROMPT, "Reply with {}.")
+            logger.info(f"Model warmed up in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            logger.warning(f"Warm-up request failed, serving anyway: {e}")
+    await SuggestionServer(suggest, args.socket).serve_forever()
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def build_calibrate_parser() -> argparse.ArgumentParser:
+    """Parser for `main.py calibrate`: measure a provider and save concurrency, chunk size and timeout."""
+    parser = argparse.ArgumentParser(prog="main.py calibrate",
+                                     description="Send a ladder of synthetic requests to a provider and save the "
+                                                 "recommended concurrency, chunk size and timeout.")
+    parser.add_argument("-l", "--llm", choices=list(PROVIDERS), default="ollama", help="Choice of LLM.")
+    parser.add_argument("-m", "--model", default=None, help="Choice of LLM model (default: the provider's).")
+    parser.add_argument("--output", default=None, metavar="FILE",
+                        help=f"Profile file (default: $OCDG_CALIBRATION_FILE or {CALIBRATION_FILE}).")
+    parser.add_argument("--concurrency", type=_int_list, default=list(CALIBRATION_CONCURRENCY), metavar="N,N,...",
+                        help=f"Concurrency levels to climb (default: {','.join(map(str, CALIBRATION_CONCURRENCY))}).")
+    parser.add_argument("--sizes", type=_int_list, default=list(CALIBRATION_SIZES), metavar="CHARS,...",
+                        help=f"Diff sizes to climb (default: {','.join(map(str, CALIBRATION_SIZES))}).")
+    parser.add_argument("--requests", type=int, default=CALIBRATION_REQUESTS,
+                        help=f"Requests per step and concurrent slot (default: {CALIBRATION_REQUESTS}).")
+    return parser
+
+
+async def run_calibrate(args: argparse.Namespace) -> dict:
+    """Calibrates `args.llm`/`args.model` with real requests and saves the profile load_configuration reads."""
+    args.model = args.model or DEFAULT_MODELS.get(args.llm)
+    config = load_configuration(args.llm, args.model)
+    config['LLM_TIMEOUT'] = CALIBRATION_REQUEST_TIMEOUT  # Slow steps should show up as latency, not client timeouts
+    client = create_client(args.llm, config, args.model)  # The profile is saved for this model
+
+    async def send(diff: str) -> str:
+        return await client.async_generate_text(COMMIT_SYSTEM_PROMPT, _commit_user_prompt(diff, "Update handlers"))
+
+    profile = await calibrate(send, args.concurrency, args.sizes, args.requests)
+    save_profile(args.output or config['CALIBRATION_FILE'], calibration_key(args.llm, args.model), profile)
+    return profile
+
+
+def build_snapshots_parser() -> argparse.ArgumentParser:
+    """Parser for `main.py snapshots`: list, restore or prune the ref snapshots taken before rewrites."""
+    parser = argparse.ArgumentParser(prog="main.py snapshots",
+                                     description="Manage ref snapshots under refs/ocdg/backup/.")
+    parser.add_argument("action", choices=["list", "create", "restore", "prune"])
+    parser.add_argument("repo_path", nargs="?", default=".", help="Repository (default: current directory).")
+    parser.add_argument("--name", help="Snapshot to restore (default: the latest).")
+    parser.add_argument("--keep", type=int, default=REF_SNAPSHOT_KEEP,
+                        help=f"Snapshots kept by 'prune' (default: {REF_SNAPSHOT_KEEP}).")
+    return parser
+
+
+def manage_snapshots(args: argparse.Namespace):
+    repo_path = os.path.abspath(args.repo_path)
+    if args.action == "list":
+        snapshots = list_snapshots(repo_path)
+        for name, refs in snapshots:
+            print(f"{name}\t{refs} refs")
+        return snapshots
+    if args.action == "create":
+        return create_snapshot(repo_path)
+    if args.action == "restore":
+        return restore_snapshot(repo_path, args.name)
+    return prune_snapshots(repo_path, args.keep)
+
+
+def review_text(commit_history: 'CommitHistory', style: str) -> str:
+    """Old and new messages for the review pager: side by side, or as a unified diff ('diff')."""
+    sections = []
+    for commit in commit_history.commits:
+        header = f"commit {commit.hash}\nAuthor: {commit.author}\nDate:   {commit.date}\n"
+        if style == "diff":
+            diff = difflib.unified_diff(commit.message.splitlines(), commit.new_message.splitlines(),
+                                        "old", "new", lineterm="")
+            sections.append(header + "\n".join(diff))
+        else:
+            sections.append(f"{header}\nOld: {commit.message}\nNew: {commit.new_message}")
+    return "\n\n".join(sections) + "\n"
+
+
+def same_repository(entry_repo: str, repo: str, repo_path: str, clone_dir: str) -> bool:
+    """Whether a message-map entry written for `entry_repo` (path or URL) is for `repo`, found at `repo_path`."""
+    if entry_repo == repo:
+        return True
+    entry_path = clone_path(entry_repo, clone_dir) if is_remote_url(entry_repo) else entry_repo
+    return os.path.realpath(entry_path) == os.path.realpath(repo_path)
+
+
+def apply_message_map(args: argparse.Namespace) -> Optional[Dict[str, str]]:
+    """Rewrites history from a message map; returns {old hash: new hash}, or None if nothing was rewritten."""
+    repo_path, clone_dir = args.repo_path, load_configuration()['COMMIT_DIFF_DIRECTORY']
+    if is_remote_url(repo_path):
+        repo_path = clone_path(repo_path, clone_dir)
+    updater = RepositoryUpdater(os.path.abspath(repo_path))
+    commit_history = CommitHistory()
+    commits, skipped = [], 0
+    for entry in read_message_map(args.message_map):
+        if "repo" in entry and not same_repository(entry["repo"], args.repo_path, repo_path, clone_dir):
+            skipped += 1  # A batch or merged map holds other repositories too
+            continue
+        commit = Commit(entry["hash"], entry["author"], entry["date"], entry["message"], updater.repo)
+        commit.new_message = entry["new_message"]
+        commit.trivial_rule = entry.get("trivial_rule")
+        commits.append(commit)
+    commit_history.commits = commits
+    logger.info(f"Loaded {len(commits)} messages from {args.message_map}"
+                + (f" ({skipped} for other repositories skipped)" if skipped else ""))
+
+    if args.review != "none":
+        pydoc.pager(review_text(commit_history, args.review))
+        if input(f"Rewrite {len(commits)} commit messages? (yes/no): ").lower() not in ("yes", "y"):
+            logger.info("Rewrite cancelled by user.")
+            return None
+    refs = args.refs or ("HEAD",)
+    rewritten = updater.rewrite_commit_messages(commit_history, refs)
+    save_commit_messages_to_log(commit_history)
+    if args.force_push and rewritten:
+        logger.info("Force pushing changes to remote repository...")
+        updater.force_push(refs)
+    return rewritten
+
+
+def finish_run(args: argparse.Namespace):
+    """Final metrics textfile and stage timings, once generation is over (also after a failure)."""
+    if args.metrics_textfile:
+        write_textfile(args.metrics_textfile)
+    if tracer.enabled:
+        logger.info(f"Stage timings:\n{tracer.summary_table()}")
+        tracer.close()
+
+
+async def run_batch(args: argparse.Namespace, config: dict):
+    """
+    Generates messages for every repository in the --manifest through one client and one
+    request semaphore, so one repository's git work overlaps the others' LLM requests.
+    """
+    entries = load_manifest(args.manifest)
+    client = create_client(args.llm, config, args.model)
+    if args.record:
+        client = ReplayClient(args.record, upstream=client)
+    message_map = args.message_map or MESSAGE_MAP_FILE
+    open(message_map, "w").close()  # Repositories append as they finish
+    semaphore = asyncio.Semaphore(config['MAX_CONCURRENT_REQUESTS'])
+    git_slots = asyncio.Semaphore(BATCH_GIT_CONCURRENCY)
+    budget = run_budget(args, config)  # Shared: repositories are admitted as they get there, in --priority order each
+    executor = None
+    if args.cpu_workers or any(entry.args(args).ast_analysis != "off" for entry in entries):
+        executor = ProcessPoolExecutor(args.cpu_workers or None)
+    results = []
+
+    async def run_repository(entry: ManifestEntry):
+        repo_args = entry.args(args)
+        result = BatchResult(entry.repo)
+        start = time.perf_counter()
+        try:
+            async with git_slots:  # Clones and enumeration, bounded so they don't swamp the disk
+                repo_path = await asyncio.to_thread(resolve_repository, entry.repo, repo_args, config)
+                analyzer = await asyncio.to_thread(GitAnalyzer, repo_path)
+                commits, watermark = await asyncio.to_thread(load_commits, analyzer, repo_args)
+            logger.info(f"[{entry.repo}] {len(commits)} commits queued")
+            await generate_messages(commits, analyzer, client, repo_args, semaphore, executor, budget)
+            result.count(commits)
+            write_message_map(message_map, commits, entry.repo, append=True,
+                              shard=args.shard and shard_label(args.shard))
+            if watermark:
+                advance_watermark(repo_path, commits, watermark, repo_args)
+        except Exception as e:
+            result.error = str(e)
+            logger.error(f"[{entry.repo}] failed: {e}")
+        result.seconds = time.perf_counter() - start
+        results.append(result)
+        logger.info(f"[{len(results)}/{len(entries)}] {result}")
+
+    try:
+        await asyncio.gather(*(run_repository(entry) for entry in entries))
+    finally:
+        if executor:
+            executor.shutdown()
+    if budget:
+        logger.info(budget.summary())
+    failed = [result.repo for result in results if result.error]
+    logger.info(f"Batch done: {len(entries) - len(failed)}/{len(entries)} repositories, messages in {message_map}")
+    if failed:
+        logger.warning(f"Failed repositories: {', '.join(failed)}")
+    return results
+
+
+async def main(argv: List[str] = None):
+    # Parse command-line arguments; 'generate', 'apply' and 'merge' are subcommands, anything else is a full run
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command = argv.pop(0) if argv and argv[0] in SUBCOMMANDS else None
+    if command == "apply":
+        return apply_message_map(build_apply_parser().parse_args(argv))
+    if command == "merge":
+        args = build_merge_parser().parse_args(argv)
+        return merge_message_maps(args.inputs, args.output)
+    if command == "daemon":
+        return await run_daemon(build_daemon_parser().parse_args(argv))
+    if command == "calibrate":
+        return await run_calibrate(build_calibrate_parser().parse_args(argv))
+    if command == "snapshots":
+        return manage_snapshots(build_snapshots_parser().parse_intermixed_args(argv))
+    parser = build_arg_parser()
+    if command:
+        parser.prog = f"{parser.prog} {command}"
+    args = parser.parse_args(argv)
+    if command == "generate" and not args.message_map:
+        args.message_map = MESSAGE_MAP_FILE
+    if bool(args.repo_path) == bool(args.manifest):
+        parser.error("pass either repo_path or --manifest")
+    if args.shard and args.incremental:
+        parser.error("--shard cannot move the --incremental watermark; shards only see part of the commits")
+    if args.shard and args.repo_path and not args.message_map:
+        parser.error("--shard writes its messages to --message-map for a later merge")
+    if args.plan and args.manifest:
+        parser.error("--plan works on one repository")
 
     # Load configuration with LLM choice for proper validation
-    config = load_configuration(args.llm)
+    args.model = args.model or DEFAULT_MODELS.get(args.llm)
+    config = load_configuration(args.llm, args.model)
+    if args.chunk_size is None:
+        args.chunk_size = config['CHUNK_SIZE']
+    if args.replay_file:
+        config['REPLAY_FILE'] = args.replay_file
+    if args.replay_latency is not None:
+        config['REPLAY_LATENCY'] = args.replay_latency
+    if args.trace:
+        tracer.configure(args.trace)
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    if args.metrics_textfile:
+        start_textfile_exporter(args.metrics_textfile)
     os.makedirs(config['COMMIT_DIFF_DIRECTORY'], exist_ok=True)
+    if args.manifest:
+        try:
+            await run_batch(args, config)
+        finally:
+            finish_run(args)
+        return
 
     # Determine repository type and get URL
-    if args.repo_path.startswith(("http", "git@")):
-        repo_url = args.repo_path
-        repo_path = os.path.join(config['COMMIT_DIFF_DIRECTORY'], os.path.basename(repo_url).replace(".git", ""))
-        # Clone if the directory doesn't exist
-        if not os.path.exists(repo_path):
-            logger.info(f"Cloning remote repository to {repo_path}")
-            git.Repo.clone_from(repo_url, repo_path)
-    else:
-        # Get absolute path for local repositories
-        repo_path = os.path.abspath(args.repo_path)
+    try:
+        repo_path = resolve_repository(args.repo_path, args, config)
+    except RuntimeError as e:
+        logger.error(f"Failed to clone or fetch {args.repo_path}: {e}")
+        return
+    if not is_remote_url(args.repo_path):
         logger.info(f"Using local repository path: {repo_path}")
         analyzer = GitAnalyzer(repo_path)
         repo_url = analyzer.get_repo_url()
@@ -674,54 +1329,79 @@ async def main():
         except Exception as e:
             logger.critical(f"Error during restore: {e}")
             return  # Exit on restore error
-    # BACKUP REFS IMMEDIATELY AFTER LOADING REPOSITORY
-    try:
-        logger.info("Backing up refs before any operations...")
-        updater.backup_refs()
-    except Exception as e:
-        logger.critical(f"Error during initial backup: {e}")
-        return  # Exit on backup error
+    # Refs are snapshotted by rewrite_commit_messages, right before they move: a cancelled run leaves none
 
     # 2. Load Commit History
     logger.info("Loading commit history...")
     try:
         analyzer = GitAnalyzer(repo_path)
-        commits = analyzer.get_commits() # Now get commits with diffs
+        commits, watermark = load_commits(analyzer, args)
         # Get the repo object from the analyzer
         repo = analyzer.repo
-
-        commit_history = CommitHistory()
-        commit_history.commits = commits  # Assign the commits to the history object
         for i, commit in enumerate(commits):
             logger.info(f"Commit {i + 1}/{len(commits)}: {commit.hash}")
     except Exception as e:
-        logging.error(f"Failed to load commit history: {e}")
+        logger.error(f"Failed to load commit history: {e}")
         return
 
-    logging.info(f"Loaded {len(commits)} commits from repository.")
+    logger.info(f"Loaded {len(commits)} commits from repository.")
+    if args.plan:
+        plan = plan_run(analyzer, commits, args, config)
+        print(plan)
+        return plan
+    if watermark and not commits:
+        advance_watermark(repo_path, commits, watermark, args)
+        logger.info("No new commits since the watermark. Nothing to do.")
+        return
 
     # 3. Initialize LLM Interface
-    client = create_client(args.llm, config)
-    logging.info(f"Initialized LLM client: {client}")
+    client = create_client(args.llm, config, args.model)
+    if args.record:
+        client = ReplayClient(args.record, upstream=client)
+        logger.info(f"Recording LLM responses to {args.record}")
+    logger.info(f"Initialized LLM client: {client}")
+
+    # 4. Generate new messages
+    budget = run_budget(args, config)
+    try:
+        await generate_messages(commits, analyzer, client, args,
+                                asyncio.Semaphore(config['MAX_CONCURRENT_REQUESTS']), budget=budget)
+    finally:
+        finish_run(args)
+    if budget:
+        logger.info(budget.summary())
+
+    if args.message_map:
+        write_message_map(args.message_map, commits, args.repo_path, shard=args.shard and shard_label(args.shard))
+    if args.shard:
+        logger.info("Shard done. Combine the shard files with 'python main.py merge'.")
+        return
+    if command == "generate":
+        if watermark:  # As in batch; 'apply' then carries it onto the rewritten history
+            advance_watermark(repo_path, commits, watermark, args)
+        logger.info(f"Messages written to {args.message_map}. Rewrite with 'python main.py apply'.")
+        return
 
-    # 4. Process each commit asynchronously, limited by semaphore
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = [process_commit(commit, analyzer, client, args.model, repo_path, semaphore) for commit in commits]
-    await asyncio.gather(*tasks)  # Execute tasks concurrently
+    # With --commit-store, the remaining steps read commits back from SQLite instead of memory
+    commit_history = SQLiteCommitStore(args.commit_store, repo) if args.commit_store else CommitHistory()
+    commit_history.commits = commits
+    del commits
 
     # 5. User Confirmation before Rewrite
     if user_confirms_rewrite(commit_history):
         # updater = RepositoryUpdater(repo_path)
         try:
-            logging.info("Rewriting commit messages...")
+            logger.info("Rewriting commit messages...")
             save_commit_messages_to_log(commit_history)
-            updater.rewrite_commit_messages(commit_history)
+            rewritten = updater.rewrite_commit_messages(commit_history, args.refs or ("HEAD",))
         except Exception as e:
-            logging.critical(
+            logger.critical(
                 f"An error occurred during the rewrite process. "
                 f"'python {__file__} --restore'. Error: {e}"
             )
             return  # Stop execution after error
+        if watermark:  # Only now: a declined or failed rewrite leaves the commits for the next run
+            advance_watermark(repo_path, commit_history.commits, watermark, args, rewritten)
 
         # 6. Force push (if enabled and user is aware)
         if args.force_push:
@@ -733,29 +1413,25 @@ async def main():
                     "Are you absolutely sure you want to force push? (yes/no): "
                 ).lower()
                 if force_confirm in ("yes", "y"):
-                    logging.info(
+                    logger.info(
                         "Force pushing changes to remote repository..."
                     )
                     try:
-                        repo.git.push(
-                            "--force-with-lease",
-                            "origin",
-                            repo.active_branch.name,
-                        )
-                        logging.info("Successfully force-pushed changes.")
+                        updater.force_push(args.refs or ("HEAD",))
+                        logger.info("Successfully force-pushed changes.")
                         break  # Exit confirmation loop
                     except Exception as e:
-                        logging.error(f"Error force pushing changes: {e}")
+                        logger.error(f"Error force pushing changes: {e}")
                         return  # Stop execution after error
                 elif force_confirm in ("no", "n"):
-                    logging.info("Force push cancelled.")
+                    logger.info("Force push cancelled.")
                     break  # Exit confirmation loop
                 else:
                     print("Invalid input. Please enter 'yes' or 'no'.")
     else:
-        logging.info("Rewrite cancelled by user.")
+        logger.info("Rewrite cancelled by user.")
 
-    logging.info("OCDG process completed!")
+    logger.info("OCDG process completed!")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
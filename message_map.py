@@ -0,0 +1,80 @@
+import argparse
+import json
+from typing import Iterable, Iterator, List
+
+from loguru import logger
+
+
+def commit_entry(commit, repo: str, shard: str = None) -> dict:
+    """One message-map line: the generated message for a commit plus what is needed to review it."""
+    entry = {
+        "repo": repo,
+        "hash": commit.hash,
+        "author": commit.author,
+        "date": commit.date,
+        "message": commit.message,
+        "new_message": commit.new_message,
+        "trivial_rule": commit.trivial_rule,
+    }
+    if shard:
+        entry["shard"] = shard
+    return entry
+
+
+def write_message_map(path: str, commits: Iterable, repo: str, append: bool = False, shard: str = None) -> int:
+    """Writes commits that got a new message as JSONL; returns how many were written."""
+    written = 0
+    with open(path, "a" if append else "w") as f:
+        for commit in commits:
+            if commit.new_message:
+                f.write(json.dumps(commit_entry(commit, repo, shard)) + "\n")
+                written += 1
+    logger.info(f"Wrote {written} messages for {repo} to {path}")
+    return written
+
+
+def read_message_map(path: str) -> Iterator[dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def merge_message_maps(paths: List[str], output: str) -> int:
+    """
+    Combines message maps (e.g. one per --shard) into `output`; returns the number of commits.
+
+    A commit listed twice keeps its first message. Shards that contributed no lines are
+    reported, since a shard whose file is missing and one with no commits look the same.
+    """
+    merged, shards = {}, {}
+    for path in paths:
+        for entry in read_message_map(path):
+            key = (entry["repo"], entry["hash"])
+            if key in merged:
+                if merged[key]["new_message"] != entry["new_message"]:
+                    logger.warning(f"{entry['hash']} ({entry['repo']}) has different messages; keeping the first")
+                continue
+            merged[key] = entry
+            if "shard" in entry:
+                index, count = entry["shard"].split("/")
+                shards.setdefault(int(count), set()).add(int(index))
+    for count, seen in shards.items():
+        missing = sorted(set(range(1, count + 1)) - seen)
+        if missing:
+            logger.warning(f"No messages from shard(s) {', '.join(f'{i}/{count}' for i in missing)}")
+    with open(output, "w") as f:
+        for entry in merged.values():
+            f.write(json.dumps(entry) + "\n")
+    logger.info(f"Merged {len(merged)} messages from {len(paths)} files into {output}")
+    return len(merged)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Message map utilities.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    merge = commands.add_parser("merge", help="Combine message maps, e.g. the outputs of --shard runs.")
+    merge.add_argument("inputs", nargs="+", help="Message map files.")
+    merge.add_argument("-o", "--output", required=True, help="Merged message map.")
+    args = parser.parse_args()
+    merge_message_maps(args.inputs, args.output)
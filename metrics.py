@@ -0,0 +1,217 @@
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from tracing import tracer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry: List['_Metric'] = []
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """Thread-safe metric family keyed by label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _add(self, amount: float, labels: dict):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def total(self) -> float:
+        """Sum over all label values."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        self._add(amount, labels)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1, **labels):
+        self._add(-amount, labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self._observations: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._observations.setdefault(key, [0] * (len(self.buckets) + 2))  # buckets, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, counts in sorted(self._observations.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', str(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {counts[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+COMMITS_PROCESSED = Counter("ocdg_commits_processed_total", "Commits finished, by result.")
+COMMIT_DURATION = Histogram("ocdg_commit_duration_seconds", "Wall time per processed commit.")
+COMMITS_QUEUED = Gauge("ocdg_commits_queued", "Commits waiting for a processing slot.")
+LLM_REQUESTS = Counter("ocdg_llm_requests_total", "LLM requests, by provider and outcome.")
+LLM_REQUEST_DURATION = Histogram("ocdg_llm_request_duration_seconds", "LLM request latency, by provider.")
+LLM_IN_FLIGHT = Gauge("ocdg_llm_requests_in_flight", "LLM requests currently awaiting a response.")
+LLM_RETRIES = Counter("ocdg_llm_retries_total", "Retries performed by retry_with_backoff.")
+LLM_PROMPT_TOKENS = Counter("ocdg_llm_prompt_tokens_total", "Prompt tokens sent, estimated as chars/4.")
+LLM_COMPLETION_TOKENS = Counter("ocdg_llm_completion_tokens_total", "Completion tokens received, estimated as chars/4.")
+JSON_RESPONSES = Counter("ocdg_json_responses_total", "LLM responses checked against the JSON schema, by outcome.")
+JSON_FAILURES = Counter("ocdg_json_failures_total", "Generations that never produced valid JSON.")
+CACHE_LOOKUPS = Counter("ocdg_cache_lookups_total", "Message reuse lookups, by cache and result.")
+LLM_USAGE_PROMPT_TOKENS = Counter("ocdg_llm_usage_prompt_tokens_total", "Prompt tokens reported by the provider.")
+LLM_CACHED_PROMPT_TOKENS = Counter("ocdg_llm_cached_prompt_tokens_total",
+                                   "Prompt tokens the provider served from its prompt cache.")
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Rough token estimate used when providers do not report usage."""
+    return len(text or "") // 4
+
+
+def record_prompt_usage(provider: str, usage) -> None:
+    """Counts provider-reported prompt and cached prompt tokens from an OpenAI-style `usage` object."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    LLM_USAGE_PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", None) or 0, provider=provider)
+    LLM_CACHED_PROMPT_TOKENS.inc(cached, provider=provider)
+    tracer.add("cached_tokens", cached)
+
+
+def prompt_cache_hit_rate() -> Optional[float]:
+    """Share of provider-reported prompt tokens served from cache, or None without usage data."""
+    prompt = sum(LLM_USAGE_PROMPT_TOKENS._values.values())
+    return sum(LLM_CACHED_PROMPT_TOKENS._values.values()) / prompt if prompt else None
+
+
+def record_llm_request(provider: str):
+    """Decorator for client `async_generate_text` methods: counts, timing, in-flight and token estimates."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, system_prompt, prompt, **kwargs):
+            LLM_IN_FLIGHT.inc(provider=provider)
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                text = await func(self, system_prompt, prompt, **kwargs)
+                outcome = "success"
+                LLM_COMPLETION_TOKENS.inc(estimate_tokens(text), provider=provider)
+                return text
+            finally:
+                LLM_IN_FLIGHT.dec(provider=provider)
+                LLM_REQUESTS.inc(provider=provider, outcome=outcome)
+                LLM_REQUEST_DURATION.observe(time.perf_counter() - start, provider=provider)
+                LLM_PROMPT_TOKENS.inc(estimate_tokens(system_prompt) + estimate_tokens(prompt), provider=provider)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics: {format % args}")
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves /metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="ocdg-metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def write_textfile(path: str):
+    """Atomically writes all metrics to a file for node_exporter's textfile collector."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+
+def start_textfile_exporter(path: str, interval: float = 15.0) -> threading.Event:
+    """Rewrites the textfile every `interval` seconds until the returned event is set."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            write_textfile(path)
+
+    threading.Thread(target=loop, name="ocdg-metrics-textfile", daemon=True).start()
+    return stop
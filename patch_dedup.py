@@ -0,0 +1,88 @@
+import subprocess
+import tempfile
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from tracing import tracer
+
+
+def compute_patch_ids(repo_path: str, commit_hashes: List[str]) -> Dict[str, str]:
+    """
+    Computes stable patch-ids for many commits in a single git pass.
+
+    Pipes `git diff-tree --stdin -p` into `git patch-id --stable`. Merge commits
+    produce no patch and are absent from the result.
+    """
+    if not commit_hashes:
+        return {}
+    with tempfile.TemporaryFile(mode="w+") as hashes_file:
+        hashes_file.write("\n".join(commit_hashes) + "\n")
+        hashes_file.seek(0)
+        diff_tree = subprocess.Popen(
+            ["git", "diff-tree", "--stdin", "-p", "-r", "--root", "--no-color"],
+            cwd=repo_path, stdin=hashes_file, stdout=subprocess.PIPE,
+        )
+        try:
+            output = subprocess.run(
+                ["git", "patch-id", "--stable"],
+                cwd=repo_path, stdin=diff_tree.stdout, capture_output=True, text=True, check=True,
+            ).stdout
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Git command failed: {e.stderr}") from e
+        finally:
+            diff_tree.stdout.close()
+            diff_tree.wait()
+
+    patch_ids = {}
+    for line in output.splitlines():
+        patch_id, commit_hash = line.split()
+        patch_ids[commit_hash] = patch_id
+    logger.info(f"Computed patch-ids for {len(patch_ids)}/{len(commit_hashes)} commits.")
+    return patch_ids
+
+
+def deduplicate_commits(commits: List['Commit'], patch_ids: Dict[str, str]) -> Tuple[List['Commit'], Dict[str, List['Commit']]]:
+    """
+    Picks one commit per unique patch and groups the copies behind it.
+
+    The oldest commit of each patch (the original, not the cherry-pick) is kept.
+    Returns (unique_commits, {original_hash: [duplicate commits]}), with
+    unique_commits in the original order.
+    """
+    originals: Dict[str, 'Commit'] = {}
+    duplicates: Dict[str, List['Commit']] = {}
+    # git log lists newest first, so walk backwards to meet originals first
+    for commit in reversed(commits):
+        patch_id = patch_ids.get(commit.hash)
+        if patch_id is None:
+            continue
+        if patch_id in originals:
+            duplicates.setdefault(originals[patch_id].hash, []).append(commit)
+        else:
+            originals[patch_id] = commit
+
+    duplicate_hashes = {commit.hash for copies in duplicates.values() for commit in copies}
+    unique_commits = [commit for commit in commits if commit.hash not in duplicate_hashes]
+    logger.info(
+        f"{len(duplicate_hashes)} duplicate commits share a patch with another commit; "
+        f"{len(unique_commits)} unique commits remain."
+    )
+    return unique_commits, duplicates
+
+
+def fan_out_messages(commits: List['Commit'], duplicates: Dict[str, List['Commit']], cherry_pick_note: bool = False) -> int:
+    """Copies generated messages from each original commit to its duplicates. Returns the number filled."""
+    by_hash = {commit.hash: commit for commit in commits}
+    filled = 0
+    for original_hash, copies in duplicates.items():
+        original = by_hash.get(original_hash)
+        if original is None or not original.new_message:
+            continue
+        for commit in copies:
+            commit.new_message = original.new_message
+            tracer.event("dedup_reuse", commit=commit.hash, cache_hit=True, original=original_hash)
+            if cherry_pick_note:
+                commit.new_message += f"\n\n(cherry picked from commit {original_hash})"
+            filled += 1
+    return filled
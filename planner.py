@@ -0,0 +1,258 @@
+import math
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from config import LOCKFILE_PATTERNS, PLAN_COMPLETION_TOKENS, PLAN_SECONDS_PER_REQUEST, DIFF_MAX_FILE_BYTES, \
+    DIFF_MAX_FILE_LINES, DIFF_MAX_TOTAL_BYTES
+from diff_budget import FileStat, plan_diff
+from diff_filter import IGNORED_SECTION_RE
+from cascade import CONVENTIONAL_TITLE_PATTERN
+from metrics import LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS
+
+PRIORITIES = ("recent", "oldest", "worst")
+_LOCKFILE_RE = re.compile("|".join(LOCKFILE_PATTERNS))
+_GENERIC_TITLE_RE = re.compile(r"^(wip|fix(es|ed)?|update[sd]?|changes?|misc|stuff|tmp|test|minor|cleanup|\.+)\W*$", re.I)
+
+
+def default_chunk_size(model: str) -> int:
+    """Chunk size (characters) when none is calibrated or given: llama3 takes whole diffs."""
+    return 100_000 if model == "llama3" else 7900
+
+
+class Estimate:
+    """Predicted LLM requests, tokens and sequential seconds."""
+
+    __slots__ = ("requests", "tokens", "seconds")
+
+    def __init__(self, requests: int = 0, tokens: int = 0, seconds: float = 0.0):
+        self.requests = requests
+        self.tokens = tokens
+        self.seconds = seconds
+
+    def __add__(self, other: 'Estimate') -> 'Estimate':
+        return Estimate(self.requests + other.requests, self.tokens + other.tokens, self.seconds + other.seconds)
+
+
+class CostModel:
+    """
+    How one provider profile turns a filtered diff into requests, tokens and time.
+
+    Diffs of at least `chunk_size` characters are split and need one more request to
+    combine the parts. Latency comes from the profile's calibration steps at its concurrency,
+    or PLAN_SECONDS_PER_REQUEST when it was never calibrated.
+    """
+
+    def __init__(self, name: str, chunk_size: int, concurrency: int, overhead_chars: int, steps: List[dict] = None):
+        self.name = name
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.overhead_chars = overhead_chars  # System prompt and prompt template around each chunk
+        self.steps = sorted((step for step in steps or () if step["concurrency"] == concurrency and step["errors"] == 0),
+                            key=lambda step: step["size"])
+
+    @classmethod
+    def from_profile(cls, name: str, profile: dict, model: str, overhead_chars: int, chunk_size: int = None,
+                     concurrency: int = None) -> 'CostModel':
+        return cls(name, chunk_size or profile.get("chunk_size") or default_chunk_size(model),
+                   concurrency or profile.get("concurrency", 1), overhead_chars, profile.get("steps"))
+
+    def seconds_per_request(self, chars: int) -> float:
+        """p50 latency of the smallest calibrated size that covers `chars`, else the largest one."""
+        if not self.steps:
+            return PLAN_SECONDS_PER_REQUEST
+        for step in self.steps:
+            if step["size"] >= chars:
+                return step["p50"]
+        return self.steps[-1]["p50"]
+
+    def estimate(self, diff_chars: int) -> Estimate:
+        chunks = math.ceil(diff_chars / self.chunk_size) if diff_chars >= self.chunk_size else 1
+        sizes = [min(self.chunk_size, diff_chars - i * self.chunk_size) for i in range(chunks)]
+        if chunks > 1:
+            sizes.append(chunks * PLAN_COMPLETION_TOKENS * 4)  # The combine request quotes every partial answer
+        tokens = sum((self.overhead_chars + size) // 4 + PLAN_COMPLETION_TOKENS for size in sizes)  # As estimate_tokens
+        return Estimate(len(sizes), tokens, sum(self.seconds_per_request(size) for size in sizes))
+
+    def wall_seconds(self, estimate: Estimate) -> float:
+        return estimate.seconds / self.concurrency
+
+
+def predicted_diff_chars(stats: List[FileStat], max_file_bytes: int = DIFF_MAX_FILE_BYTES,
+                         max_file_lines: int = DIFF_MAX_FILE_LINES, max_total_bytes: int = DIFF_MAX_TOTAL_BYTES) -> int:
+    """
+    Filtered diff size predicted from sizes alone: ignored sections dropped, the diff budget applied.
+    The line patterns only remove single lines (e.g. the '---'/'+++' headers), never a whole file.
+    """
+    kept = [stat for stat in stats if not IGNORED_SECTION_RE.search(f"diff --git a/{stat.path} b/{stat.path}")]
+    fetched, omitted = plan_diff(kept, max_file_bytes, max_file_lines, max_total_bytes)
+    return sum(stat.estimated_bytes for stat in fetched) + sum(len(stat.summary()) for stat in omitted)
+
+
+def predicted_trivial(parents: Optional[List[str]], stats: List[FileStat], trivial_rules) -> bool:
+    """Merges, empty or initial commits and lockfile-only commits; other trivial rules need the diff itself."""
+    if parents and len(parents) > 1 and "merge" in trivial_rules:
+        return True
+    if (not parents or not stats) and "empty" in trivial_rules:
+        return True
+    return bool(stats) and "lockfile" in trivial_rules and all(_LOCKFILE_RE.search(stat.path) for stat in stats)
+
+
+def message_badness(message: str) -> int:
+    """Higher for messages more in need of a rewrite: short, generic, unconventional, no body."""
+    lines = (message or "").strip().splitlines()
+    title = lines[0].strip() if lines else ""
+    score = 0
+    if _GENERIC_TITLE_RE.match(title):
+        score += 4
+    if len(title) < 12:
+        score += 2
+    if len(title.split()) < 3:
+        score += 2
+    if not CONVENTIONAL_TITLE_PATTERN.match(title):
+        score += 1
+    if len(lines) < 3:
+        score += 1
+    return score
+
+
+def prioritize(commits: Sequence, priority: str = "recent") -> list:
+    """Commits in processing order; `commits` come newest first, as `git log` lists them."""
+    if priority == "oldest":
+        return list(reversed(commits))
+    if priority == "worst":
+        return sorted(commits, key=lambda commit: -message_badness(commit.message))  # Stable: newest first on ties
+    return list(commits)
+
+
+class CommitPlan:
+    """A commit's predicted filtered diff size and whether it will reach the LLM."""
+
+    __slots__ = ("commit", "diff_chars", "trivial")
+
+    def __init__(self, commit, diff_chars: int, trivial: bool):
+        self.commit = commit
+        self.diff_chars = diff_chars
+        self.trivial = trivial
+
+    def estimate(self, model: CostModel) -> Estimate:
+        return Estimate() if self.trivial else model.estimate(self.diff_chars)
+
+
+def plan_commits(commits: Sequence, stats: Dict[str, List[FileStat]], trivial_rules, diff_budget=()) -> List[CommitPlan]:
+    return [CommitPlan(commit, predicted_diff_chars(stats.get(commit.hash, []), *diff_budget),
+                       predicted_trivial(commit.parents, stats.get(commit.hash, []), trivial_rules))
+            for commit in commits]
+
+
+def fits_budget(plans: List[CommitPlan], model: CostModel, tokens: int = None, seconds: float = None) -> int:
+    """How many LLM commits of `plans` a run with these budgets would send."""
+    budget = Budget(model, tokens, seconds)
+    budget.select(plans)
+    return budget.selected
+
+
+def format_plan(plans: List[CommitPlan], models: List[CostModel], tokens: int = None, seconds: float = None) -> str:
+    """One row per provider profile: requests, tokens and wall time for the whole run, and what fits the budget."""
+    llm_commits = sum(1 for plan in plans if not plan.trivial)
+    lines = [f"{len(plans)} commits, {llm_commits} need the LLM ({len(plans) - llm_commits} predicted trivial)",
+             f"{'profile':<40}{'chunk':>8}{'conc':>6}{'requests':>10}{'tokens':>12}{'time':>10}"
+             + (f"{'in budget':>11}" if tokens is not None or seconds is not None else "")]
+    for model in models:
+        total = Estimate()
+        for plan in plans:
+            total = total + plan.estimate(model)
+        row = (f"{model.name:<40}{model.chunk_size:>8}{model.concurrency:>6}{total.requests:>10}{total.tokens:>12}"
+               f"{_duration(model.wall_seconds(total)):>10}")
+        if tokens is not None or seconds is not None:
+            row += f"{fits_budget(plans, model, tokens, seconds):>11}"
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def _duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def _tokens_recorded() -> float:
+    return LLM_PROMPT_TOKENS.total() + LLM_COMPLETION_TOKENS.total()
+
+
+class Budget:
+    """
+    Token and wall-time limits for a run.
+
+    Before generation, `select` keeps the prioritized commits up to the first one whose
+    predicted cost no longer fits. During generation, `admit` guards against wrong
+    predictions: once the tokens the clients recorded, plus the estimates of commits still in
+    flight, or the elapsed time, plus a commit's own estimate would pass a limit, that commit
+    and every later one are refused. Each admitted commit holds its estimate until `release`,
+    so concurrent commits cannot all pass on the same recorded total. Either way the run
+    stops cleanly and the rest is left for a later run.
+    """
+
+    def __init__(self, model: CostModel, tokens: int = None, seconds: float = None):
+        self.model = model
+        self.tokens = tokens
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.recorded_before = _tokens_recorded()
+        self.planned = Estimate()
+        self.reserved = 0  # Estimated tokens of admitted commits whose usage is not recorded yet
+        self.selected = 0  # Commits planned for the LLM
+        self.deferred = 0  # Commits left for a later run
+        self.full = False  # Planning stopped
+        self.stopped = False  # Generation stopped
+
+    def recorded_tokens(self) -> int:
+        return int(_tokens_recorded() - self.recorded_before)
+
+    def select(self, plans: List[CommitPlan]) -> list:
+        """The commits of `plans` that fit, in order; trivial ones cost nothing and always stay."""
+        selected = []
+        for plan in plans:
+            total = self.planned + plan.estimate(self.model)
+            fits = (self.tokens is None or total.tokens <= self.tokens) and \
+                (self.seconds is None or self.model.wall_seconds(total) <= self.seconds)
+            if plan.trivial or (fits and not self.full):
+                self.planned = total
+                self.selected += not plan.trivial
+                selected.append(plan.commit)
+            else:
+                self.full = True
+                self.deferred += 1
+        return selected
+
+    def admit(self, diff_chars: int) -> bool:
+        """
+        Whether a selected commit, with its actual filtered diff, may still call the LLM.
+        An admitted commit reserves its estimate; call `release` with the same size once it is done.
+        """
+        estimate = self.model.estimate(diff_chars)
+        if not self.stopped and (
+                (self.tokens is not None and self.recorded_tokens() + self.reserved + estimate.tokens > self.tokens)
+                or (self.seconds is not None and time.monotonic() - self.start + self.model.wall_seconds(estimate) > self.seconds)):
+            self.stopped = True
+            logger.warning("Budget exhausted during generation; remaining commits are left for a later run")
+        if self.stopped:
+            self.selected -= 1
+            self.deferred += 1
+            return False
+        self.reserved += estimate.tokens
+        return True
+
+    def release(self, diff_chars: int):
+        """Drops an admitted commit's reservation; its actual usage is in the recorded tokens by now."""
+        self.reserved -= self.model.estimate(diff_chars).tokens
+
+    def summary(self) -> str:
+        limits = ", ".join(part for part in (self.tokens is not None and f"{self.tokens} tokens",
+                                             self.seconds is not None and f"{self.seconds:.0f}s") if part)
+        return (f"Budget ({limits}): {self.selected} commits sent to the LLM, {self.deferred} left for a later run; "
+                f"~{max(self.planned.tokens, self.recorded_tokens())} tokens, {time.monotonic() - self.start:.0f}s")
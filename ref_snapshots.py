@@ -0,0 +1,103 @@
+import subprocess
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+SNAPSHOT_PREFIX = "refs/ocdg/backup/"  # Snapshot refs keep objects alive and are never pushed or fetched
+SNAPSHOT_SOURCES = ("refs/heads/", "refs/tags/", "refs/remotes/")
+
+
+def _git(repo_path: str, args: List[str], input: str = None) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=repo_path, input=input, capture_output=True, text=True,
+                              check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Git command failed: {e.stderr.strip()}") from e
+
+
+def _refs(repo_path: str, *patterns: str) -> Dict[str, str]:
+    output = _git(repo_path, ["for-each-ref", "--format=%(refname) %(objectname)", *patterns])
+    return dict(line.split(" ") for line in output.splitlines())
+
+
+def _detached_head(repo_path: str) -> Optional[str]:
+    if subprocess.run(["git", "symbolic-ref", "-q", "HEAD"], cwd=repo_path, capture_output=True).returncode == 0:
+        return None
+    return _git(repo_path, ["rev-parse", "--verify", "HEAD"]).strip()
+
+
+def _transaction(repo_path: str, commands: List[str], message: str):
+    """Applies update-ref commands atomically: all of them or none."""
+    _git(repo_path, ["update-ref", "--no-deref", "-m", message, "--stdin"],
+         "start\n" + "".join(f"{command}\n" for command in commands) + "prepare\ncommit\n")
+
+
+def list_snapshots(repo_path: str) -> List[Tuple[str, int]]:
+    """(name, number of refs) for every snapshot, oldest first."""
+    counts = Counter(refname[len(SNAPSHOT_PREFIX):].split("/", 1)[0] for refname in _refs(repo_path, SNAPSHOT_PREFIX))
+    return sorted(counts.items())
+
+
+def create_snapshot(repo_path: str) -> str:
+    """
+    Copies all branches, tags and remote-tracking refs (and a detached HEAD) to
+    refs/ocdg/backup/<UTC timestamp>/<refname> in one transaction; returns the snapshot name.
+    """
+    existing = {name for name, _ in list_snapshots(repo_path)}
+    name = base = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    suffix = 1
+    while name in existing:
+        suffix += 1
+        name = f"{base}-{suffix}"
+    refs = _refs(repo_path, *SNAPSHOT_SOURCES)
+    head = _detached_head(repo_path)
+    if head:
+        refs["HEAD"] = head
+    if not refs:
+        logger.warning("No refs to snapshot")
+        return name
+    _transaction(repo_path, [f"create {SNAPSHOT_PREFIX}{name}/{refname} {oid}" for refname, oid in refs.items()],
+                 f"ocdg: snapshot {name}")
+    logger.info(f"Snapshot {name}: {len(refs)} refs saved under {SNAPSHOT_PREFIX}{name}/")
+    return name
+
+
+def read_snapshot(repo_path: str, name: str) -> Dict[str, str]:
+    """{refname: oid} as saved in snapshot `name`; a detached HEAD is saved as "HEAD"."""
+    prefix = f"{SNAPSHOT_PREFIX}{name}/"
+    return {refname[len(prefix):]: oid for refname, oid in _refs(repo_path, prefix).items()}
+
+
+def restore_snapshot(repo_path: str, name: str = None) -> str:
+    """
+    Resets every ref saved in snapshot `name` (default: the latest) in one transaction and
+    returns the name. Refs created after the snapshot are left alone; the working tree is
+    not touched, which is exact for message-only rewrites.
+    """
+    snapshots = [snapshot for snapshot, _ in list_snapshots(repo_path)]
+    if not snapshots:
+        raise RuntimeError("No ref snapshots to restore")
+    name = name or snapshots[-1]
+    if name not in snapshots:
+        raise RuntimeError(f"No ref snapshot named {name}")
+    saved = read_snapshot(repo_path, name)
+    if "HEAD" in saved and not _detached_head(repo_path):
+        del saved["HEAD"]  # HEAD is on a branch again; restoring the branch is enough
+    _transaction(repo_path, [f"update {refname} {oid}" for refname, oid in saved.items()],
+                 f"ocdg: restore snapshot {name}")
+    logger.info(f"Restored {len(saved)} refs from snapshot {name}")
+    return name
+
+
+def prune_snapshots(repo_path: str, keep: int) -> List[str]:
+    """Deletes all but the `keep` newest snapshots in one transaction; returns the deleted names."""
+    snapshots = [snapshot for snapshot, _ in list_snapshots(repo_path)]
+    pruned = snapshots[:max(len(snapshots) - keep, 0)]
+    if pruned:
+        refs = _refs(repo_path, *(f"{SNAPSHOT_PREFIX}{name}/" for name in pruned))
+        _transaction(repo_path, [f"delete {refname} {oid}" for refname, oid in refs.items()],
+                     "ocdg: prune snapshots")
+        logger.info(f"Pruned {len(pruned)} snapshots ({len(refs)} refs)")
+    return pruned
@@ -0,0 +1,110 @@
+import os
+import subprocess
+from typing import List, Optional
+
+from loguru import logger
+
+REMOTE_PREFIXES = ("http://", "https://", "git@", "ssh://", "git://", "file://")
+PARTIAL_CLONE_FILTER = "blob:none"  # Blobs are fetched on demand, only for the commits whose diffs are read
+
+
+def is_remote_url(path: str) -> bool:
+    return path.startswith(REMOTE_PREFIXES)
+
+
+def clone_path(url: str, base_dir: str) -> str:
+    """Where a remote repository is cloned: `base_dir/<name without .git>`."""
+    name = os.path.basename(url.rstrip("/"))
+    return os.path.join(base_dir, name[:-4] if name.endswith(".git") else name)
+
+
+def _git(args: List[str], cwd: str = None) -> str:
+    logger.debug(f"Running git command: git {' '.join(args)}")
+    try:
+        return subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Git command failed: {e.stderr.strip()}") from e
+
+
+def _shallow_args(depth: Optional[int], shallow_since: Optional[str]) -> List[str]:
+    args = []
+    if depth:
+        args.append(f"--depth={depth}")
+    if shallow_since:
+        args.append(f"--shallow-since={shallow_since}")
+    return args
+
+
+def _deepen_past_cutoff(path: str, shallow_since: Optional[str]):
+    """Fetches one generation past a --shallow-since cutoff, so the oldest commits after it keep their parents."""
+    if shallow_since and shallow_boundary(os.path.join(path, ".git")):
+        _git(["fetch", "--quiet", "--deepen=1", "origin"], path)
+
+
+def _deepen_args(path: str, depth: Optional[int], shallow_since: Optional[str]) -> List[str]:
+    """
+    Fetch options that give an existing shallow clone the history a new scope needs, or [].
+
+    Only ever deepens: `--depth`/`--shallow-since` on a fetch would also cut a clone that
+    already has more history, so each is used only when the clone falls short of it.
+    """
+    boundary = shallow_boundary(os.path.join(path, ".git"))
+    if not boundary:
+        return []  # Full clone
+    if not depth and not shallow_since:
+        return ["--unshallow"]
+    if depth:
+        try:
+            tip = _git(["rev-parse", "--verify", "@{upstream}"], path)
+        except RuntimeError:
+            tip = "HEAD"
+        available = int(_git(["rev-list", "--count", tip], path))
+        return [f"--deepen={depth - available}"] if available < depth else []
+    cutoff = int(_git(["rev-parse", f"--since={shallow_since}"], path).split("=", 1)[1])
+    boundary_dates = _git(["show", "--no-patch", "--format=%ct", *boundary], path).split()
+    if all(int(date) > cutoff for date in boundary_dates):  # Every edge is newer than the cutoff: deepen to it
+        return [f"--shallow-since={shallow_since}"]
+    return []
+
+
+def clone_or_fetch(url: str, path: str, depth: int = None, shallow_since: str = None,
+                   filter_spec: str = PARTIAL_CLONE_FILTER) -> str:
+    """
+    Makes `path` an up-to-date clone of `url` and returns it.
+
+    New clones are partial (`--filter=blob:none`) and, with `depth` or `shallow_since`,
+    shallow. An existing clone is refreshed with an incremental fetch and its branch
+    fast-forwarded; a branch that no longer fast-forwards (e.g. rewritten locally) is kept.
+    A shallow clone is deepened when the new scope reaches further back, never shortened.
+    """
+    if not os.path.exists(path):
+        logger.info(f"Cloning {url} to {path} (filter={filter_spec}, depth={depth}, since={shallow_since})")
+        filter_args = [f"--filter={filter_spec}"] if filter_spec else []
+        _git(["clone", "--quiet", *filter_args, *_shallow_args(depth, shallow_since), url, path])
+        _deepen_past_cutoff(path, shallow_since)
+        return path
+
+    origin = _git(["remote", "get-url", "origin"], path)
+    if origin != url:
+        logger.warning(f"{path} tracks {origin}, not {url}; fetching from its own origin")
+    logger.info(f"Fetching new commits into existing clone {path}")
+    _git(["fetch", "--quiet", "origin"], path)  # A shallow clone keeps its boundary, never loses history
+    deepen = _deepen_args(path, depth, shallow_since)
+    if deepen:
+        logger.info(f"Deepening shallow clone {path} for the new scope ({' '.join(deepen)})")
+        _git(["fetch", "--quiet", "origin", *deepen], path)
+        _deepen_past_cutoff(path, shallow_since)
+    try:
+        _git(["merge", "--ff-only", "--quiet", "@{upstream}"], path)
+    except RuntimeError as e:
+        logger.warning(f"Keeping the local branch in {path}; it does not fast-forward to origin: {e}")
+    return path
+
+
+def shallow_boundary(git_dir: str) -> set:
+    """Commits at the edge of a shallow clone; their parents are missing, so their diffs cannot be read."""
+    shallow_file = os.path.join(git_dir, "shallow")
+    if not os.path.exists(shallow_file):
+        return set()
+    with open(shallow_file) as f:
+        return {line.strip() for line in f if line.strip()}
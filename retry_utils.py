@@ -4,6 +4,9 @@ from functools import wraps
 from typing import Callable, TypeVar, Any
 from loguru import logger
 
+from metrics import LLM_RETRIES
+from tracing import tracer
+
 T = TypeVar('T')
 
 
@@ -43,6 +46,8 @@ def retry_with_backoff(
                         f"{func.__name__} attempt {attempt + 1}/{max_retries + 1} failed: {e}. "
                         f"Retrying in {delay:.2f}s..."
                     )
+                    tracer.add("retries")
+                    LLM_RETRIES.inc(function=func.__name__)
                     time.sleep(delay)
                     delay = min(delay * exponential_base, max_delay)
 
@@ -66,6 +71,8 @@ def retry_with_backoff(
                         f"{func.__name__} attempt {attempt + 1}/{max_retries + 1} failed: {e}. "
                         f"Retrying in {delay:.2f}s..."
                     )
+                    tracer.add("retries")
+                    LLM_RETRIES.inc(function=func.__name__)
                     await asyncio.sleep(delay)
                     delay = min(delay * exponential_base, max_delay)
 
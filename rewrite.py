@@ -0,0 +1,150 @@
+import re
+import subprocess
+from typing import Dict, Iterable, List
+
+from loguru import logger
+
+DROPPED_HEADERS = (b"gpgsig", b"gpgsig-sha256")  # Signatures do not survive a rewrite
+TAG_SIGNATURE = re.compile(rb"\n?-----BEGIN (PGP|SSH) SIGNATURE-----.*\Z", re.S)
+
+
+def _git(repo_path: str, args: List[str], input: bytes = None) -> bytes:
+    try:
+        return subprocess.run(["git", *args], cwd=repo_path, input=input, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Git command failed: {e.stderr.decode(errors='replace').strip()}") from e
+
+
+def expand_refs(repo_path: str, patterns: Iterable[str]) -> List[str]:
+    """
+    Full ref names selected by `patterns`: "HEAD" (as the branch it points to), or
+    for-each-ref patterns such as "refs/heads", "refs/tags/v*" or "refs/heads/release/*".
+    """
+    refnames = []
+    for pattern in patterns:
+        if pattern == "HEAD":
+            found = [_git(repo_path, ["rev-parse", "--symbolic-full-name", "HEAD"]).decode().strip() or "HEAD"]
+        else:
+            found = _git(repo_path, ["for-each-ref", "--format=%(refname)", pattern]).decode().split()
+            if not found:
+                logger.warning(f"No refs match {pattern}")
+        refnames += [refname for refname in found if refname not in refnames]
+    return refnames
+
+
+def read_commit_objects(repo_path: str, hashes: List[str]) -> Dict[str, bytes]:
+    """Raw objects for `hashes`, read with a single `git cat-file --batch`."""
+    output = _git(repo_path, ["cat-file", "--batch"], "".join(f"{h}\n" for h in hashes).encode())
+    objects, pos = {}, 0
+    for commit_hash in hashes:
+        header_end = output.index(b"\n", pos)
+        _, _, size = output[pos:header_end].split(b" ")
+        start = header_end + 1
+        objects[commit_hash] = output[start:start + int(size)]
+        pos = start + int(size) + 1  # Object bytes are followed by a newline
+    return objects
+
+
+def rewrite_commit_object(raw: bytes, parents: List[str], message: str = None) -> bytes:
+    """
+    `raw` with its parent lines replaced and, if given, a new message. Tree, author and
+    committer (names and dates) are kept byte for byte; signatures are dropped.
+    """
+    headers, _, body = raw.partition(b"\n\n")
+    lines, skipping = [], False
+    for line in headers.split(b"\n"):
+        if line.startswith(b" ") and skipping:  # Continuation of a dropped multi-line header
+            continue
+        key = line.split(b" ", 1)[0]
+        skipping = key in DROPPED_HEADERS or (message is not None and key == b"encoding")
+        if skipping or key == b"parent":
+            continue
+        lines.append(line)
+        if key == b"tree":
+            lines += [b"parent " + parent.encode() for parent in parents]
+    if message is not None:
+        body = message.rstrip("\n").encode() + b"\n"
+    return b"\n".join(lines) + b"\n\n" + body
+
+
+def rewrite_tag_object(raw: bytes, target: str) -> bytes:
+    """An annotated tag pointing at `target` instead; tagger and message are kept, the signature is dropped."""
+    headers, _, body = raw.partition(b"\n\n")
+    headers = re.sub(rb"^object \S+", b"object " + target.encode(), headers, count=1)
+    return headers + b"\n\n" + TAG_SIGNATURE.sub(b"\n", body, count=1)
+
+
+def _peel(repo_path: str, refnames: List[str]) -> Dict[str, tuple]:
+    """{refname: (value, commit it points at, tag object if annotated)} for refs that end at a commit."""
+    names = [refname for refname in refnames if refname != "HEAD"]
+    output = _git(repo_path, ["for-each-ref", "--format=%(refname) %(objectname) %(objecttype) %(*objectname) "
+                                              "%(*objecttype)", *names]).decode() if names else ""
+    refs = {}
+    for line in output.splitlines():
+        refname, value, kind, peeled, peeled_kind = (line.split(" ") + [""] * 5)[:5]
+        if refname not in names:  # Patterns also match refs below them, e.g. refs/heads/main/fix
+            continue
+        if kind == "commit":
+            refs[refname] = (value, value, None)
+        elif kind == "tag" and peeled_kind == "commit":
+            refs[refname] = (value, peeled, value)
+    if "HEAD" in refnames:  # Detached HEAD; for-each-ref does not list it
+        head = _git(repo_path, ["rev-parse", "--verify", "HEAD^{commit}"]).decode().strip()
+        refs["HEAD"] = (head, head, None)
+    return refs
+
+
+def rewrite_messages(repo_path: str, messages: Dict[str, str], refs: Iterable[str] = ("HEAD",)) -> Dict[str, str]:
+    """
+    Gives the commits in `messages` ({hash: new message}) their new messages on every ref in `refs`.
+
+    Commits reachable from any of the refs are walked once, oldest first, and each affected commit
+    is recreated once with git plumbing (no checkout, no rebase, no editor), so branches that share
+    history keep sharing it. Descendants get new parents and otherwise stay identical, so the
+    working tree is untouched. Annotated tags are recreated on the new commits. All refs move in
+    one `update-ref --stdin` transaction that fails as a whole if any of them moved meanwhile.
+    Returns {old hash: new hash} for every recreated commit.
+    """
+    refs = _peel(repo_path, expand_refs(repo_path, refs))
+    if not refs:
+        raise RuntimeError("No refs to rewrite")
+    tips = sorted({commit for _, commit, _ in refs.values()})
+    history = [line.split() for line in
+               _git(repo_path, ["rev-list", "--topo-order", "--reverse", "--parents", *tips]).decode().splitlines()]
+
+    # Commits to recreate: the reworded ones and everything descending from them
+    affected = set()
+    for commit_hash, *parents in history:
+        if commit_hash in messages or affected.intersection(parents):
+            affected.add(commit_hash)
+    missing = len(set(messages) - affected)
+    if missing:
+        logger.warning(f"{missing} commits with new messages are not reachable from {', '.join(refs)}; skipping them")
+    if not affected:
+        return {}
+
+    objects = read_commit_objects(repo_path, [h for h, *_ in history if h in affected])
+    rewritten: Dict[str, str] = {}
+    for commit_hash, *parents in history:
+        if commit_hash not in affected:
+            continue
+        raw = rewrite_commit_object(objects[commit_hash], [rewritten.get(p, p) for p in parents],
+                                    messages.get(commit_hash))
+        rewritten[commit_hash] = _git(repo_path, ["hash-object", "-t", "commit", "-w", "--stdin"], raw).decode().strip()
+
+    updates = []
+    tags = read_commit_objects(repo_path, [tag for _, commit, tag in refs.values() if tag and commit in rewritten])
+    for refname, (value, commit, tag) in refs.items():
+        if commit not in rewritten:
+            continue
+        new_value = rewritten[commit]
+        if tag:
+            new_value = _git(repo_path, ["hash-object", "-t", "tag", "-w", "--stdin"],
+                             rewrite_tag_object(tags[tag], new_value)).decode().strip()
+        updates.append(f"update {refname} {new_value} {value}\n")
+    transaction = "start\n" + "".join(updates) + "prepare\ncommit\n"
+    _git(repo_path, ["update-ref", "--no-deref", "-m", "ocdg: rewrite commit messages", "--stdin"],
+         transaction.encode())
+    logger.info(f"Rewrote {len(messages) - missing} messages ({len(rewritten)} commits recreated); "
+                f"moved {len(updates)} of {len(refs)} refs")
+    return rewritten
@@ -24,9 +24,24 @@ from main import (
     generate_commit_description,
     Commit,
     GitAnalyzer,
+    parse_commit_log,
+    prepare_diff,
+    COMMIT_SYSTEM_PROMPT,
+    COMBINE_SYSTEM_PROMPT,
+    build_arg_parser,
+    shallow_clone_scope,
 )
 from clients import create_client, OpenAIClient, GroqClient  # Import client-related classes.
-from config import load_configuration, COMMIT_MESSAGES_LOG_FILE  # Import configuration loading function.
+from clients.replay_client import ReplayClient, ReplayMissError
+from commit_store import SQLiteCommitStore
+from diff_budget import budgeted_diff, read_capped
+from trivial_commits import classify_trivial_commit
+from patch_dedup import compute_patch_ids, deduplicate_commits, fan_out_messages
+from cascade import ModelCascade, check_message_quality
+from ast_changes import analyze_commit, analyze_python_change, read_blobs, summarize_structure
+from tracing import Tracer, percentile
+import metrics
+from config import load_configuration, COMMIT_MESSAGES_LOG_FILE, TRIVIAL_COMMIT_RULES  # Import configuration loading function.
 
 # Load test configuration
 TEST_CONFIG = load_configuration()  # Load configuration specifically for testing.
@@ -203,6 +218,43 @@ def test_split_text_aggressively():
     assert len(chunks) == 8
 
 
+def test_split_text_aggressively_covers_text_with_large_overlap():
+    """The default overlap exceeds small chunk sizes; splitting must still terminate and reach the end."""
+    text = "".join(str(i % 10) for i in range(1000))
+    chunks = list(_split_text_aggressively(text, max_chunk_size=100))
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert chunks[0] == text[:100]
+    assert text.endswith(chunks[-1])
+
+
+def test_filter_diff_leading_wildcard_patterns():
+    """Patterns such as '.*\\.(png|jpg)$' still match anywhere in the line after compilation."""
+    diff = (
+        "diff --git a/app.py b/app.py\n"
+        "+import os\n"
+        "+see assets/logo.png\n"
+        "diff --git a/node_modules/x/index.js b/node_modules/x/index.js\n"
+        "+module.exports = 1\n"
+    )
+    filtered = filter_diff(diff)
+    assert "+import os" in filtered
+    assert "logo.png" not in filtered
+    assert "node_modules" not in filtered
+
+
+def test_parse_commit_log():
+    """Subjects may contain commas; merge commits keep every parent."""
+    log_output = (
+        "a1,p1 p2,Alice <a@example.com>,Mon Jan 1 2024,Merge branch 'x', with commas\n"
+        "b2,,Bob <b@example.com>,Tue Jan 2 2024,initial\n"
+    )
+    commits = parse_commit_log(log_output, MagicMock())
+    assert [c.hash for c in commits] == ["a1", "b2"]
+    assert commits[0].parents == ["p1", "p2"]
+    assert commits[0].message == "Merge branch 'x', with commas"
+    assert commits[1].parents == []
+
+
 def test_generate_single_commit_message_json(mock_llm_client):
     """Test generating a single commit message part (mocked LLM)."""
     diff_chunk = "- print('old')\n+ print('new')"
@@ -286,8 +338,9 @@ def test_commit_history(commit_history):
     assert commit_history.get_oldest_commit() == commit_history.commits[0]
 
 
-def test_save_commit_messages_to_log(commit_history):
+def test_save_commit_messages_to_log(commit_history, tmp_path, monkeypatch):
     """Test saving commit messages to a log file."""
+    monkeypatch.chdir(tmp_path)
     commit_history.commits[0].new_message = "New Message 1"
     commit_history.commits[1].new_message = "New Message 2"
     save_commit_messages_to_log(commit_history)
@@ -300,21 +353,55 @@ def test_save_commit_messages_to_log(commit_history):
         assert "New Message 2" in log_content
 
 
-def test_repository_updater_backup_restore(temp_repo_path, mock_git_repo):
-    """Test backup and restore functionality of RepositoryUpdater."""
-    updater = RepositoryUpdater(temp_repo_path)
-    updater.backup_refs()
-    assert hasattr(updater, 'refs_backup_file')
-    assert os.path.exists(updater.refs_backup_file)
-    updater.restore_refs()
-    assert not os.path.exists(updater.refs_backup_file)
+def test_repository_updater_backup_restore(real_git_repo):
+    """Snapshots live under refs/ocdg/backup/ and restore moved and deleted refs in one go."""
+    from ref_snapshots import SNAPSHOT_PREFIX, list_snapshots, prune_snapshots
 
+    _git(real_git_repo, "tag", "-a", "v1", "-m", "release")
+    original = _git(real_git_repo, "rev-parse", "HEAD")
+    tag = _git(real_git_repo, "rev-parse", "v1")
+    updater = RepositoryUpdater(real_git_repo)
+    name = updater.backup_refs()
+    assert _git(real_git_repo, "rev-parse", f"{SNAPSHOT_PREFIX}{name}/refs/heads/main") == original
 
-def test_repository_updater_rewrite(temp_repo_path, commit_history, mock_git_repo):
-    """Test rewriting commit messages with RepositoryUpdater."""
-    updater = RepositoryUpdater(temp_repo_path)
-    commit_history.commits[0].new_message = "New Message 1"
-    updater.rewrite_commit_messages(commit_history)
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "add a")
+    _git(real_git_repo, "tag", "-d", "v1")
+    _git(real_git_repo, "branch", "later")  # Created after the snapshot: left alone
+    assert updater.restore_refs() == name
+    assert _git(real_git_repo, "rev-parse", "main") == original
+    assert _git(real_git_repo, "rev-parse", "v1") == tag
+    assert _git(real_git_repo, "rev-parse", "later") != original
+
+    second = RepositoryUpdater(real_git_repo).backup_refs()
+    assert [snapshot for snapshot, _ in list_snapshots(real_git_repo)] == [name, second]
+    assert prune_snapshots(real_git_repo, keep=1) == [name]
+    assert list_snapshots(real_git_repo) == [(second, 3)]
+
+
+def test_repository_updater_rewrite(real_git_repo, monkeypatch):
+    """RepositoryUpdater rewords the given commits, backs up refs first and can restore them."""
+    import main
+    from ref_snapshots import list_snapshots
+
+    old_head = _commit_file(real_git_repo, "a.py", "x = 1\n", "Message 2")
+    first = _git(real_git_repo, "rev-parse", "HEAD~1")
+    history = CommitHistory()
+    history.commits = [Commit(first, "Test", "2024-01-20", "initial", repo=MagicMock())]
+    history.commits[0].new_message = "New Message 1"
+
+    updater = RepositoryUpdater(real_git_repo)
+    rewritten = updater.rewrite_commit_messages(history)
+    assert set(rewritten) == {first, old_head}
+    assert _git(real_git_repo, "log", "--format=%s") == "Message 2\nNew Message 1"
+    assert updater.snapshot
+
+    updater.restore_refs()
+    assert _git(real_git_repo, "rev-parse", "HEAD") == old_head
+
+    monkeypatch.setattr(main, "REF_SNAPSHOT_KEEP", 2)
+    for _ in range(3):
+        updater.backup_refs()
+    assert len(list_snapshots(real_git_repo)) == 2  # Older snapshots are pruned as new ones are taken
 #
 #
 def test_git_analyzer(temp_repo_path, mock_git_repo):
@@ -362,4 +449,1046 @@ def test_create_client(client_type, expected_class, test_config=TEST_CONFIG):
     )  # Create the specified type of LLM client.
     assert isinstance(
         client, expected_class
-    )  # Assert that the created client is of the expected type.
\ No newline at end of file
+    )  # Assert that the created client is of the expected type.
+
+def test_classify_trivial_commit_lockfile():
+    """Lockfile-only diffs get a deterministic chore(deps) message."""
+    diff = (
+        "diff --git a/poetry.lock b/poetry.lock\n"
+        "--- a/poetry.lock\n+++ b/poetry.lock\n"
+        "@@ -1 +1 @@\n-version = \"1.0\"\n+version = \"1.1\"\n"
+    )
+    assert classify_trivial_commit(diff, filter_diff(diff)) == ("lockfile", "chore(deps): update poetry.lock")
+
+
+def test_classify_trivial_commit_version_bump():
+    """Version-only edits in version files are detected as release bumps."""
+    diff = (
+        "diff --git a/pyproject.toml b/pyproject.toml\n"
+        "--- a/pyproject.toml\n+++ b/pyproject.toml\n"
+        "@@ -3 +3 @@\n-version = \"0.1.0\"\n+version = \"0.2.0\"\n"
+    )
+    assert classify_trivial_commit(diff, diff) == ("version_bump", "chore(release): bump version to 0.2.0")
+
+
+def test_classify_trivial_commit_rename_whitespace_merge_empty():
+    """Renames, whitespace-only changes, merges and empty diffs skip the LLM."""
+    rename = "diff --git a/a.py b/b.py\nsimilarity index 100%\nrename from a.py\nrename to b.py\n"
+    assert classify_trivial_commit(rename, rename)[0] == "rename"
+
+    whitespace = "diff --git a/a.py b/a.py\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-x=1\n+x = 1\n"
+    assert classify_trivial_commit(whitespace, whitespace)[0] == "whitespace"
+    for before, after in (("return x", "returnx"), ('print("a b")', 'print("ab")')):  # Spaces that separate words
+        edit = f"diff --git a/a.py b/a.py\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-{before}\n+{after}\n"
+        assert classify_trivial_commit(edit, edit) is None
+
+    merged = classify_trivial_commit("", "", "Merge branch 'dev'", parents=["p1", "p2"])
+    assert merged == ("merge", "chore: merge branch 'dev'")
+    assert classify_trivial_commit("", "", is_initial=True) == ("empty", "chore: initial commit")
+
+
+def test_classify_trivial_commit_real_change():
+    """Real code changes and disabled rules go to the LLM."""
+    diff = "diff --git a/a.py b/a.py\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-x = 1\n+x = 2\n"
+    assert classify_trivial_commit(diff, diff) is None
+    assert classify_trivial_commit("", "", rules=set()) is None
+
+
+def _git(repo_dir, *args):
+    """Runs a real git command inside repo_dir with a fixed identity."""
+    import subprocess
+    return subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+        cwd=repo_dir, check=True, capture_output=True, text=True,
+    ).stdout.strip()
+
+
+def _commit_file(repo_dir, name, content, message):
+    """Writes a file and commits it, returning the new commit hash."""
+    with open(os.path.join(repo_dir, name), "w") as f:
+        f.write(content)
+    _git(repo_dir, "add", name)
+    _git(repo_dir, "commit", "-q", "-m", message)
+    return _git(repo_dir, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def real_git_repo(temp_repo_path):
+    """Fixture creating a real Git repository with a single initial commit."""
+    _git(temp_repo_path, "init", "-q", "-b", "main")
+    _commit_file(temp_repo_path, "README.md", "# Test\n", "initial")
+    return temp_repo_path
+
+
+def test_patch_id_dedup(real_git_repo):
+    """Cherry-picked commits share a patch-id and reuse the original's message."""
+    _git(real_git_repo, "checkout", "-q", "-b", "release")
+    _commit_file(real_git_repo, "b.py", "y = 1\n", "add b")
+    _git(real_git_repo, "checkout", "-q", "main")
+    original = _commit_file(real_git_repo, "a.py", "x = 1\n", "add a")
+    _git(real_git_repo, "checkout", "-q", "release")
+    _git(real_git_repo, "cherry-pick", original)
+    picked = _git(real_git_repo, "rev-parse", "HEAD")
+
+    patch_ids = compute_patch_ids(real_git_repo, [picked, original])
+    assert patch_ids[picked] == patch_ids[original]
+
+    commits = [Commit(picked, "A", "d", "add a", repo=MagicMock()), Commit(original, "A", "d", "add a", repo=MagicMock())]
+    unique, duplicates = deduplicate_commits(commits, patch_ids)
+    assert [commit.hash for commit in unique] == [original]
+    assert [commit.hash for commit in duplicates[original]] == [picked]
+
+    commits[1].new_message = "feat: add a"
+    assert fan_out_messages(commits, duplicates, cherry_pick_note=True) == 1
+    assert commits[0].new_message == f"feat: add a\n\n(cherry picked from commit {original})"
+
+
+class _FakeAsyncClient:
+    """Async LLM client stub returning a fixed commit title."""
+
+    def __init__(self, title):
+        self.title = title
+        self.calls = 0
+
+    async def async_generate_text(self, system_prompt, prompt, **kwargs):
+        self.calls += 1
+        return json.dumps({
+            "short_analysis": "analysis",
+            "new_commit_title": self.title,
+            "new_detailed_commit_message": "- details",
+        })
+
+
+def test_model_cascade_escalation():
+    """Good small-model output is kept; bad titles and large diffs escalate."""
+    import asyncio
+
+    small = _FakeAsyncClient("feat: add parser")
+    large = _FakeAsyncClient("feat(core): add parser")
+    cascade = ModelCascade(generate_commit_description, small, "small", large, "large", max_small_diff_chars=100)
+    assert asyncio.run(cascade.generate_commit_description("+x = 1", "old")) == "feat: add parser\n\n- details"
+    assert large.calls == 0
+
+    small.title = "Added a parser"
+    assert asyncio.run(cascade.generate_commit_description("+x = 1", "old")).startswith("feat(core)")
+    asyncio.run(cascade.generate_commit_description("+x" * 100, "old"))
+    assert cascade.small_count == 1
+    assert cascade.escalations == {"not_conventional": 1, "large_diff": 1}
+    assert check_message_quality("feat: " + "x" * 80) == "title_too_long"
+    assert check_message_quality(None) == "invalid_json"
+
+
+def test_analyze_python_change():
+    """Formatting-only edits are ignored; real body changes are reported per qualified name."""
+    before = "class A:\n    def f(self):\n        return 1\n\ndef g():\n    pass\n"
+    after = "class A:\n    def f(self):\n        return 2\n\ndef g( ):\n    pass\n\ndef h():\n    pass\n"
+    assert analyze_python_change("m.py", before, after) == {"added": ["h"], "removed": [], "modified": ["A.f"]}
+    assert analyze_python_change("m.py", before, "def (") is None
+
+
+def test_analyze_commit_and_summary(real_git_repo):
+    """Local analysis fills code_changes and can replace Python hunks with a summary."""
+    import asyncio
+
+    _commit_file(real_git_repo, "m.py", "def f():\n    return 1\n", "add m")
+    head = _commit_file(real_git_repo, "m.py", "def f():\n    return 2\n\ndef g():\n    pass\n", "change m")
+    repo = git.Repo(real_git_repo)
+    diff = repo.git.diff(f"{head}~1", head)
+
+    code_changes = asyncio.run(analyze_commit(repo, head, diff))
+    assert code_changes["files_changed"] == ["m.py"]
+    assert code_changes["functions_modified"] == ["g (added)", "f"]
+    summary = summarize_structure(diff, code_changes)
+    assert "return 2" not in summary
+    assert "# modified: f" in summary
+
+
+def test_read_blobs_batch_and_prefill_once(real_git_repo):
+    """Blobs come from one cat-file batch; the prefill summary is sent with the first chunk only."""
+    import asyncio
+
+    root = _commit_file(real_git_repo, "m.py", "def f():\n    return 1\n", "add m")
+    assert read_blobs(real_git_repo, [f"{root}:m.py", f"{root}~1:m.py", f"{root}:gone.py"]) == [
+        "def f():\n    return 1\n", "", ""]
+
+    prompts = []
+
+    class RecordingClient(_FakeAsyncClient):
+        async def async_generate_text(self, system_prompt, prompt, **kwargs):
+            prompts.append(prompt)
+            return await super().async_generate_text(system_prompt, prompt, **kwargs)
+
+    code_changes = {"files_changed": ["m.py"], "functions_modified": ["f"], "other_observations": []}
+    asyncio.run(_generate_commit_message_parts("x" * 30, "old", RecordingClient("feat: x"), "m", 10, code_changes))
+    assert ["computed locally" in prompt for prompt in prompts] == [True, False, False]
+
+
+def test_tracer_spans_and_summary(temp_repo_path):
+    """Spans are written as JSONL with nested counters and summarized per stage."""
+    trace_path = os.path.join(temp_repo_path, "trace.jsonl")
+    tracer = Tracer()
+    with tracer.span("disabled") as span:
+        assert span == {}
+    tracer.configure(trace_path)
+    with tracer.span("commit", commit="abc"):
+        with tracer.span("llm_request", prompt_chars=10) as span:
+            tracer.add("retries")
+            tracer.add("retries")
+            span["completion_chars"] = 5
+    tracer.close()
+
+    with open(trace_path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["stage"] for record in records] == ["llm_request", "commit"]
+    assert records[0]["commit"] == "abc"
+    assert records[0]["retries"] == 2
+    assert records[0]["completion_chars"] == 5
+    table = tracer.summary_table()
+    assert "llm_request" in table
+    assert "slowest commits:" in table and "abc" in table
+
+
+def test_percentile_nearest_rank():
+    """Nearest-rank percentiles: the smallest value with at least `percent` of the list at or below it."""
+    values = list(range(1, 11))
+    assert [percentile(values, p) for p in (0, 10, 50, 51, 95, 100)] == [1, 1, 5, 6, 10, 10]
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_metrics_exposition_and_http_endpoint(temp_repo_path):
+    """Client-layer metrics are exposed in Prometheus text format over HTTP and as a textfile."""
+    import asyncio
+    import urllib.request
+
+    class _Client:
+        @metrics.record_llm_request("fake")
+        async def async_generate_text(self, system_prompt, prompt, **kwargs):
+            return "x" * 40
+
+    before = metrics.LLM_REQUESTS.get(provider="fake", outcome="success")
+    asyncio.run(_Client().async_generate_text("s" * 8, "p" * 8))
+    assert metrics.LLM_REQUESTS.get(provider="fake", outcome="success") == before + 1
+    assert metrics.LLM_IN_FLIGHT.get(provider="fake") == 0
+
+    server = metrics.start_http_server(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        body = urllib.request.urlopen(url).read().decode()
+    finally:
+        server.shutdown()
+    assert "# TYPE ocdg_llm_requests_total counter" in body
+    assert 'ocdg_llm_requests_total{outcome="success",provider="fake"}' in body
+    assert 'ocdg_llm_request_duration_seconds_bucket{provider="fake",le="+Inf"}' in body
+
+    textfile = os.path.join(temp_repo_path, "ocdg.prom")
+    metrics.write_textfile(textfile)
+    with open(textfile) as f:
+        assert "ocdg_llm_completion_tokens_total" in f.read()
+
+
+def test_e2e_benchmark_harness(temp_repo_path, monkeypatch):
+    """Synthetic repo + fake LLM server run through the real generation pipeline."""
+    import asyncio
+    from benchmarks.e2e import run_benchmark
+    from benchmarks.fake_llm_server import FakeLLMServer
+    from benchmarks.synthetic_repo import generate_repo
+    from tracing import tracer
+
+    repo_path = generate_repo(os.path.join(temp_repo_path, "repo"), commits=8, merge_every=4, median_diff_lines=5)
+    merges = _git(repo_path, "rev-list", "--merges", "--count", "HEAD")
+    assert merges == "1"
+
+    monkeypatch.chdir(temp_repo_path)
+    server = FakeLLMServer(latency=0).start()
+    try:
+        report = asyncio.run(run_benchmark(repo_path, server, "ollama"))
+    finally:
+        server.stop()
+        monkeypatch.setattr(tracer, "enabled", False)
+    assert report["commits"] == 9
+    assert report["messages"] == 9
+    assert report["llm_calls"] == server.requests > 0
+    assert "generate" in report["stage_seconds"]
+
+
+def test_replay_client_record_and_replay(tmp_path):
+    """Recorded responses are served back for identical requests, in order, without the upstream."""
+    import asyncio
+
+    path = str(tmp_path / "replay.jsonl")
+    upstream = _FakeAsyncClient("feat: first")
+    recorder = ReplayClient(path, upstream=upstream)
+
+    async def record():
+        first = await recorder.async_generate_text("system", "prompt")
+        upstream.title = "feat: second"
+        second = await recorder.async_generate_text("system", "prompt")
+        other = await recorder.async_generate_text("system", "other prompt")
+        return first, second, other
+
+    first, second, other = asyncio.run(record())
+    replay = create_client("replay", {"REPLAY_FILE": path, "REPLAY_LATENCY": "0"})
+
+    async def play():
+        return [await replay.async_generate_text("system", p) for p in ("prompt", "prompt", "prompt", "other prompt")]
+
+    assert asyncio.run(play()) == [first, second, second, other]
+    with pytest.raises(ReplayMissError):
+        asyncio.run(replay.async_generate_text("system", "never recorded"))
+
+
+STARTUP_IMPORT_BUDGET_SECONDS = 1.0
+
+
+def test_startup_does_not_import_provider_sdks():
+    """`import main` (the cost of --help/--restore) stays within budget and loads no provider SDK."""
+    import subprocess
+    import sys
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - start\n"
+        "sdks = ['openai', 'groq', 'replicate', 'ollama', 'langchain', 'jsonschema']\n"
+        "print(elapsed, [m for m in sdks if m in sys.modules])\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    elapsed, loaded = output.split(" ", 1)
+    assert loaded.strip() == "[]"
+    assert float(elapsed) < STARTUP_IMPORT_BUDGET_SECONDS
+
+
+def test_create_client_loads_provider_lazily():
+    """Unknown providers fail before any import; known ones resolve through the registry."""
+    import clients
+    with pytest.raises(ValueError):
+        create_client("nope", {})
+    assert clients.ReplayClient.__name__ == "ReplayClient"
+    with pytest.raises(AttributeError):
+        clients.NoSuchClient
+
+
+def test_commit_stores_binary_hashes():
+    """Hex hashes are kept as 20 raw bytes and round-trip; commits carry no per-instance dict or diff."""
+    sha, parent = "a" * 40, "b" * 40
+    commit = Commit(sha, "A", "d", "msg", repo=None, parents=[parent])
+    assert commit.oid == bytes.fromhex(sha)
+    assert commit.hash == sha
+    assert commit.parents == [parent]
+    assert not hasattr(commit, "__dict__")
+    assert not hasattr(commit, "diff")
+
+
+def test_sqlite_commit_store(tmp_path):
+    """The SQLite store keeps order, lookups and generated messages."""
+    store = SQLiteCommitStore(str(tmp_path / "commits.db"))
+    commits = [Commit(f"{i:040x}", "A", "d", f"msg {i}", repo=None, parents=[f"{i - 1:040x}"] if i else [])
+               for i in range(5)]
+    commits[3].new_message = "feat: three"
+    store.commits = commits
+    assert len(store.commits) == 5
+    assert [c.message for c in store.commits] == [f"msg {i}" for i in range(5)]
+    assert store.get_oldest_commit().hash == commits[0].hash
+    assert store.get_commit(commits[3].hash).new_message == "feat: three"
+    assert store.get_commit(commits[2].hash).parents == [commits[1].hash]
+    assert store.get_commit("f" * 40) is None
+    store.close()
+
+
+def test_budgeted_diff_summarizes_oversized_files(real_git_repo):
+    """Small commits get the plain diff; oversized files are sized by numstat and only summarized."""
+    small = _commit_file(real_git_repo, "app.py", "x = 1\n", "add app")
+    assert budgeted_diff(real_git_repo, f"{small}~1", small)[0] == _git(real_git_repo, "diff", f"{small}~1", small)
+
+    with open(os.path.join(real_git_repo, "data.csv"), "w") as f:
+        f.write("row,value\n" * 2000)
+    with open(os.path.join(real_git_repo, "app.py"), "a") as f:
+        f.write("y = 2\n")
+    _git(real_git_repo, "add", ".")
+    _git(real_git_repo, "commit", "-q", "-m", "add data")
+    big = _git(real_git_repo, "rev-parse", "HEAD")
+
+    diff, omitted = budgeted_diff(real_git_repo, f"{big}~1", big, max_file_bytes=1000)
+    assert [stat.path for stat in omitted] == ["data.csv"]
+    assert "+y = 2" in diff
+    assert "row,value" not in diff
+    assert "diff --git a/data.csv b/data.csv\n# Patch omitted (+2000 -0 lines, 20000 bytes" in diff
+
+    capped, _ = budgeted_diff(real_git_repo, f"{big}~1", big, max_file_bytes=0, max_total_bytes=0)
+    assert capped.count("row,value") == 2000
+    truncated = read_capped(real_git_repo, ["diff", f"{big}~1", big, "--", "data.csv"], 500)
+    assert len(truncated) < 600
+    assert truncated.endswith("(over the diff budget)")
+
+
+def test_omitted_patch_is_never_whitespace(real_git_repo):
+    """A formatting-only edit next to a file over the diff budget still goes to the LLM."""
+    _commit_file(real_git_repo, "a.py", "y = x+1\n", "add a")
+    with open(os.path.join(real_git_repo, "a.py"), "w") as f:
+        f.write("y = x + 1\n")
+    with open(os.path.join(real_git_repo, "data.py"), "w") as f:
+        f.write("".join(f"ROW_{i} = {i}\n" for i in range(20000)))
+    _git(real_git_repo, "add", ".")
+    _git(real_git_repo, "commit", "-q", "-m", "format a, add data")
+    head = _git(real_git_repo, "rev-parse", "HEAD")
+
+    diff, omitted = budgeted_diff(real_git_repo, f"{head}~1", head)
+    assert [stat.path for stat in omitted] == ["data.py"]
+    assert classify_trivial_commit(diff, filter_diff(diff)) is None
+
+
+def test_prepare_diff_in_pool_matches_inline():
+    """Offloaded filtering (bytes and shared-memory transport) gives the same result as inline."""
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    import cpu_offload
+
+    from config import CPU_OFFLOAD_MIN_CHARS, DIFF_MAX_TOTAL_BYTES
+
+    async def offload(diff):
+        return await cpu_offload.prepare_diff_in_pool(executor, diff, "msg", ["p"], False, TRIVIAL_COMMIT_RULES)
+
+    # Both sizes are offloaded and fit the default diff budget; only the larger one uses shared memory
+    small = "diff --git a/app.py b/app.py\n" + "+value = 1\n" * (CPU_OFFLOAD_MIN_CHARS // 10) + "+logo.png\n"
+    large = "diff --git a/app.py b/app.py\n" + "+value = 1\n" * (DIFF_MAX_TOTAL_BYTES // 12) + "+logo.png\n"
+    assert len(small) >= CPU_OFFLOAD_MIN_CHARS and len(large) < DIFF_MAX_TOTAL_BYTES
+    payload, shared = cpu_offload._pack(large)
+    shared.close()
+    assert isinstance(payload, tuple) and isinstance(cpu_offload._pack(small)[0], bytes)
+    with ProcessPoolExecutor(1) as executor:
+        for diff in (small, large):
+            assert asyncio.run(offload(diff)) == prepare_diff(diff, "msg", ["p"], False, TRIVIAL_COMMIT_RULES)
+    assert cpu_offload.parse_workers("auto") == cpu_offload.available_cores() >= 1
+
+
+def test_prompts_share_a_stable_prefix_and_combine_sends_one_request():
+    """Every request starts with the same system prompt; combining valid parts costs exactly one request."""
+    import asyncio
+
+    class RecordingClient(_FakeAsyncClient):
+        def __init__(self):
+            super().__init__("feat: x")
+            self.system_prompts = []
+
+        async def async_generate_text(self, system_prompt, prompt, **kwargs):
+            self.system_prompts.append(system_prompt)
+            return await super().async_generate_text(system_prompt, prompt, **kwargs)
+
+    client = RecordingClient()
+    for diff in ("+a = 1", "+b = 2"):
+        asyncio.run(_generate_single_commit_message_json(diff, "old", client, "m", 0, 1))
+    assert client.system_prompts == [COMMIT_SYSTEM_PROMPT] * 2
+
+    asyncio.run(combine_messages([{"new_commit_title": "a"}, {"new_commit_title": "b"}], client, "m"))
+    assert client.calls == 3
+    assert client.system_prompts[-1] == COMBINE_SYSTEM_PROMPT
+
+
+def test_prompt_cache_usage_and_cache_key(monkeypatch):
+    """Provider usage feeds the cached-token hit rate; OpenAI requests carry a per-system-prompt cache key."""
+    import asyncio
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock
+    from clients.openai_client import OpenAIClient as LazyOpenAIClient
+
+    monkeypatch.setattr(metrics.LLM_USAGE_PROMPT_TOKENS, "_values", {})
+    monkeypatch.setattr(metrics.LLM_CACHED_PROMPT_TOKENS, "_values", {})
+    assert metrics.prompt_cache_hit_rate() is None
+    usage = SimpleNamespace(prompt_tokens=400, prompt_tokens_details=SimpleNamespace(cached_tokens=300))
+    response = SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=" {} "))])
+
+    client = LazyOpenAIClient("key", "http://127.0.0.1:9/v1", prompt_cache_key=True)
+    create = AsyncMock(return_value=response)
+    monkeypatch.setattr(client.async_client.chat.completions, "create", create)
+    asyncio.run(client.async_generate_text("system", "first"))
+    asyncio.run(client.async_generate_text("system", "second"))
+
+    keys = {call.kwargs["extra_body"]["prompt_cache_key"] for call in create.await_args_list}
+    assert len(keys) == 1
+    assert metrics.prompt_cache_hit_rate() == 0.75
+
+
+def test_remote_partial_shallow_clone_and_refetch(tmp_path):
+    """URLs are cloned partially and shallowly; reruns fetch new commits; the shallow boundary is skipped."""
+    from remote_repo import clone_or_fetch, clone_path, is_remote_url
+
+    source = tmp_path / "source"
+    source.mkdir()
+    _git(source, "init", "-q", "-b", "main")
+    for i in range(5):
+        _commit_file(source, "f.txt", f"{i}\n", f"commit {i}")
+    bare = tmp_path / "origin.git"
+    _git(tmp_path, "clone", "-q", "--bare", str(source), str(bare))
+    _git(bare, "config", "uploadpack.allowfilter", "true")
+    url = f"file://{bare}"
+    assert is_remote_url(url) and not is_remote_url(str(bare))
+
+    path = clone_path(url, str(tmp_path / "commit_diff"))
+    assert path.endswith("origin")
+    clone_or_fetch(url, path, depth=3)
+    assert _git(path, "rev-parse", "--is-shallow-repository") == "true"
+    assert _git(path, "config", "remote.origin.partialclonefilter") == "blob:none"
+    commits = GitAnalyzer(path).get_commits()
+    assert [c.message for c in commits] == ["commit 4", "commit 3"]  # "commit 2" has no parent locally
+
+    new_hash = _commit_file(source, "f.txt", "5\n", "commit 5")
+    _git(source, "push", "-q", str(bare), "main")
+    clone_or_fetch(url, path)
+    assert _git(path, "rev-parse", "HEAD") == new_hash
+    assert GitAnalyzer(path).get_commits()[0].hash == new_hash
+
+
+
+def test_refetch_never_shortens_history(tmp_path):
+    """A fetch into an existing clone deepens a shallow one when the scope grows, but never cuts history."""
+    from remote_repo import clone_or_fetch
+
+    source = tmp_path / "source"
+    source.mkdir()
+    _git(source, "init", "-q", "-b", "main")
+    for i in range(6):
+        _commit_file(source, "f.txt", f"{i}\n", f"commit {i}")
+    url = f"file://{source}"
+
+    full = str(tmp_path / "full")
+    clone_or_fetch(url, full)
+    clone_or_fetch(url, full, depth=3)
+    assert _git(full, "rev-parse", "--is-shallow-repository") == "false"
+    assert _git(full, "rev-list", "--count", "HEAD") == "6"
+
+    shallow = str(tmp_path / "shallow")
+    clone_or_fetch(url, shallow, depth=2)
+    assert _git(shallow, "rev-list", "--count", "HEAD") == "2"
+    clone_or_fetch(url, shallow, depth=4)
+    assert _git(shallow, "rev-list", "--count", "HEAD") == "4"
+    clone_or_fetch(url, shallow, depth=2)
+    assert _git(shallow, "rev-list", "--count", "HEAD") == "4"
+    clone_or_fetch(url, shallow)
+    assert _git(shallow, "rev-parse", "--is-shallow-repository") == "false"
+
+def test_get_commits_scoping(real_git_repo):
+    """Range, count, author and pathspec filters are applied by git log itself."""
+    base = _git(real_git_repo, "rev-parse", "HEAD")
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "add a")
+    _git(real_git_repo, "-c", "user.name=Other", "-c", "user.email=other@example.com",
+         "commit", "-q", "--allow-empty", "-m", "by other")
+    _commit_file(real_git_repo, "b.py", "y = 1\n", "add b")
+    analyzer = GitAnalyzer(real_git_repo)
+
+    assert len(analyzer.get_commits()) == 4
+    assert [c.message for c in analyzer.get_commits(limit=2)] == ["add b", "by other"]
+    assert [c.message for c in analyzer.get_commits(revision_range=f"{base}..HEAD~1")] == ["by other", "add a"]
+    assert [c.message for c in analyzer.get_commits(authors=["other@"])] == ["by other"]
+    assert [c.message for c in analyzer.get_commits(paths=["a.py", "README.md"])] == ["add a", "initial"]
+    assert analyzer.get_commits(until="2000-01-01") == []
+
+
+def test_shallow_clone_scope():
+    """Clone depth follows --max-count only when nothing else filters the newest commits."""
+    parse = build_arg_parser().parse_args
+    assert shallow_clone_scope(parse(["url"])) == (None, None)
+    assert shallow_clone_scope(parse(["url", "-n", "50"])) == (51, None)
+    assert shallow_clone_scope(parse(["url", "-n", "50", "--path", "src"])) == (None, None)
+    assert shallow_clone_scope(parse(["url", "--since", "2024-01-01", "--author", "me"])) == (None, "2024-01-01")
+    assert shallow_clone_scope(parse(["url", "-n", "50", "--clone-depth", "10"])) == (10, None)
+
+
+def test_incremental_watermark(real_git_repo):
+    """The watermark limits runs to new commits and falls back to the merge base after a rewrite."""
+    from watermark import current_branch, incremental_range, read_watermark, write_watermark
+
+    branch = current_branch(real_git_repo)
+    assert branch == "main"
+    first = _git(real_git_repo, "rev-parse", "HEAD")
+    assert incremental_range(real_git_repo, branch, first) is None
+    write_watermark(real_git_repo, branch, first)
+    assert read_watermark(real_git_repo, branch) == first
+
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "add a")
+    processed = _commit_file(real_git_repo, "b.py", "y = 1\n", "add b")
+    revisions = incremental_range(real_git_repo, branch, processed)
+    assert revisions == f"{first}..{processed}"
+    assert [c.message for c in GitAnalyzer(real_git_repo).get_commits(revision_range=revisions)] == ["add b", "add a"]
+
+    write_watermark(real_git_repo, branch, processed)
+    _git(real_git_repo, "commit", "-q", "--amend", "-m", "add b (reworded)")  # Upstream rewrote the watermark
+    tip = _git(real_git_repo, "rev-parse", "HEAD")
+    assert incremental_range(real_git_repo, branch, tip) == f"{_git(real_git_repo, 'rev-parse', 'HEAD~1')}..{tip}"
+
+    _git(real_git_repo, "checkout", "-q", "--orphan", "unrelated")
+    orphan = _commit_file(real_git_repo, "c.py", "z = 1\n", "unrelated root")
+    assert incremental_range(real_git_repo, branch, orphan) is None
+
+
+def test_batch_manifest(tmp_path, monkeypatch):
+    """A manifest runs every repository through one client; a broken entry does not stop the others."""
+    import asyncio
+    import main
+    from batch import load_manifest
+    from message_map import read_message_map
+
+    repos = []
+    for name in ("one", "two"):
+        repo = tmp_path / name
+        repo.mkdir()
+        _git(repo, "init", "-q", "-b", "main")
+        for i in range(3):
+            _commit_file(repo, f"{name}{i}.py", f"x = {i}\n", f"{name} {i}")
+        repos.append(str(repo))
+    manifest = tmp_path / "repos.jsonl"
+    manifest.write_text(
+        f"# fleet\n{repos[0]}\n"
+        + json.dumps({"repo": repos[1], "max-count": 1, "path": "two2.py"}) + "\n"
+        + str(tmp_path / "missing") + "\n"
+    )
+    entries = load_manifest(str(manifest))
+    assert [entry.repo for entry in entries] == [repos[0], repos[1], str(tmp_path / "missing")]
+    assert entries[1].options == {"max_count": 1, "path": ["two2.py"]}
+
+    client = _FakeAsyncClient("feat: batch")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: client)
+    message_map = tmp_path / "messages.jsonl"
+    results = asyncio.run(main.run_batch(
+        main.build_arg_parser().parse_args(["--manifest", str(manifest), "--message-map", str(message_map)]),
+        main.load_configuration("ollama"),
+    ))
+
+    by_repo = {result.repo: result for result in results}
+    assert by_repo[repos[0]].commits == 3 and by_repo[repos[1]].commits == 1
+    assert by_repo[str(tmp_path / "missing")].error
+    lines = list(read_message_map(str(message_map)))
+    assert sorted((line["repo"], line["message"]) for line in lines) == [
+        (repos[0], "one 0"), (repos[0], "one 1"), (repos[0], "one 2"), (repos[1], "two 2"),
+    ]
+    assert client.calls == 3  # Initial commits have empty diffs and are handled locally
+
+
+def test_batch_writes_final_metrics_and_trace(tmp_path, monkeypatch):
+    """Batch runs end like single runs: the metrics textfile is written and the trace summarized and closed."""
+    import asyncio
+    import main
+    from tracing import Tracer
+
+    repo = tmp_path / "one"
+    repo.mkdir()
+    _git(repo, "init", "-q", "-b", "main")
+    _commit_file(repo, "a.py", "x = 1\n", "wip")
+    _commit_file(repo, "b.py", "y = 1\n", "more wip")
+    manifest = tmp_path / "repos.jsonl"
+    manifest.write_text(f"{repo}\n")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: _FakeAsyncClient("feat: batch"))
+    monkeypatch.setattr(main, "tracer", Tracer())
+    monkeypatch.setattr(main, "start_textfile_exporter", lambda path: None)
+    textfile, trace = tmp_path / "ocdg.prom", tmp_path / "trace.jsonl"
+
+    asyncio.run(main.main(["--manifest", str(manifest), "--message-map", str(tmp_path / "messages.jsonl"),
+                           "--metrics-textfile", str(textfile), "--trace", str(trace)]))
+    assert "ocdg_" in textfile.read_text()
+    assert '"stage": "generate"' in trace.read_text()
+    assert main.tracer.trace_file is None
+
+
+def test_shards_partition_and_merge(real_git_repo, tmp_path, monkeypatch):
+    """--shard i/N runs cover every commit exactly once and merge back into one message map."""
+    import asyncio
+    import main
+    from batch import parse_shard
+    from message_map import merge_message_maps, read_message_map
+
+    assert parse_shard("2/4") == (1, 4)
+    with pytest.raises(Exception):
+        parse_shard("5/4")
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    for i in range(8):
+        _commit_file(real_git_repo, f"f{i}.py", f"x = {i}\n", f"commit {i}")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: _FakeAsyncClient("feat: shard"))
+
+    shard_files = []
+    for i in (1, 2, 3):
+        path = str(tmp_path / f"shard{i}.jsonl")
+        asyncio.run(main.main([real_git_repo, "--shard", f"{i}/3", "--message-map", path]))
+        shard_files.append(path)
+    sizes = [len(list(read_message_map(path))) for path in shard_files]
+    assert sum(sizes) == 9  # Hashes are random, so individual shard sizes vary
+
+    merged = str(tmp_path / "merged.jsonl")
+    assert merge_message_maps(shard_files + shard_files[:1], merged) == 9  # Repeated input is not duplicated
+    entries = list(read_message_map(merged))
+    assert len({entry["hash"] for entry in entries}) == 9
+    assert all(int(entry["hash"], 16) % 3 == int(entry["shard"][0]) - 1 for entry in entries)
+
+
+def test_generate_then_apply(real_git_repo, tmp_path, monkeypatch):
+    """'generate' only writes the message map; 'apply' rewrites from it without prompting, keeping trees intact."""
+    import asyncio
+    import builtins
+    import pydoc
+    import main
+
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    monkeypatch.chdir(tmp_path)  # The rewrite appends to the relative COMMIT_MESSAGES_LOG_FILE
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "wip")
+    _commit_file(real_git_repo, "b.py", "y = 1\n", "more wip")
+    tip, tree = _git(real_git_repo, "rev-parse", "HEAD"), _git(real_git_repo, "rev-parse", "HEAD^{tree}")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: _FakeAsyncClient("feat: add module"))
+    message_map = str(tmp_path / "messages.jsonl")
+
+    asyncio.run(main.main(["generate", real_git_repo, "--message-map", message_map]))
+    assert _git(real_git_repo, "rev-parse", "HEAD") == tip
+    assert len(open(message_map).readlines()) == 3
+
+    monkeypatch.setattr(pydoc, "pager", lambda text: None)
+    monkeypatch.setattr(builtins, "input", lambda prompt: "no")
+    assert asyncio.run(main.main(["apply", real_git_repo, "--message-map", message_map, "--review", "diff"])) is None
+    assert _git(real_git_repo, "rev-parse", "HEAD") == tip
+
+    rewritten = asyncio.run(main.main(["apply", real_git_repo, "--message-map", message_map]))
+    assert len(rewritten) == 3
+    assert _git(real_git_repo, "log", "-2", "--format=%s") == "feat: add module\nfeat: add module"
+    assert _git(real_git_repo, "rev-parse", "HEAD^{tree}") == tree
+    assert _git(real_git_repo, "log", "-1", "--format=%an <%ae>") == "Test <test@example.com>"
+    assert _git(real_git_repo, "status", "--porcelain") == ""
+
+
+def test_rewrite_commit_object_drops_signature():
+    """Rewritten commit objects get new parents and message; signatures are dropped, identities kept."""
+    from rewrite import rewrite_commit_object
+
+    raw = (b"tree t\nparent old1\nauthor A <a@x> 1 +0000\ncommitter C <c@x> 2 +0000\n"
+           b"gpgsig -----BEGIN PGP SIGNATURE-----\n \n abc\n -----END PGP SIGNATURE-----\n\nold message\n")
+    assert rewrite_commit_object(raw, ["new1", "new2"], "feat: new\n\n- body") == (
+        b"tree t\nparent new1\nparent new2\nauthor A <a@x> 1 +0000\ncommitter C <c@x> 2 +0000\n\n"
+        b"feat: new\n\n- body\n"
+    )
+    assert rewrite_commit_object(raw, ["new1"]).endswith(b"\n\nold message\n")
+
+
+def test_daemon_and_prepare_commit_msg_hook(real_git_repo, tmp_path, monkeypatch):
+    """The hook fills an empty message from the warm daemon, and gives up quietly when the daemon stalls."""
+    import asyncio
+    import socket
+    import subprocess
+    import sys
+    import threading
+    import time
+    import main
+
+    hook = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hooks", "prepare-commit-msg")
+    client = _FakeAsyncClient("feat: add feature flag")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: setattr(client, "model", model) or client)
+    sock = str(tmp_path / "d.sock")
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(main.main(["daemon", "--socket", sock, "--no-warmup", "-m", "coder"]))
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        loop.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+
+    def run_hook(socket_path, timeout="5"):
+        message_file = tmp_path / "COMMIT_EDITMSG"
+        message_file.write_text("\n# Please enter the commit message\n")
+        env = {**os.environ, "OCDG_SOCKET": socket_path, "OCDG_HOOK_TIMEOUT": timeout}
+        start = time.perf_counter()
+        subprocess.run([sys.executable, hook, str(message_file)], cwd=real_git_repo, env=env, check=True)
+        return message_file.read_text(), time.perf_counter() - start
+
+    try:
+        for _ in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.05)
+        with open(os.path.join(real_git_repo, "flags.py"), "w") as f:
+            f.write("FEATURE = True\n")
+        _git(real_git_repo, "add", "flags.py")
+        message, _ = run_hook(sock)
+        assert message.startswith("feat: add feature flag")
+        assert "# Please enter the commit message" in message
+        run_hook(sock)
+        assert client.calls == 1  # Second request served from the daemon's cache
+        assert client.model == "coder"  # The daemon serves -m, not the client's default model
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join(5)
+    assert not os.path.exists(sock)
+
+    stalled = str(tmp_path / "stalled.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(stalled)
+        server.listen()  # Accepts connections but never answers
+        message, elapsed = run_hook(stalled, timeout="0.5")
+    assert message == "\n# Please enter the commit message\n"
+    assert elapsed < 3
+
+
+def test_multi_ref_generate_and_rewrite(real_git_repo, tmp_path, monkeypatch):
+    """Branches and tags are enumerated as a union, generated once per commit and rewritten in one pass."""
+    import asyncio
+    import main
+
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    monkeypatch.chdir(tmp_path)  # The rewrite appends to the relative COMMIT_MESSAGES_LOG_FILE
+    _commit_file(real_git_repo, "shared.py", "s = 1\n", "shared")
+    _git(real_git_repo, "tag", "-a", "v1", "-m", "release v1")
+    _git(real_git_repo, "checkout", "-q", "-b", "feature")
+    _commit_file(real_git_repo, "feature.py", "f = 1\n", "feature work")
+    _git(real_git_repo, "tag", "light")
+    _git(real_git_repo, "checkout", "-q", "main")
+    _commit_file(real_git_repo, "main.py", "m = 1\n", "main work")
+    count = lambda: _git(real_git_repo, "rev-list", "--count", "--branches", "--tags")
+    assert count() == "4"
+
+    client = _FakeAsyncClient("feat: reworded")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: client)
+    message_map = str(tmp_path / "messages.jsonl")
+    refs = ["--refs", "refs/heads", "--refs", "refs/tags"]
+    asyncio.run(main.main(["generate", real_git_repo, "--message-map", message_map, *refs]))
+    assert client.calls == 3  # shared, feature work, main work; the root commit is trivial
+
+    rewritten = asyncio.run(main.main(["apply", real_git_repo, "--message-map", message_map, *refs]))
+    assert len(rewritten) == 4
+    assert count() == "4"  # Shared history stayed shared
+    assert _git(real_git_repo, "merge-base", "main", "feature") == _git(real_git_repo, "rev-parse", "v1^{commit}")
+    assert _git(real_git_repo, "log", "--format=%s", "-1", "v1") == "feat: reworded"
+    assert _git(real_git_repo, "cat-file", "-t", "v1") == "tag"
+    assert _git(real_git_repo, "tag", "-l", "--format=%(contents:subject)", "v1") == "release v1"
+    assert _git(real_git_repo, "rev-parse", "light") == _git(real_git_repo, "rev-parse", "feature")
+    assert _git(real_git_repo, "log", "--format=%s", "main~1..feature") == "feat: reworded"
+
+
+def test_force_push_leases_each_ref(real_git_repo, tmp_path):
+    """Branches and annotated tags are pushed leased to their pre-rewrite values; remote work blocks the push."""
+    remote = str(tmp_path / "origin.git")
+    _git(tmp_path, "init", "-q", "--bare", remote)
+    _git(real_git_repo, "remote", "add", "origin", remote)
+    target = _commit_file(real_git_repo, "a.py", "x = 1\n", "wip")
+    _git(real_git_repo, "tag", "-a", "v1", "-m", "release v1")
+    _git(real_git_repo, "push", "-q", "origin", "main", "v1")
+
+    def rewrite(title):
+        history = CommitHistory()
+        history.commits = [Commit(_git(real_git_repo, "rev-parse", "v1^{commit}"), "Test", "", "", repo=MagicMock())]
+        history.commits[0].new_message = title
+        updater = RepositoryUpdater(real_git_repo)
+        updater.rewrite_commit_messages(history, ["refs/heads", "refs/tags"])
+        return updater
+
+    rewrite("feat: add a").force_push(["refs/heads", "refs/tags"])
+    for ref in ("main", "v1"):
+        assert _git(remote, "rev-parse", ref) == _git(real_git_repo, "rev-parse", ref)
+    assert _git(remote, "log", "-1", "--format=%s", "v1") == "feat: add a"
+
+    _git(remote, "update-ref", "refs/heads/main", target)  # Someone else pushed meanwhile
+    with pytest.raises(git.GitCommandError):
+        rewrite("feat: add module a").force_push(["refs/heads", "refs/tags"])
+    assert _git(remote, "rev-parse", "main") == target
+    assert _git(remote, "rev-parse", "v1") != _git(real_git_repo, "rev-parse", "v1")  # --atomic: nothing moved
+
+    _git(real_git_repo, "checkout", "-q", "--detach")
+    rewrite("feat: detached").force_push()  # No HEAD:HEAD refspec; nothing to push
+    assert _git(remote, "rev-parse", "main") == target
+
+def test_calibrate_saves_profile(tmp_path, monkeypatch):
+    """The ladder stops at error onset; load_configuration picks up the saved profile."""
+    import asyncio
+    import main
+
+    class LimitedClient:
+        """Fails above 4 requests in flight or past 12000 prompt characters."""
+
+        def __init__(self):
+            self.in_flight = 0
+
+        async def async_generate_text(self, system_prompt, prompt, **kwargs):
+            self.in_flight += 1
+            try:
+                await asyncio.sleep(0.02)
+                if self.in_flight > 4 or len(prompt) > 12000:
+                    raise RuntimeError("overloaded")
+                return "{}"
+            finally:
+                self.in_flight -= 1
+
+    models = []
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: models.append(model) or LimitedClient())
+    profiles = str(tmp_path / "calibration.json")
+    profile = asyncio.run(main.main(["calibrate", "-l", "ollama", "-m", "tiny", "--output", profiles,
+                                     "--concurrency", "1,2,4,8", "--sizes", "1000,4000,8000,16000"]))
+    assert (profile["concurrency"], profile["chunk_size"]) == (4, 8000)
+    assert profile["error_onset"] == {"concurrency": 8, "size": 1000}
+    assert profile["timeout"] >= 10
+    assert len(profile["steps"]) == 4 + 3
+    assert models == ["tiny"]  # The ladder measured the model the profile is saved for
+
+    monkeypatch.setenv("OCDG_CALIBRATION_FILE", profiles)
+    config = load_configuration("ollama", "tiny")
+    assert (config["MAX_CONCURRENT_REQUESTS"], config["CHUNK_SIZE"]) == (4, 8000)
+    assert config["LLM_TIMEOUT"] == profile["timeout"]
+    assert load_configuration("ollama", "other")["CHUNK_SIZE"] is None  # Other models keep the defaults
+
+
+def test_budget_keeps_worst_messages_first(real_git_repo, tmp_path, monkeypatch):
+    """--plan predicts without the LLM; a token budget sends the worst messages first and stops cleanly."""
+    import asyncio
+    import main
+
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    subjects = ["feat(core): add configuration loader module\n\n- loads defaults", "wip", "fix",
+                "feat(parser): add tokenizer for nested blocks\n\n- handles quotes"]
+    for index, subject in enumerate(subjects):
+        _commit_file(real_git_repo, f"m{index}.py", "x = 1\n", subject)
+
+    plan = asyncio.run(main.main([real_git_repo, "--plan", "--token-budget", "1"]))
+    assert plan.splitlines()[0] == "5 commits, 4 need the LLM (1 predicted trivial)"
+    assert plan.splitlines()[2].split()[-1] == "0"  # Nothing fits one token
+
+    args = main.build_arg_parser().parse_args([real_git_repo])
+    per_commit = main.run_cost_model(args, load_configuration(args.llm, args.model)).estimate(len("x = 1\n")).tokens
+    client = _FakeAsyncClient("refactor: reworded")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: client)
+    message_map = str(tmp_path / "messages.jsonl")
+    asyncio.run(main.main(["generate", real_git_repo, "--message-map", message_map, "--priority", "worst",
+                           "--token-budget", str(int(per_commit * 2.5))]))
+    assert client.calls == 2
+    with open(message_map) as f:
+        generated = {json.loads(line)["message"] for line in f}
+    assert generated == {"wip", "fix", "initial"}  # The root commit is trivial and costs nothing
+
+
+def test_budget_reserves_commits_in_flight():
+    """Concurrently admitted commits hold their estimates, so they cannot all pass on the same recorded total."""
+    from planner import Budget, CostModel
+
+    model = CostModel("test", chunk_size=1000, concurrency=4, overhead_chars=0)
+    per_commit = model.estimate(100).tokens
+    budget = Budget(model, tokens=per_commit * 2)
+    budget.selected = 3
+    assert budget.admit(100) and budget.admit(100)
+    assert not budget.admit(100)  # Nothing recorded yet, but two commits are in flight
+    assert (budget.selected, budget.deferred) == (2, 1)
+    budget.release(100)
+    budget.release(100)
+    assert budget.reserved == 0
+
+
+def test_budget_time_and_predicted_size_match_the_run():
+    """admit compares wall time like select does; predictions drop the same sections filter_diff drops."""
+    from config import PLAN_SECONDS_PER_REQUEST
+    from diff_budget import FileStat
+    from planner import Budget, CostModel, predicted_diff_chars
+
+    model = CostModel("test", chunk_size=1000, concurrency=4, overhead_chars=0)
+    assert Budget(model, seconds=PLAN_SECONDS_PER_REQUEST / 2).admit(100)  # 1 request over 4 slots
+
+    conf = FileStat("app.conf", 3, 0, False, 0, 40)
+    diff = "diff --git a/app.conf b/app.conf\n--- /dev/null\n+++ b/app.conf\n+a = 1\n" \
+           "diff --git a/venv/lib.py b/venv/lib.py\n+x = 1\n"
+    assert "+a = 1" in filter_diff(diff) and "venv" not in filter_diff(diff)
+    assert predicted_diff_chars([conf, FileStat("venv/lib.py", 1, 0, False, 0, 6)]) == conf.estimated_bytes
+
+
+def test_incremental_watermark_waits_for_rewrite(real_git_repo, tmp_path, monkeypatch):
+    """A declined rewrite leaves the watermark alone; an accepted one moves it to the rewritten tip."""
+    import asyncio
+    import builtins
+    import main
+    from ref_snapshots import list_snapshots
+    from watermark import read_watermark
+
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    monkeypatch.chdir(tmp_path)  # The rewrite appends to the relative COMMIT_MESSAGES_LOG_FILE
+    original = _commit_file(real_git_repo, "a.py", "x = 1\n", "wip")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: _FakeAsyncClient("feat: add module"))
+
+    monkeypatch.setattr(builtins, "input", lambda prompt: "no")
+    asyncio.run(main.main([real_git_repo, "--incremental"]))
+    assert read_watermark(real_git_repo, "main") is None
+    assert list_snapshots(real_git_repo) == []  # Nothing moved, so nothing was snapshotted
+
+    monkeypatch.setattr(builtins, "input", lambda prompt: "yes")
+    asyncio.run(main.main([real_git_repo, "--incremental"]))
+    assert _git(real_git_repo, "log", "-1", "--format=%s") == "feat: add module"
+    assert read_watermark(real_git_repo, "main") == _git(real_git_repo, "rev-parse", "HEAD")
+
+    monkeypatch.setattr(builtins, "input", lambda prompt: "no")
+    asyncio.run(main.main([real_git_repo]))
+    asyncio.run(main.main([real_git_repo, "-r"]))  # The cancelled run took no snapshot to restore instead
+    assert _git(real_git_repo, "rev-parse", "HEAD") == original
+
+
+def test_apply_skips_other_repositories(real_git_repo, tmp_path, monkeypatch):
+    """A map holding several repositories only rewrites the entries written for the one being applied."""
+    import asyncio
+    import main
+    from message_map import read_message_map
+
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    monkeypatch.chdir(tmp_path)  # The rewrite appends to the relative COMMIT_MESSAGES_LOG_FILE
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "wip")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: _FakeAsyncClient("feat: add module"))
+    message_map = str(tmp_path / "messages.jsonl")
+    asyncio.run(main.main(["generate", real_git_repo, "--message-map", message_map]))
+    entries = list(read_message_map(message_map))
+    with open(message_map, "a") as f:  # Same hashes under another repository, e.g. a fork in the same batch
+        for entry in entries:
+            f.write(json.dumps(dict(entry, repo="git@example.com:x/fork.git", new_message="chore: wrong")) + "\n")
+
+    assert len(asyncio.run(main.main(["apply", real_git_repo, "--message-map", message_map]))) == 2
+    assert _git(real_git_repo, "log", "--format=%s") == "\n".join(entry["new_message"].splitlines()[0]
+                                                                  for entry in entries)
+
+
+def test_generate_apply_incremental(real_git_repo, tmp_path, monkeypatch):
+    """'generate --incremental' moves the watermark and 'apply' carries it onto the rewritten history."""
+    import asyncio
+    import main
+    from watermark import read_watermark
+
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    monkeypatch.chdir(tmp_path)  # The rewrite appends to the relative COMMIT_MESSAGES_LOG_FILE
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "wip")
+    client = _FakeAsyncClient("feat: add module")
+    monkeypatch.setattr(main, "create_client", lambda llm, config, model=None: client)
+    message_map = str(tmp_path / "messages.jsonl")
+
+    asyncio.run(main.main(["generate", real_git_repo, "--incremental", "--message-map", message_map]))
+    assert read_watermark(real_git_repo, "main") == _git(real_git_repo, "rev-parse", "HEAD")
+    asyncio.run(main.main(["apply", real_git_repo, "--message-map", message_map]))
+    assert read_watermark(real_git_repo, "main") == _git(real_git_repo, "rev-parse", "HEAD")
+
+    calls = client.calls
+    asyncio.run(main.main(["generate", real_git_repo, "--incremental", "--message-map", message_map]))
+    assert client.calls == calls  # Nothing new since the rewrite
+
+
+def test_clients_use_the_requested_model(real_git_repo, tmp_path, monkeypatch):
+    """Clients send to -m (else the provider default); cascade escalations go to -m, not the client default."""
+    import asyncio
+    import main
+    from clients.ollama_client import OllamaClient
+
+    models = []
+
+    async def generate(self, system_prompt, prompt, **kwargs):
+        models.append(self.model)
+        title = "Added a module" if self.model == "tiny" else "feat: add module"
+        return json.dumps({"short_analysis": "analysis", "new_commit_title": title,
+                           "new_detailed_commit_message": "- details"})
+
+    monkeypatch.setattr(OllamaClient, "async_generate_text", generate)
+    _git(real_git_repo, "remote", "add", "origin", "git@example.com:x/y.git")
+    _commit_file(real_git_repo, "a.py", "x = 1\n", "wip")
+    message_map = str(tmp_path / "messages.jsonl")
+
+    asyncio.run(main.main(["generate", real_git_repo, "--message-map", message_map]))
+    assert models == ["llama3"]
+    models.clear()
+    asyncio.run(main.main(["generate", real_git_repo, "--message-map", message_map, "-m", "big",
+                           "--small-model", "tiny"]))
+    assert models == ["tiny", "big"]  # The small model's title is not conventional, so it escalates
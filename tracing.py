@@ -0,0 +1,103 @@
+import json
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+# The innermost open span and its commit, per asyncio task
+_current_span: ContextVar[Optional[dict]] = ContextVar("ocdg_current_span", default=None)
+_current_commit: ContextVar[Optional[str]] = ContextVar("ocdg_current_commit", default=None)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Tracer:
+    """Span-style stage timings written as JSONL, with an end-of-run summary."""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_file = None
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.commit_durations: Dict[str, float] = {}
+
+    def configure(self, trace_path: Optional[str]):
+        """Enables tracing. Spans are appended to trace_path when given, otherwise only summarized."""
+        self.enabled = True
+        if trace_path:
+            self.trace_file = open(trace_path, "a", buffering=1)
+            logger.info(f"Writing trace spans to {trace_path}")
+
+    def close(self):
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+
+    @contextmanager
+    def span(self, stage: str, commit: Optional[str] = None, **attributes):
+        """
+        Times a pipeline stage. Yields the span record so callers can attach attributes
+        (sizes, attempts, cache hits); nested code can use add() on the innermost span.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        record = {"stage": stage, "commit": commit or _current_commit.get(), **attributes}
+        commit_token = _current_commit.set(record["commit"])
+        span_token = _current_span.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            _current_span.reset(span_token)
+            _current_commit.reset(commit_token)
+            self._finish(record)
+
+    def add(self, key: str, amount: int = 1):
+        """Increments a counter attribute on the innermost open span, if any."""
+        record = _current_span.get()
+        if record is not None:
+            record[key] = record.get(key, 0) + amount
+
+    def event(self, stage: str, commit: Optional[str] = None, **attributes):
+        """Records a zero-duration span, e.g. a cache hit."""
+        with self.span(stage, commit, **attributes):
+            pass
+
+    def _finish(self, record: dict):
+        self.durations[record["stage"]].append(record["duration_ms"])
+        if record["stage"] == "commit" and record["commit"]:
+            self.commit_durations[record["commit"]] = record["duration_ms"]
+        if self.trace_file:
+            record = {"ts": datetime.now().isoformat(), **record}
+            self.trace_file.write(json.dumps(record, default=str) + "\n")
+
+    def summary_table(self, slowest: int = 5) -> str:
+        """Per-stage count/p50/p95/max/total in milliseconds, plus the slowest commits."""
+        lines = [f"{'stage':<16}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}{'total s':>10}"]
+        for stage, values in sorted(self.durations.items()):
+            values = sorted(values)
+            lines.append(
+                f"{stage:<16}{len(values):>8}{percentile(values, 50):>12.1f}{percentile(values, 95):>12.1f}"
+                f"{values[-1]:>12.1f}{sum(values) / 1000:>10.2f}"
+            )
+        if self.commit_durations:
+            lines.append("slowest commits:")
+            ranked = sorted(self.commit_durations.items(), key=lambda item: item[1], reverse=True)
+            lines += [f"  {commit_hash}  {duration:.1f} ms" for commit_hash, duration in ranked[:slowest]]
+        return "\n".join(lines)
+
+
+tracer = Tracer()
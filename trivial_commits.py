@@ -0,0 +1,165 @@
+import re
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from config import TRIVIAL_COMMIT_RULES, LOCKFILE_PATTERNS, VERSION_FILE_PATTERNS, VERSION_LINE_PATTERN
+from diff_budget import OMITTED_PATCH_MARKER
+
+
+class DiffFile:
+    """A single file section of a unified git diff."""
+
+    def __init__(self, old_path: str, new_path: str):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.renamed = False
+        self.binary = False
+        self.omitted = False  # Patch replaced by a summary line; its changed lines are unknown
+        self.added: List[str] = []
+        self.removed: List[str] = []
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path
+
+
+def split_diff_files(diff: str) -> List[DiffFile]:
+    """Parses a unified git diff into per-file sections with added/removed lines."""
+    files: List[DiffFile] = []
+    current = None
+    for line in diff.splitlines():
+        if line.startswith('diff --git '):
+            match = re.match(r'diff --git a/(.*) b/(.*)$', line)
+            old_path, new_path = match.groups() if match else ('', '')
+            current = DiffFile(old_path, new_path)
+            files.append(current)
+        elif current is None:
+            continue
+        elif line.startswith('rename from ') or line.startswith('rename to '):
+            current.renamed = True
+        elif line.startswith('Binary files ') or line.startswith('GIT binary patch'):
+            current.binary = True
+        elif line.startswith(OMITTED_PATCH_MARKER):
+            current.omitted = True
+        elif line.startswith('+++ ') or line.startswith('--- '):
+            continue
+        elif line.startswith('+'):
+            current.added.append(line[1:])
+        elif line.startswith('-'):
+            current.removed.append(line[1:])
+    return files
+
+
+def _matches_any(path: str, patterns) -> bool:
+    return any(re.search(pattern, path) for pattern in patterns)
+
+
+def _file_list(files: List[DiffFile]) -> str:
+    return "\n".join(f"- {file.path}" for file in files)
+
+
+def _classify_merge(message, files, parents, **_) -> Optional[str]:
+    if not parents or len(parents) < 2:
+        return None
+    subject = message.strip().splitlines()[0] if message.strip() else "merge commit"
+    return f"chore: {subject[0].lower()}{subject[1:]}"
+
+
+def _classify_empty(message, files, filtered_diff, is_initial, **_) -> Optional[str]:
+    if filtered_diff.strip():
+        return None
+    if is_initial:
+        return "chore: initial commit"
+    if not files:
+        return "chore: empty commit"
+    return f"chore: update {len(files)} non-source file(s)\n\n{_file_list(files)}"
+
+
+def _classify_lockfile(message, files, **_) -> Optional[str]:
+    if not files or not all(_matches_any(file.path, LOCKFILE_PATTERNS) for file in files):
+        return None
+    names = ", ".join(sorted({file.path.rsplit('/', 1)[-1] for file in files}))
+    return f"chore(deps): update {names}"
+
+
+def _classify_version_bump(message, files, **_) -> Optional[str]:
+    if not files or not all(_matches_any(file.path, VERSION_FILE_PATTERNS) for file in files):
+        return None
+    changed = [line for file in files for line in file.added + file.removed if line.strip()]
+    if not changed or not all(re.search(VERSION_LINE_PATTERN, line) for line in changed):
+        return None
+    added = [line for file in files for line in file.added if line.strip()]
+    version = re.search(r'\d+(?:\.\d+)+[\w.+-]*', added[0]) if added else None
+    if version:
+        return f"chore(release): bump version to {version.group(0)}"
+    return "chore(release): bump version"
+
+
+def _classify_rename(message, files, **_) -> Optional[str]:
+    if not files or not all(file.renamed and not file.added and not file.removed for file in files):
+        return None
+    if len(files) == 1:
+        return f"refactor: rename {files[0].old_path} to {files[0].new_path}"
+    renames = "\n".join(f"- {file.old_path} -> {file.new_path}" for file in files)
+    return f"refactor: rename {len(files)} files\n\n{renames}"
+
+
+_TOKEN_RE = re.compile(r'\w+|\S')  # Words and single symbols: "x=1" and "x = 1" match, "return x" and "returnx" don't
+
+
+def _classify_whitespace(message, files, **_) -> Optional[str]:
+    changed = [file for file in files if file.added or file.removed]
+    if not changed or any(file.binary for file in files):
+        return None
+    for file in changed:
+        if _TOKEN_RE.findall("\n".join(file.removed)) != _TOKEN_RE.findall("\n".join(file.added)):
+            return None
+    return f"style: fix whitespace and formatting\n\n{_file_list(changed)}"
+
+
+# Rules that judge the changed lines; they cannot vouch for a commit with an omitted patch.
+LINE_RULES = ('version_bump', 'rename', 'whitespace')
+
+# Evaluated in order; the first rule that matches wins.
+TRIVIAL_RULES = {
+    'merge': _classify_merge,
+    'empty': _classify_empty,
+    'lockfile': _classify_lockfile,
+    'version_bump': _classify_version_bump,
+    'rename': _classify_rename,
+    'whitespace': _classify_whitespace,
+}
+
+
+def classify_trivial_commit(
+    diff: str,
+    filtered_diff: str,
+    message: str = "",
+    parents: Optional[List[str]] = None,
+    is_initial: bool = False,
+    rules=TRIVIAL_COMMIT_RULES,
+) -> Optional[Tuple[str, str]]:
+    """
+    Detects commits that do not need an LLM and builds a deterministic Conventional Commit message.
+
+    Returns (rule_name, new_message) for the first matching enabled rule, or None. When the diff
+    budget replaced a file's patch with a summary, only rules that need no changed lines apply.
+    """
+    files = split_diff_files(diff)
+    omitted = any(file.omitted for file in files)
+    for name, rule in TRIVIAL_RULES.items():
+        if name not in rules or (omitted and name in LINE_RULES):
+            continue
+        new_message = rule(
+            message=message,
+            files=files,
+            filtered_diff=filtered_diff,
+            parents=parents,
+            is_initial=is_initial,
+        )
+        if new_message:
+            logger.debug(f"Trivial commit rule '{name}' matched.")
+            return name, new_message
+    return None
+
@@ -0,0 +1,76 @@
+import subprocess
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+WATERMARK_REF_PREFIX = "refs/ocdg/watermark/"  # Not under refs/heads or refs/tags, so never pushed or fetched
+
+
+def _git(args: List[str], cwd: str, input: str = None) -> subprocess.CompletedProcess:
+    logger.debug(f"Running git command: git {' '.join(args)}")
+    return subprocess.run(["git", *args], cwd=cwd, input=input, capture_output=True, text=True)
+
+
+def current_branch(repo_path: str) -> str:
+    """The checked-out branch, or "HEAD" when detached."""
+    result = _git(["symbolic-ref", "--quiet", "--short", "HEAD"], repo_path)
+    return result.stdout.strip() if result.returncode == 0 else "HEAD"
+
+
+def read_watermark(repo_path: str, branch: str) -> Optional[str]:
+    """The last commit fully processed on `branch`, if any."""
+    result = _git(["rev-parse", "--verify", "--quiet", f"{WATERMARK_REF_PREFIX}{branch}^{{commit}}"], repo_path)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def write_watermark(repo_path: str, branch: str, commit_hash: str):
+    result = _git(["update-ref", "-m", f"ocdg: processed up to {commit_hash}",
+                   f"{WATERMARK_REF_PREFIX}{branch}", commit_hash], repo_path)
+    if result.returncode != 0:
+        raise RuntimeError(f"Git command failed: {result.stderr.strip()}")
+    logger.info(f"Watermark for '{branch}' moved to {commit_hash}")
+
+
+def remap_watermarks(repo_path: str, rewritten: Dict[str, str]) -> int:
+    """
+    Moves every watermark that points at a rewritten commit onto its new hash; returns how many moved.
+
+    Without this, a watermark left on the pre-rewrite tip is no longer an ancestor of the branch,
+    and the next --incremental run would reprocess everything after the merge base.
+    """
+    if not rewritten:
+        return 0
+    listed = _git(["for-each-ref", "--format=%(refname) %(objectname)", WATERMARK_REF_PREFIX], repo_path)
+    updates = [f"update {refname} {rewritten[value]} {value}\n"
+               for refname, value in (line.split(" ") for line in listed.stdout.splitlines()) if value in rewritten]
+    if not updates:
+        return 0
+    result = _git(["update-ref", "-m", "ocdg: follow rewritten history", "--stdin"], repo_path, "".join(updates))
+    if result.returncode != 0:
+        raise RuntimeError(f"Git command failed: {result.stderr.strip()}")
+    logger.info(f"Moved {len(updates)} watermark(s) onto the rewritten history")
+    return len(updates)
+
+
+def incremental_range(repo_path: str, branch: str, tip: str) -> Optional[str]:
+    """
+    Revision range of the commits on `tip` not processed yet, or None for the whole history.
+
+    Normally `watermark..tip`. If the history was rewritten so the watermark is no longer
+    an ancestor of `tip`, everything after their merge base is treated as new; with no
+    common history at all, the whole branch is processed again.
+    """
+    watermark = read_watermark(repo_path, branch)
+    if watermark is None:
+        logger.info(f"No watermark for '{branch}'; processing the full history")
+        return None
+    if _git(["merge-base", "--is-ancestor", watermark, tip], repo_path).returncode == 0:
+        return f"{watermark}..{tip}"
+    merge_base = _git(["merge-base", watermark, tip], repo_path)
+    if merge_base.returncode == 0 and merge_base.stdout.strip():
+        base = merge_base.stdout.strip()
+        logger.warning(f"History of '{branch}' was rewritten after watermark {watermark}; "
+                       f"reprocessing everything after the common ancestor {base}")
+        return f"{base}..{tip}"
+    logger.warning(f"Watermark {watermark} shares no history with '{branch}'; processing the full history")
+    return None